@@ -0,0 +1,304 @@
+"""Approximate nearest-neighbour search for large face galleries"""
+import os
+import threading
+import uuid
+import numpy as np
+from typing import Callable, List, Optional, Tuple
+from .matcher import GallerySearch, normalize_embeddings, top_k_from_scores
+from ..core.config import settings
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu is optional
+    faiss = None
+
+def default_nlist(n: int) -> int:
+    """Number of inverted lists: ~4*sqrt(N), with at least ~39 points per list"""
+    return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+def _temp_path(path: str, suffix: str) -> str:
+    # Every worker saves on shutdown; each writes its own temp file before the atomic replace
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}{suffix}"
+
+def _remove_quietly(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+class IVFFlatIndex:
+    """Inverted-file index with a spherical k-means coarse quantizer (NumPy)
+
+    Vectors are stored unquantized in per-list arrays; a probe scans only the
+    nprobe lists whose centroids are closest. Each list is one (ids, vectors)
+    tuple replaced by a single assignment on write, so searches running
+    concurrently always see ids and vectors of the same version of a list.
+    Writers must not run concurrently with each other.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, dim: int, nlist: int = 1, nprobe: int = 8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._id_to_list = {}
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return len(self._id_to_list)
+
+    def train(self, vectors: np.ndarray, iterations: int = 10, seed: int = 0) -> None:
+        vectors = normalize_embeddings(vectors)
+        rng = np.random.default_rng(seed)
+        n = vectors.shape[0]
+        self.nlist = max(1, min(self.nlist, n))
+        sample = vectors[rng.choice(n, min(n, self.nlist * 64), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            present, starts = np.unique(assign[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[present] = sums
+            empty = np.setdiff1d(np.arange(self.nlist), present)
+            if empty.size:
+                centroids[empty] = sample[rng.choice(sample.shape[0], empty.size, replace=False)]
+            centroids = normalize_embeddings(centroids)
+        self.centroids = centroids
+        self._lists = [self._empty_list() for _ in range(self.nlist)]
+        self._id_to_list = {}
+
+    def _empty_list(self) -> Tuple[np.ndarray, np.ndarray]:
+        return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        vectors = normalize_embeddings(vectors)
+        self.remove(ids)
+        assign = np.argmax(vectors @ self.centroids.T, axis=1)
+        for list_no in np.unique(assign).tolist():
+            members = assign == list_no
+            list_ids, list_vectors = self._lists[list_no]
+            self._lists[list_no] = (
+                np.concatenate([list_ids, ids[members]]),
+                np.vstack([list_vectors, vectors[members]]),
+            )
+            for vid in ids[members].tolist():
+                self._id_to_list[vid] = list_no
+
+    def remove(self, ids) -> None:
+        touched = {}
+        for vid in np.asarray(ids, dtype=np.int64).ravel().tolist():
+            list_no = self._id_to_list.pop(vid, None)
+            if list_no is not None:
+                touched.setdefault(list_no, []).append(vid)
+        for list_no, removed in touched.items():
+            list_ids, list_vectors = self._lists[list_no]
+            keep = ~np.isin(list_ids, removed)
+            self._lists[list_no] = (list_ids[keep], list_vectors[keep])
+
+    def ids(self) -> np.ndarray:
+        return np.fromiter(self._id_to_list.keys(), dtype=np.int64, count=len(self._id_to_list))
+
+    def vector(self, vid: int) -> Optional[np.ndarray]:
+        list_no = self._id_to_list.get(int(vid))
+        if list_no is None:
+            return None
+        list_ids, list_vectors = self._lists[list_no]
+        rows = list_vectors[list_ids == vid]
+        return rows[0] if rows.shape[0] else None
+
+    def search(self, probe: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probe = normalize_embeddings(np.asarray(probe).ravel())[0]
+        nprobe = min(self.nprobe, self.nlist)
+        lists = np.argpartition(-(self.centroids @ probe), nprobe - 1)[:nprobe]
+        probed = [self._lists[i] for i in lists.tolist()]
+        ids = np.concatenate([list_ids for list_ids, _ in probed])
+        if not ids.size:
+            return ids, np.empty(0, dtype=np.float32)
+        scores = np.vstack([list_vectors for _, list_vectors in probed]) @ probe
+        top = top_k_from_scores(ids, scores, k)
+        return np.array([t[0] for t in top], dtype=np.int64), np.array([t[1] for t in top], dtype=np.float32)
+
+    def save(self, path: str) -> None:
+        lists = list(self._lists)
+        ids = np.concatenate([l[0] for l in lists]) if lists else np.empty(0, dtype=np.int64)
+        vectors = np.vstack([l[1] for l in lists]) if lists else np.empty((0, self.dim), dtype=np.float32)
+        tmp_path = _temp_path(path, ".tmp.npz")
+        try:
+            np.savez(tmp_path, centroids=self.centroids, ids=ids, vectors=vectors, nprobe=self.nprobe)
+            os.replace(tmp_path, path)
+        except Exception:
+            _remove_quietly(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "IVFFlatIndex":
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            index = cls(centroids.shape[1], centroids.shape[0], int(data["nprobe"]))
+            index.centroids = centroids
+            index._lists = [index._empty_list() for _ in range(index.nlist)]
+            if data["ids"].size:
+                index.add(data["ids"], data["vectors"])
+        return index
+
+class FaissIVFIndex:
+    """faiss-cpu IndexIVFFlat (inner product) with the same interface"""
+
+    backend = "faiss"
+
+    def __init__(self, dim: int, nlist: int = 1, nprobe: int = 8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._index = None
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+    @property
+    def trained(self) -> bool:
+        return self._index is not None and self._index.is_trained
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def train(self, vectors: np.ndarray, iterations: int = 10, seed: int = 0) -> None:
+        vectors = normalize_embeddings(vectors)
+        self.nlist = max(1, min(self.nlist, vectors.shape[0]))
+        quantizer = faiss.IndexFlatIP(self.dim)
+        index = faiss.IndexIVFFlat(quantizer, self.dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+        index.cp.niter = iterations
+        index.cp.seed = seed
+        index.train(vectors)
+        index.nprobe = self.nprobe
+        with self._lock:
+            # Keep the quantizer alive for as long as the IVF index references it
+            self._quantizer = quantizer
+            self._index = index
+            self._vectors = {}
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        vectors = normalize_embeddings(vectors)
+        with self._lock:
+            self._index.remove_ids(ids)
+            self._index.add_with_ids(vectors, ids)
+            for vid, vector in zip(ids.tolist(), vectors):
+                self._vectors[vid] = vector
+
+    def remove(self, ids) -> None:
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        with self._lock:
+            self._index.remove_ids(ids)
+            for vid in ids.tolist():
+                self._vectors.pop(vid, None)
+
+    def ids(self) -> np.ndarray:
+        return np.fromiter(self._vectors.keys(), dtype=np.int64, count=len(self._vectors))
+
+    def vector(self, vid: int) -> Optional[np.ndarray]:
+        return self._vectors.get(int(vid))
+
+    def search(self, probe: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probe = normalize_embeddings(np.asarray(probe).ravel())
+        with self._lock:
+            scores, ids = self._index.search(probe, k)
+        valid = ids[0] >= 0
+        return ids[0][valid], scores[0][valid]
+
+    def save(self, path: str) -> None:
+        tmp_path = _temp_path(path, ".tmp")
+        try:
+            with self._lock:
+                faiss.write_index(self._index, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            _remove_quietly(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "FaissIVFIndex":
+        raw = faiss.read_index(path)
+        index = cls(raw.d, raw.nlist, settings.ann_nprobe)
+        raw.nprobe = index.nprobe
+        index._index = raw
+        return index
+
+def create_ann_index(dim: int, n: int):
+    """Create an untrained ANN engine for the configured backend"""
+    backend = settings.ann_backend
+    if backend == "faiss" and faiss is None:
+        print("[ANN] faiss-cpu is not installed; falling back to the NumPy IVF index")
+        backend = "numpy"
+    cls = FaissIVFIndex if backend == "faiss" else IVFFlatIndex
+    return cls(dim, default_nlist(n), settings.ann_nprobe)
+
+def load_ann_index(path: str):
+    """Load a persisted ANN engine, or None if it is missing or unusable"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        if path.endswith(".npz"):
+            return IVFFlatIndex.load(path)
+        if faiss is not None:
+            return FaissIVFIndex.load(path)
+    except Exception as e:
+        print(f"[ANN] Ignoring unreadable index at {path}: {e}")
+    return None
+
+class AnnGallery(GallerySearch):
+    """Matcher backed by an ANN engine with an exact float32 re-rank stage
+
+    The engine proposes k * rerank_factor candidates; those are rescored
+    exactly against their stored float32 templates before top-k selection.
+    An optional id filter restricts results to a scope (e.g. one organization):
+    the candidate list is widened until k ids survive it, and ``exact`` (an
+    exhaustive matcher for the scope) answers when the engine runs out.
+    """
+
+    def __init__(
+        self,
+        engine,
+        size: int,
+        vectors_for: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]],
+        id_filter: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+        rerank_factor: Optional[int] = None,
+        exact: Optional[Callable[[], GallerySearch]] = None,
+    ):
+        self.engine = engine
+        self.size = size
+        self.vectors_for = vectors_for
+        self.id_filter = id_filter
+        self.exact = exact
+        self.rerank_factor = rerank_factor or settings.ann_rerank_factor
+
+    def __len__(self) -> int:
+        return self.size
+
+    def search(self, target_embedding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        if k <= 0 or not self.size:
+            return []
+        wanted = min(k, self.size)
+        fetch = max(k, 2) * self.rerank_factor
+        while True:
+            ids, _ = self.engine.search(target_embedding, fetch)
+            exhausted = ids.size < fetch or fetch >= len(self.engine)
+            if self.id_filter is None or not ids.size:
+                break
+            ids = ids[self.id_filter(ids)]
+            if ids.size >= wanted or exhausted:
+                break
+            fetch *= 4
+        if self.id_filter is not None and ids.size < wanted and self.exact is not None:
+            # The probed lists hold too few of this scope's faces: scan the scope exactly
+            return self.exact().search(target_embedding, k)
+        if not ids.size:
+            return []
+        ids, matrix = self.vectors_for(ids)
+        probe = normalize_embeddings(np.asarray(target_embedding).ravel())[0]
+        return top_k_from_scores(ids, matrix @ probe, k)
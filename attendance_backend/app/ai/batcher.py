@@ -0,0 +1,76 @@
+"""Micro-batching of recognition calls across concurrent requests"""
+import asyncio
+import numpy as np
+from typing import List, Optional
+from .insightface_model import face_model
+from .inference_executor import inference_executor
+from ..core.config import settings
+
+class RecognitionBatcher:
+    """Coalesce aligned face crops from concurrent requests into batched calls
+
+    The first crop to arrive opens a batch; it is flushed once max_batch
+    crops are waiting or max_wait_ms has elapsed, whichever comes first.
+    The batched ONNX call runs on the inference executor and each waiting
+    request receives its own row of the output.
+    """
+
+    def __init__(self, max_batch: Optional[int] = None, max_wait_ms: Optional[float] = None, embed_fn=None):
+        self.max_batch = max_batch or settings.recognition_max_batch
+        self.max_wait_ms = settings.recognition_max_wait_ms if max_wait_ms is None else max_wait_ms
+        self.embed_fn = embed_fn or face_model.embed_crops
+        self._pending = []  # (crop, future)
+        self._timer = None
+        self.batches = 0
+        self.faces = 0
+
+    async def embed(self, crop: np.ndarray) -> np.ndarray:
+        """Embedding (raw model output) for one aligned crop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((crop, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    async def embed_many(self, crops: List[np.ndarray]) -> np.ndarray:
+        """Embeddings for several crops of one request (they share batches with others)"""
+        if not crops:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(await asyncio.gather(*[self.embed(crop) for crop in crops]))
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch) -> None:
+        try:
+            features = await inference_executor.run(self.embed_fn, [crop for crop, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.faces += len(batch)
+        for (_, future), feature in zip(batch, features):
+            if not future.done():
+                future.set_result(np.asarray(feature).ravel())
+
+    def metrics(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self.batches,
+            "faces": self.faces,
+            "mean_batch_size": round(self.faces / self.batches, 2) if self.batches else 0.0,
+        }
+
+# Global singleton instance
+recognition_batcher = RecognitionBatcher()
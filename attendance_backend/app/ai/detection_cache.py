@@ -0,0 +1,151 @@
+"""Short-lived cache of /face/detect results, addressed by an opaque token"""
+import os
+import re
+import secrets
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from .validator import FaceAnalysisResult
+from ..core.config import settings
+
+_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+_OWNER = struct.Struct("<q")
+
+class CachedDetection:
+    """A decoded upload and its face analysis, reusable by one later verify/register
+
+    ``analysis`` is None when the token was created by another worker: only
+    the upload bytes are shared, so the redeeming worker decodes them again.
+    """
+
+    def __init__(self, user_id: int, image_data: bytes, analysis: Optional[FaceAnalysisResult]):
+        self.user_id = user_id
+        self.image_data = image_data  # original bytes (registration saves them as the photo)
+        self.analysis = analysis
+        self.created = time.monotonic()
+
+class DetectionCache:
+    """Bounded, TTL-expiring token -> CachedDetection map
+
+    Tokens are single use and bound to the user who ran the detection. The
+    oldest entries are evicted first when ``max_entries`` is reached.
+
+    With ``shared_dir`` (multiple workers) the upload bytes are also written
+    to ``<shared_dir>/<token>``, so a token can be redeemed on any worker.
+    Redeeming renames that file away first, which keeps tokens single use
+    across processes.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, shared_dir: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.shared_dir = shared_dir
+        self._entries: "OrderedDict[str, CachedDetection]" = OrderedDict()
+        self._lock = threading.Lock()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            token, entry = next(iter(self._entries.items()))
+            if now - entry.created < self.ttl_seconds:
+                break
+            del self._entries[token]
+
+    def put(self, entry: CachedDetection) -> str:
+        token = secrets.token_urlsafe(16)
+        if self.shared_dir:
+            self._share(token, entry)
+        with self._lock:
+            self._expire(time.monotonic())
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[token] = entry
+        return token
+
+    def take(self, token: str, user_id: int) -> Optional[CachedDetection]:
+        """Remove and return a live entry created by this user (None if unknown or expired)"""
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get(token)
+            if entry is not None and entry.user_id != user_id:
+                return None
+            if not self.shared_dir:
+                if entry is not None:
+                    del self._entries[token]
+                return entry
+            self._entries.pop(token, None)
+        shared = self._take_shared(token, user_id)
+        if shared is None:
+            return None  # unknown, expired, another user's, or already redeemed on another worker
+        return entry or shared
+
+    def _path(self, token: str) -> str:
+        return os.path.join(self.shared_dir, token)
+
+    def _share(self, token: str, entry: CachedDetection) -> None:
+        self._remove_expired_files()
+        tmp_path = f"{self._path(token)}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_OWNER.pack(entry.user_id))
+                f.write(entry.image_data)
+            os.replace(tmp_path, self._path(token))
+        except OSError as e:
+            print(f"[Detect] Cannot share detection token: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _take_shared(self, token: str, user_id: int) -> Optional[CachedDetection]:
+        if not _TOKEN_PATTERN.match(token):
+            return None
+        path = self._path(token)
+        claimed = f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.taken"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        try:
+            if time.time() - os.path.getmtime(claimed) >= self.ttl_seconds:
+                os.remove(claimed)
+                return None
+            with open(claimed, "rb") as f:
+                (owner,) = _OWNER.unpack(f.read(_OWNER.size))
+                if owner != user_id:
+                    # Not this user's token: put it back for its owner
+                    os.rename(claimed, path)
+                    return None
+                image_data = f.read()
+            os.remove(claimed)
+        except (OSError, struct.error):
+            if os.path.exists(claimed):
+                os.remove(claimed)
+            return None
+        return CachedDetection(owner, image_data, None)
+
+    def _remove_expired_files(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            names = os.listdir(self.shared_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.shared_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass  # redeemed or removed by another worker meanwhile
+
+def _shared_dir() -> Optional[str]:
+    # Workers that share a gallery directory share detection tokens too
+    return os.path.join(settings.gallery_shared_dir, "detections") if settings.gallery_shared_dir else None
+
+# Global singleton instance
+detection_cache = DetectionCache(settings.detection_token_ttl_seconds, settings.detection_cache_max_entries, _shared_dir())
@@ -1,37 +1,268 @@
 """Generate face embeddings"""
+import cv2
 import numpy as np
 import json
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
+from insightface.utils import face_align
 from .insightface_model import face_model
+from .inference_executor import inference_executor
+from .batcher import recognition_batcher
+from .profiles import get_profile
+from .validator import FaceAnalysisResult, analyze_image, single_face_error, check_quality_gate
+from ..core.config import settings
+from ..utils.image_utils import decode_image
+from ..utils.embedding_blob import normalize_embedding, embedding_to_blob, read_blob_header, embedding_from_blob
 
-def generate_embedding(image: np.ndarray) -> Tuple[Optional[str], str]:
+
+def generate_embedding(image: np.ndarray, face_policy: Optional[str] = None) -> Tuple[Optional[np.ndarray], str]:
     """Generate face embedding from image
-    
+
+    Detection runs first; recognition runs only on the selected face.
+    ``face_policy`` "largest" or "central" keeps one face when several are
+    visible instead of rejecting the image (default: the enrollment profile's).
+
+    Returns:
+        Tuple[embedding, message]: (L2-normalized float32 embedding, status message)
+    """
+    try:
+        analysis = analyze_image(image, "enroll-quality", face_policy=face_policy)
+        index, error = _select_and_gate(analysis)
+        if error:
+            return None, error
+        return normalize_embedding(analysis.embedding(index)), "Face embedding generated successfully"
+
+    except Exception as e:
+        return None, f"Error generating embedding: {str(e)}"
+
+def _decode_upload(image_data: bytes, max_size: int = 1024) -> Tuple[Optional[np.ndarray], str, float]:
+    """Validate and decode an upload to a working-size RGB image
+
+    Returns:
+        Tuple[image, message, scale] where scale is original pixels per working pixel
+    """
+    return decode_image(image_data, max_size=max_size)
+
+def _select_and_gate(analysis: FaceAnalysisResult, profile: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
+    """Pick the face under the face policy, then apply the profile's quality gate
+
+    An analysis that kept every face (e.g. a /face/detect token) follows the
+    consuming profile's policy, so a verify token with bystanders still
+    selects the largest face.
+    """
+    profile = profile or analysis.profile
+    face_policy = analysis.face_policy if analysis.face_policy != "all" else get_profile(profile).face_policy
+    index = analysis.select_face(face_policy)
+    if index is None:
+        return None, single_face_error(analysis)
+    return index, check_quality_gate(analysis, index, profile)
+
+def _gated_crop(analysis: FaceAnalysisResult, profile: Optional[str] = None) -> Tuple[Optional[np.ndarray], str]:
+    """Aligned crop of the selected face, unless it fails the profile's quality gate"""
+    index, error = _select_and_gate(analysis, profile)
+    if error:
+        return None, error
+    return analysis.aligned_crop(index), "Face detected"
+
+def _align_single(image: np.ndarray, profile: str) -> Tuple[Optional[np.ndarray], str]:
+    return _gated_crop(analyze_image(image, profile))
+
+def align_single_face(image_data: bytes, profile: str = "verify-fast") -> Tuple[Optional[np.ndarray], str]:
+    """Validate, decode, detect and align the single face in an upload
+
+    Only the detector runs here (blocking; services call it through the
+    inference executor). Recognition of the returned crop is batched with
+    other requests by the recognition batcher.
+
     Returns:
-        Tuple[embedding_json, message]: (embedding as JSON string, status message)
+        Tuple[aligned face crop, message]
+    """
+    image, message, _ = _decode_upload(image_data)
+    if image is None:
+        return None, message
+    try:
+        return _align_single(image, profile)
+    except Exception as e:
+        return None, f"Error generating embedding: {str(e)}"
+
+def _check_aligned_crop(image: np.ndarray) -> Optional[np.ndarray]:
+    """Accept a client-aligned crop if the detector agrees it is a canonical face
+
+    The crop is padded and run through the small ROI detector; its landmarks
+    must sit within 10% of the crop size of the ArcFace template positions.
     """
+    size = face_model.recognition_model.input_size[0]
+    if image.shape[:2] != (size, size):
+        return None
+    pad = size // 2
+    padded = cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=0)
+    faces = face_model.detect(padded, get_profile("roi"))
+    if len(faces) != 1 or faces[0].kps is None:
+        return None
+    expected = face_align.arcface_dst * (size / 112.0) + pad
+    if np.mean(np.linalg.norm(faces[0].kps - expected, axis=1)) > 0.1 * size:
+        return None
+    return image
+
+def _align_in_roi(image: np.ndarray, box: List[float], landmarks: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """Detect only inside the client's face box (plus a margin) at a small input size"""
+    x1, y1, x2, y2 = box
+    width, height = x2 - x1, y2 - y1
+    if width <= 0 or height <= 0:
+        return None
+    margin = settings.roi_margin
+    left, top = int(max(0, x1 - margin * width)), int(max(0, y1 - margin * height))
+    right = int(min(image.shape[1], x2 + margin * width))
+    bottom = int(min(image.shape[0], y2 + margin * height))
+    roi = image[top:bottom, left:right]
+    if roi.shape[0] < 16 or roi.shape[1] < 16:
+        return None
+    faces = face_model.detect(roi, get_profile("roi"))
+    if not faces:
+        return None
+    if landmarks is not None:
+        hint = landmarks - np.array([left, top], dtype=np.float32)
+        distances = [np.mean(np.linalg.norm(f.kps - hint, axis=1)) if f.kps is not None else np.inf for f in faces]
+        best = int(np.argmin(distances))
+        # The hint must roughly agree with what the server sees
+        if distances[best] > 0.25 * max(width, height):
+            return None
+        return face_model.align(roi, faces[best])
+    if len(faces) > 1:
+        return None
+    return face_model.align(roi, faces[0])
+
+def align_with_hint(
+    image_data: bytes,
+    box: Optional[List[float]] = None,
+    landmarks: Optional[List[float]] = None,
+    aligned: bool = False,
+    profile: str = "verify-fast"
+) -> Tuple[Optional[np.ndarray], str]:
+    """Use a client-side detection to skip most of the server detection cost
+
+    Either the upload is already an aligned crop (``aligned``), or ``box``
+    (x1, y1, x2, y2) and optional 5-point ``landmarks`` (x, y pairs) locate
+    the face in the uploaded frame. When the hint fails its sanity check the
+    upload goes through the normal full-frame detection.
+    """
+    image, message, scale = _decode_upload(image_data)
+    if image is None:
+        return None, message
     try:
-        faces = face_model.detect_faces(image)
-        
-        if len(faces) == 0:
-            return None, "No face detected in image"
-        
-        if len(faces) > 1:
-            return None, "Multiple faces detected. Please ensure only one face is visible"
-        
-        # Get the first (and only) face
-        face = faces[0]
-        embedding = face.embedding
-        
-        # Convert numpy array to JSON string for storage
-        embedding_json = json.dumps(embedding.tolist())
-        
-        return embedding_json, "Face embedding generated successfully"
-        
+        if aligned:
+            crop = _check_aligned_crop(image)
+            if crop is not None:
+                return crop, "Face detected (client-aligned crop)"
+        elif box is not None:
+            points = None
+            if landmarks is not None:
+                points = np.asarray(landmarks, dtype=np.float32).reshape(5, 2) / scale
+            crop = _align_in_roi(image, [v / scale for v in box], points)
+            if crop is not None:
+                return crop, "Face detected (client ROI)"
+        print("[Hint] Client face hint rejected; falling back to full detection")
+        return _align_single(image, profile)
     except Exception as e:
         return None, f"Error generating embedding: {str(e)}"
 
+def align_all_faces(image_data: bytes, max_size: int = 2048, profile: str = "group") -> Tuple[List[dict], List[np.ndarray], str]:
+    """Detect and align every face in an upload (e.g. a classroom photo)
+
+    Group photos are downscaled less aggressively so faces at the back keep
+    enough pixels for alignment. Boxes are returned in original image pixels.
+
+    Returns:
+        Tuple[[{"box", "det_score"}, ...], aligned crops, message]
+    """
+    image, message, scale = _decode_upload(image_data, max_size=max_size)
+    if image is None:
+        return [], [], message
+    analysis = analyze_image(image, profile, scale)
+    if not analysis.face_count:
+        return [], [], "No face detected in image"
+    boxes = [{"box": analysis.box(i), "det_score": float(face.det_score)} for i, face in enumerate(analysis.faces)]
+    return boxes, analysis.aligned_crops(), f"{analysis.face_count} face(s) detected"
+
+def detect_frame(image_data: bytes, profile: str = "verify-fast") -> Tuple[Optional[FaceAnalysisResult], str]:
+    """Decode and detect only (streaming sessions decide per face whether to recognize)
+
+    Returns:
+        Tuple[analysis or None if the upload is invalid, message]
+    """
+    image, message, scale = _decode_upload(image_data)
+    if image is None:
+        return None, message
+    analysis = analyze_image(image, profile, scale, face_policy="all")
+    return analysis, f"{analysis.face_count} face(s) detected" if analysis.face_count else "No face detected in image"
+
+def align_gated_faces(analysis: FaceAnalysisResult, faces: list) -> List[Tuple[Optional[np.ndarray], Optional[str]]]:
+    """(aligned crop, None) for each face that passes the quality gate, else (None, reason)"""
+    results = []
+    for face in faces:
+        index = next(i for i, f in enumerate(analysis.faces) if f is face)
+        reason = check_quality_gate(analysis, index)
+        results.append((None, reason) if reason else (analysis.aligned_crop(index), None))
+    return results
+
+async def embed_image_bytes(
+    image_data: bytes,
+    profile: str = "verify-fast",
+    hint: Optional[dict] = None
+) -> Tuple[Optional[np.ndarray], str]:
+    """Detect on the inference executor, then embed through the recognition batcher
+
+    ``profile`` names the model profile (see profiles.py): verification
+    endpoints use "verify-fast", enrollment uses "enroll-quality". ``hint``
+    holds align_with_hint keyword arguments from a client-side detection.
+
+    Returns:
+        Tuple[embedding, message]: (L2-normalized float32 embedding, status message)
+    """
+    if hint:
+        crop, message = await inference_executor.run(align_with_hint, image_data, profile=profile, **hint)
+    else:
+        crop, message = await inference_executor.run(align_single_face, image_data, profile)
+    if crop is None:
+        return None, message
+    embedding = await recognition_batcher.embed(crop)
+    return normalize_embedding(embedding), "Face embedding generated successfully"
+
+async def embed_detection(detection, profile: str = "verify-fast") -> Tuple[Optional[np.ndarray], str]:
+    """Embed the face of a cached /face/detect result: no decode and no detector pass"""
+    crop, message = await inference_executor.run(_gated_crop, detection.analysis, profile)
+    if crop is None:
+        return None, message
+    embedding = await recognition_batcher.embed(crop)
+    return normalize_embedding(embedding), "Face embedding generated successfully"
+
 def embedding_from_json(embedding_json: str) -> np.ndarray:
     """Convert JSON string back to numpy array"""
     embedding_list = json.loads(embedding_json)
-    return np.array(embedding_list, dtype=np.float32)
\ No newline at end of file
+    return np.array(embedding_list, dtype=np.float32)
+
+def decode_device_embedding(blob: bytes) -> Tuple[Optional[np.ndarray], str]:
+    """Decode an embedding computed on a client, checking it came from the gallery's model"""
+    try:
+        model_name, dim, offset = read_blob_header(blob)
+    except Exception as e:
+        return None, f"Invalid embedding: {str(e)}"
+    if model_name != face_model.recognition_model_name:
+        return None, f"Embedding model {model_name} does not match server model {face_model.recognition_model_name}"
+    if len(blob) != offset + dim * 4:
+        return None, "Invalid embedding: length does not match header"
+    vector = embedding_from_blob(blob)
+    if not np.all(np.isfinite(vector)) or not np.any(vector):
+        return None, "Invalid embedding values"
+    return normalize_embedding(vector), "Embedding accepted"
+
+def stored_embedding_model(record) -> Optional[str]:
+    """Model pack recorded in a row's binary header (None for legacy JSON rows)"""
+    blob = getattr(record, "embedding_blob", None)
+    return read_blob_header(blob)[0] if blob else None
+
+def decode_stored_embedding(record) -> np.ndarray:
+    """Decode a FaceEmbedding/TeacherFaceEmbedding row, preferring the binary column"""
+    blob = getattr(record, "embedding_blob", None)
+    if blob:
+        return embedding_from_blob(blob)
+    return normalize_embedding(embedding_from_json(record.embedding))
@@ -0,0 +1,664 @@
+"""In-memory face gallery index partitioned by organization and class"""
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from .matcher import EmbeddingGallery, GallerySearch
+from .gallery_file import MappedGallery, SharedGalleryFile, read_gallery_snapshot, write_gallery_snapshot
+from .embedding import decode_stored_embedding, stored_embedding_model
+from .insightface_model import face_model
+from .ann import AnnGallery, create_ann_index, load_ann_index
+from ..core.config import settings
+
+# Snapshot high-water marks are moved back by this much, covering rows whose
+# timestamp predates their commit; replaying a row twice is harmless
+SNAPSHOT_REPLAY_MARGIN = timedelta(minutes=5)
+
+class GalleryIndex:
+    """Versioned gallery of enrolled student embeddings
+
+    The index is loaded from the database once and then kept current through
+    incremental updates (enrollment, re-enrollment, deletion, class moves).
+    Each class partition is an immutable EmbeddingGallery that is swapped on
+    write, so readers can match against a snapshot without holding the lock.
+
+    With ``gallery_shared_dir`` set, the vectors live in a versioned file
+    (see gallery_file) that every worker maps read-only: partitions are
+    slices of the mapping, writes are published as a new version under a
+    cross-process lock, and readers pick up other workers' versions within
+    ``gallery_shared_poll_seconds``.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.version = 0
+        self._partitions: Dict[int, EmbeddingGallery] = {}
+        self._partition_versions: Dict[int, int] = {}
+        self._class_org: Dict[int, Optional[int]] = {}
+        self._student_class: Dict[int, int] = {}
+        self._views: Dict[tuple, Tuple[tuple, EmbeddingGallery]] = {}
+        self._ann = None
+        self._ann_build_lock = threading.Lock()
+        self._shared: Optional[SharedGalleryFile] = None
+        self._mapped: Optional[MappedGallery] = None
+        self._mapped_ranges: Dict[int, Tuple[int, int]] = {}  # class -> rows of _mapped, while unchanged
+        self._next_poll = 0.0
+        self._publishing = False
+        self._snapshot_timer: Optional[threading.Timer] = None
+        self._snapshot_version = 0  # gallery version the snapshot file holds
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self) -> int:
+        return len(self._student_class)
+
+    def load(self, db) -> None:
+        """(Re)build every partition from the snapshot file and/or the database"""
+        if settings.gallery_shared_dir and self._shared is None:
+            self._shared = SharedGalleryFile(settings.gallery_shared_dir, settings.gallery_shared_keep_versions)
+        if self._shared is None:
+            self._load_rows(db)
+        else:
+            # Read the DB under the file lock so no other worker's write slips in between
+            with self._lock, self._shared.locked():
+                self._load_rows(db)
+                self._publish_locked()
+        if self._ann_wanted(len(self)):
+            self.build_ann()
+
+    def _load_rows(self, db) -> None:
+        if not self._restore_snapshot(db):
+            self._load_from_db(db)
+            self._schedule_snapshot()
+
+    def _load_from_db(self, db) -> None:
+        from ..db import crud
+
+        grouped: Dict[int, List[Tuple[int, np.ndarray]]] = {}
+        class_org: Dict[int, Optional[int]] = {}
+        # Templates from another recognition model are not comparable; they need re-enrollment
+        pinned_model = face_model.recognition_model_name
+        skipped = 0
+        for face_embed, class_id, org_id in crud.get_face_embedding_gallery_rows(db):
+            model_name = stored_embedding_model(face_embed)
+            if model_name is not None and model_name != pinned_model:
+                skipped += 1
+                continue
+            grouped.setdefault(class_id, []).append((face_embed.student_id, decode_stored_embedding(face_embed)))
+            class_org[class_id] = org_id
+
+        self._install(grouped, class_org)
+        print(f"[Gallery] Loaded {len(self._student_class)} face(s) across {len(self._partitions)} class(es)")
+        if skipped:
+            print(f"[Gallery] ⚠️ Skipped {skipped} face(s) enrolled with a model other than {pinned_model}; re-enroll them")
+
+    def _restore_snapshot(self, db) -> bool:
+        """Start from the snapshot file and replay what changed in the DB since (False: no usable snapshot)
+
+        Vectors are only decoded for rows written after the snapshot's
+        high-water mark; deletions and class moves are reconciled against a
+        query that skips the embedding columns.
+        """
+        snapshot = read_gallery_snapshot(settings.gallery_snapshot_path)
+        if snapshot is None:
+            return False
+        pinned_model = face_model.recognition_model_name
+        if snapshot.model != pinned_model:
+            print(f"[Gallery] Snapshot was built with {snapshot.model}, not {pinned_model}; loading from the database")
+            return False
+        from ..db import crud
+
+        owners = {sid: (cid, oid) for sid, cid, oid in crud.get_face_embedding_owners(db)}
+        replay = crud.get_face_embedding_gallery_rows(db, updated_since=snapshot.high_water_mark)
+        vectors = {sid: snapshot.vectors[i] for i, sid in enumerate(snapshot.ids.tolist()) if sid in owners}
+        unchanged = len(vectors) == len(snapshot)
+        replayed = {face_embed.student_id for face_embed, _, _ in replay}
+        missing = [sid for sid in owners if sid not in vectors and sid not in replayed]
+        for start in range(0, len(missing), 500):
+            replay += crud.get_face_embedding_gallery_rows(db, student_ids=missing[start:start + 500])
+
+        skipped = 0
+        for face_embed, class_id, org_id in replay:
+            student_id = face_embed.student_id
+            vectors.pop(student_id, None)
+            owners[student_id] = (class_id, org_id)
+            model_name = stored_embedding_model(face_embed)
+            if model_name is not None and model_name != pinned_model:
+                skipped += 1
+                continue
+            vectors[student_id] = decode_stored_embedding(face_embed)
+
+        grouped: Dict[int, List[Tuple[int, np.ndarray]]] = {}
+        class_org: Dict[int, Optional[int]] = {}
+        for student_id, vector in vectors.items():
+            class_id, org_id = owners[student_id]
+            grouped.setdefault(class_id, []).append((student_id, vector))
+            class_org[class_id] = org_id
+        self._install(grouped, class_org)
+        print(f"[Gallery] Restored {len(snapshot)} face(s) from snapshot, replayed {len(replay)} changed row(s) from the database")
+        if skipped:
+            print(f"[Gallery] ⚠️ Skipped {skipped} face(s) enrolled with a model other than {pinned_model}; re-enroll them")
+        if replay or not unchanged:
+            self._schedule_snapshot()
+        else:
+            self._snapshot_version = self.version
+        return True
+
+    def _install(self, grouped: Dict[int, List[Tuple[int, np.ndarray]]], class_org: Dict[int, Optional[int]]) -> None:
+        with self._lock:
+            self.version += 1
+            self._partitions = {cid: EmbeddingGallery.from_candidates(rows) for cid, rows in grouped.items()}
+            self._partition_versions = {cid: self.version for cid in grouped}
+            self._class_org = class_org
+            self._student_class = {sid: cid for cid, rows in grouped.items() for sid, _ in rows}
+            self._views.clear()
+            self._ann = None
+            self._mapped, self._mapped_ranges = None, {}
+            self._loaded = True
+
+    def ensure_loaded(self, db) -> None:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load(db)
+
+    def _bump(self, class_id: int) -> None:
+        self.version += 1
+        self._partition_versions[class_id] = self.version
+        self._mapped_ranges.pop(class_id, None)
+        self._schedule_snapshot()
+
+    def _schedule_snapshot(self) -> None:
+        """Write the snapshot in the background a while after the first unsaved change"""
+        if not settings.gallery_snapshot_path or self._snapshot_timer is not None:
+            return
+        self._snapshot_timer = threading.Timer(settings.gallery_snapshot_delay_seconds, self.save_snapshot)
+        self._snapshot_timer.daemon = True
+        self._snapshot_timer.start()
+
+    def save_snapshot(self, db=None) -> None:
+        """Write the gallery and the DB high-water mark to ``gallery_snapshot_path`` if it changed"""
+        with self._lock:
+            if self._snapshot_timer is not None:
+                self._snapshot_timer.cancel()
+                self._snapshot_timer = None
+        if not settings.gallery_snapshot_path or not self._loaded or self._snapshot_version == self.version:
+            return
+        from ..db import crud
+        from ..db.base import SessionLocal
+
+        session = db or SessionLocal()
+        try:
+            # Read the mark before copying the gallery: later writes are replayed rather than lost
+            high_water_mark = crud.get_face_embedding_high_water_mark(session)
+            with self._lock:
+                version = self.version
+                galleries = list(self._partitions.values())
+            if high_water_mark is not None:
+                high_water_mark -= SNAPSHOT_REPLAY_MARGIN
+            write_gallery_snapshot(settings.gallery_snapshot_path, galleries, face_model.recognition_model_name, high_water_mark)
+            self._snapshot_version = version
+            print(f"[Gallery] Snapshot of {sum(len(g) for g in galleries)} face(s) written")
+        except Exception as e:
+            print(f"[Gallery] Failed to write snapshot: {e}")
+        finally:
+            if db is None:
+                session.close()
+
+    @contextmanager
+    def _writing(self):
+        """Hold the lock for a write; in shared mode also serialize with other workers and publish"""
+        with self._lock:
+            if self._shared is None or not self._loaded or self._publishing:
+                yield
+                return
+            self._publishing = True
+            try:
+                with self._shared.locked():
+                    self._adopt(self._shared.current_version())
+                    before = self.version
+                    yield
+                    if self.version != before:
+                        self._publish_locked()
+            finally:
+                self._publishing = False
+
+    def _publish_locked(self) -> None:
+        partitions = [(cid, self._class_org.get(cid), p) for cid, p in self._partitions.items()]
+        mapped = self._shared.publish(partitions, face_model.recognition_model_name)
+        if mapped is not None:
+            # Our own version: the ANN index already has these changes
+            self._adopt(mapped.version, mapped=mapped, sync_ann=False)
+
+    def _poll_shared(self) -> None:
+        """Switch to a version another worker published (checked at most every poll interval)"""
+        if self._shared is None or not self._loaded:
+            return
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + settings.gallery_shared_poll_seconds
+        version = self._shared.current_version()
+        if version is not None and (self._mapped is None or version != self._mapped.version):
+            with self._lock:
+                self._adopt(version)
+
+    def _adopt(self, version: Optional[int], mapped: Optional[MappedGallery] = None, sync_ann: bool = True) -> None:
+        """Replace every partition with slices of a mapped version (lock held)"""
+        if version is None or (self._mapped is not None and self._mapped.version == version):
+            return
+        mapped = mapped or self._shared.open(version)
+        if mapped is None:
+            return
+        if mapped.model is not None and mapped.model != face_model.recognition_model_name:
+            print(f"[Gallery] ⚠️ Ignoring shared gallery version {version} from model {mapped.model}")
+            return
+        previous = self._view() if sync_ann and self._ann is not None else None
+
+        partitions, class_org, ranges, student_class = {}, {}, {}, {}
+        for class_id, org_id, start, stop in mapped.partitions():
+            partitions[class_id] = EmbeddingGallery(mapped.ids[start:stop], mapped.vectors[start:stop], normalized=True)
+            class_org[class_id] = org_id
+            ranges[class_id] = (start, stop)
+            student_class.update(dict.fromkeys(mapped.ids[start:stop].tolist(), class_id))
+        self.version += 1
+        self._partitions = partitions
+        self._partition_versions = {cid: self.version for cid in partitions}
+        self._class_org = class_org
+        self._student_class = student_class
+        self._views.clear()
+        self._mapped, self._mapped_ranges = mapped, ranges
+        if sync_ann:  # another worker's changes; our own are already scheduled
+            self._schedule_snapshot()
+        if previous is not None:
+            self._sync_ann(previous, self._view())
+
+    def _sync_ann(self, old: EmbeddingGallery, new: EmbeddingGallery) -> None:
+        """Apply the difference between two global views to the ANN index"""
+        stale = old.ids[~np.isin(old.ids, new.ids)]
+        if stale.size:
+            self._ann.remove(stale)
+        if not len(new):
+            return
+        changed = np.ones(len(new), dtype=bool)
+        if len(old) and old.dim == new.dim:
+            order = np.argsort(old.ids)
+            rows = order[np.clip(np.searchsorted(old.ids, new.ids, sorter=order), 0, len(old) - 1)]
+            known = old.ids[rows] == new.ids
+            changed[known] = ~np.all(np.isclose(old.matrix[rows[known]], new.matrix[known], atol=1e-5), axis=1)
+        if changed.any():
+            self._ann.add(new.ids[changed], new.matrix[changed])
+
+    def _remove_from_partition(self, student_id: int) -> Optional[int]:
+        class_id = self._student_class.pop(student_id, None)
+        if class_id is None:
+            return None
+        partition = self._partitions.get(class_id)
+        if partition is not None:
+            keep = partition.ids != student_id
+            if keep.all():
+                return class_id
+            if keep.any():
+                self._partitions[class_id] = EmbeddingGallery(partition.ids[keep], partition.matrix[keep], normalized=True)
+            else:
+                self._partitions.pop(class_id)
+            self._bump(class_id)
+        return class_id
+
+    def upsert(self, student_id: int, class_id: int, org_id: Optional[int], embedding: np.ndarray) -> None:
+        """Add or replace a student's template"""
+        with self._writing():
+            if not self._loaded:
+                return
+            self._remove_from_partition(student_id)
+            addition = EmbeddingGallery(np.array([student_id]), np.asarray(embedding).reshape(1, -1))
+            partition = self._partitions.get(class_id)
+            if partition is not None and len(partition):
+                addition = EmbeddingGallery(
+                    np.concatenate([partition.ids, addition.ids]),
+                    np.vstack([partition.matrix, addition.matrix]),
+                    normalized=True
+                )
+            self._partitions[class_id] = addition
+            self._class_org[class_id] = org_id
+            self._student_class[student_id] = class_id
+            self._bump(class_id)
+            if self._ann is not None:
+                self._ann.add(np.array([student_id]), addition.matrix[-1:])
+
+    def upsert_many(self, records: List[Tuple[int, int, Optional[int], np.ndarray]]) -> None:
+        """Upsert (student_id, class_id, org_id, embedding) rows as one write (one shared-file publish)"""
+        with self._writing():
+            for student_id, class_id, org_id, embedding in records:
+                self.upsert(student_id, class_id, org_id, embedding)
+
+    def remove(self, student_id: int) -> None:
+        """Drop a student's template (face deleted or student removed)"""
+        with self._writing():
+            self._remove_from_partition(student_id)
+            if self._ann is not None:
+                self._ann.remove([student_id])
+
+    def move(self, student_id: int, class_id: int, org_id: Optional[int]) -> None:
+        """Move a student's template to another class partition"""
+        with self._writing():
+            old_class_id = self._student_class.get(student_id)
+            if old_class_id is None or old_class_id == class_id:
+                return
+            vector = self._partitions[old_class_id].matrix[self._partitions[old_class_id].ids == student_id][0].copy()
+            self.upsert(student_id, class_id, org_id, vector)
+
+    def remove_class(self, class_id: int) -> None:
+        with self._writing():
+            partition = self._partitions.pop(class_id, None)
+            self._class_org.pop(class_id, None)
+            if partition is not None:
+                for student_id in partition.ids.tolist():
+                    self._student_class.pop(student_id, None)
+                self._bump(class_id)
+                if self._ann is not None:
+                    self._ann.remove(partition.ids)
+
+    def set_class_organization(self, class_id: int, org_id: Optional[int]) -> None:
+        with self._writing():
+            if class_id in self._partitions:
+                self._class_org[class_id] = org_id
+                self._bump(class_id)
+
+    def get_embedding(self, student_id: int) -> Optional[np.ndarray]:
+        """Return a student's normalized template, if enrolled"""
+        self._poll_shared()
+        with self._lock:
+            class_id = self._student_class.get(student_id)
+            partition = self._partitions.get(class_id) if class_id is not None else None
+        if partition is None:
+            return None
+        rows = partition.matrix[partition.ids == student_id]
+        return rows[0] if len(rows) else None
+
+    def snapshot(
+        self,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None,
+        org_id: Optional[int] = None,
+    ) -> EmbeddingGallery:
+        """Return an immutable gallery for the requested scope
+
+        Scope precedence matches the verify endpoint: a single class, then a
+        list of classes, then an organization, otherwise every partition.
+        """
+        self._poll_shared()
+        return self._view(class_id, class_ids, org_id)
+
+    def _view(
+        self,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None,
+        org_id: Optional[int] = None,
+    ) -> EmbeddingGallery:
+        with self._lock:
+            if class_id:
+                return self._partitions.get(int(class_id)) or EmbeddingGallery()
+            if class_ids:
+                key = ("classes", tuple(sorted(set(int(c) for c in class_ids))))
+                members = [c for c in key[1] if c in self._partitions]
+            elif org_id is not None:
+                key = ("org", int(org_id))
+                members = sorted(c for c, o in self._class_org.items() if o == org_id and c in self._partitions)
+            else:
+                key = ("all", None)
+                members = sorted(self._partitions)
+
+            stamp = tuple((c, self._partition_versions[c]) for c in members)
+            cached = self._views.get(key)
+            if cached and cached[0] == stamp:
+                return cached[1]
+
+            parts = [self._partitions[c] for c in members]
+            rows = self._mapped_rows(members)
+            if len(parts) == 1:
+                view = parts[0]
+            elif rows is not None:
+                # Contiguous in the shared file: a slice of the mapping, no copy
+                view = EmbeddingGallery(self._mapped.ids[rows[0]:rows[1]], self._mapped.vectors[rows[0]:rows[1]], normalized=True)
+            elif parts:
+                view = EmbeddingGallery(
+                    np.concatenate([p.ids for p in parts]),
+                    np.vstack([p.matrix for p in parts]),
+                    normalized=True
+                )
+            else:
+                view = EmbeddingGallery()
+            self._views[key] = (stamp, view)
+            return view
+
+    def _mapped_rows(self, members: List[int]) -> Optional[Tuple[int, int]]:
+        """Row range of the mapped file covering exactly these classes, if they are adjacent"""
+        if self._mapped is None or not members or any(c not in self._mapped_ranges for c in members):
+            return None
+        ranges = sorted(self._mapped_ranges[c] for c in members)
+        if any(a[1] != b[0] for a, b in zip(ranges, ranges[1:])):
+            return None
+        return ranges[0][0], ranges[-1][1]
+
+    def _ann_wanted(self, scope_size: int) -> bool:
+        return settings.ann_enabled and scope_size >= settings.ann_min_gallery_size
+
+    def build_ann(self) -> None:
+        """Build (or restore and reconcile) the ANN index over the whole gallery"""
+        with self._ann_build_lock:
+            self._build_ann_locked()
+
+    def _build_ann_locked(self) -> None:
+        base = self.snapshot()
+        if not len(base):
+            return
+        engine = load_ann_index(settings.ann_index_path)
+        if engine is None or engine.dim != base.dim:
+            engine = create_ann_index(base.dim, len(base))
+            # Training runs outside the lock so verify keeps serving meanwhile
+            engine.train(base.matrix)
+        with self._lock:
+            # Reconcile against the current gallery: drop stale ids, (re)add changed rows
+            current = self.snapshot()
+            known = engine.ids()
+            stale = known[~np.isin(known, current.ids)]
+            if stale.size:
+                engine.remove(stale)
+            changed = [
+                i for i, vid in enumerate(current.ids.tolist())
+                if (stored := engine.vector(vid)) is None or not np.allclose(stored, current.matrix[i], atol=1e-5)
+            ]
+            if changed:
+                engine.add(current.ids[changed], current.matrix[changed])
+            self._ann = engine
+            # The engine holds its own copy of the vectors; don't pin the global view too
+            self._views.pop(("all", None), None)
+        print(f"[Gallery] ANN index ({engine.backend}) ready over {len(engine)} face(s), {len(changed)} (re)inserted")
+        self.save_ann()
+
+    def save_ann(self) -> None:
+        if self._ann is not None and settings.ann_index_path:
+            try:
+                self._ann.save(settings.ann_index_path)
+            except Exception as e:
+                print(f"[Gallery] Failed to persist ANN index: {e}")
+
+    def _vectors_for(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        found_ids, rows = [], []
+        for vid in ids.tolist():
+            vector = self.get_embedding(vid)
+            if vector is not None:
+                found_ids.append(vid)
+                rows.append(vector)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        return np.array(found_ids, dtype=np.int64), np.vstack(rows)
+
+    def searcher(
+        self,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None,
+        org_id: Optional[int] = None,
+    ) -> GallerySearch:
+        """Matcher for a scope: exhaustive (at gallery_precision) for class scopes, ANN for large org/global scopes"""
+        if class_id or class_ids or not settings.ann_enabled:
+            return self.snapshot(class_id=class_id, class_ids=class_ids, org_id=org_id).compressed(settings.gallery_precision)
+
+        self._poll_shared()
+        with self._lock:
+            if org_id is not None:
+                classes = {c for c, o in self._class_org.items() if o == org_id}
+                size = sum(len(self._partitions[c]) for c in classes if c in self._partitions)
+            else:
+                classes = None
+                size = len(self._student_class)
+        if not self._ann_wanted(size):
+            return self.snapshot(org_id=org_id).compressed(settings.gallery_precision)
+        if self._ann is None:
+            # Concurrent requests wait for one build instead of each training an index
+            with self._ann_build_lock:
+                if self._ann is None:
+                    self._build_ann_locked()
+
+        id_filter = None
+        if classes is not None:
+            student_class = self._student_class
+            id_filter = lambda ids: np.fromiter(
+                (student_class.get(vid) in classes for vid in ids.tolist()), dtype=bool, count=ids.shape[0]
+            )
+        exact = (lambda: self.snapshot(org_id=org_id)) if classes is not None else None
+        return AnnGallery(self._ann, size, self._vectors_for, id_filter=id_filter, exact=exact)
+
+class TeacherGalleryIndex:
+    """Teacher Face ID templates, partitioned by organization
+
+    Loaded once from the database and kept current on Face ID setup, teacher
+    updates and deletion, so face-login no longer reads and decodes every
+    teacher template per request. Partitions are immutable EmbeddingGallery
+    objects swapped on write.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.version = 0
+        self._partitions: Dict[Optional[int], EmbeddingGallery] = {}
+        self._teacher_org: Dict[int, Optional[int]] = {}
+        self._everyone: Tuple[int, EmbeddingGallery] = (-1, EmbeddingGallery())
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def __len__(self) -> int:
+        return len(self._teacher_org)
+
+    def load(self, db) -> None:
+        from ..db import crud
+
+        grouped: Dict[Optional[int], List[Tuple[int, np.ndarray]]] = {}
+        pinned_model = face_model.recognition_model_name
+        skipped = 0
+        for face_embed, org_id in crud.get_teacher_face_embedding_gallery_rows(db):
+            model_name = stored_embedding_model(face_embed)
+            if model_name is not None and model_name != pinned_model:
+                skipped += 1
+                continue
+            grouped.setdefault(org_id, []).append((face_embed.teacher_id, decode_stored_embedding(face_embed)))
+
+        with self._lock:
+            self.version += 1
+            self._partitions = {org_id: EmbeddingGallery.from_candidates(rows) for org_id, rows in grouped.items()}
+            self._teacher_org = {tid: org_id for org_id, rows in grouped.items() for tid, _ in rows}
+            self._loaded = True
+        print(f"[Gallery] Loaded {len(self._teacher_org)} teacher Face ID(s) across {len(self._partitions)} organization(s)")
+        if skipped:
+            print(f"[Gallery] ⚠️ Skipped {skipped} teacher Face ID(s) from a model other than {pinned_model}")
+
+    def ensure_loaded(self, db) -> None:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load(db)
+
+    def _remove_locked(self, teacher_id: int) -> Optional[np.ndarray]:
+        if teacher_id not in self._teacher_org:
+            return None
+        org_id = self._teacher_org.pop(teacher_id)
+        partition = self._partitions[org_id]
+        keep = partition.ids != teacher_id
+        vector = partition.matrix[~keep][0].copy()
+        if keep.any():
+            self._partitions[org_id] = EmbeddingGallery(partition.ids[keep], partition.matrix[keep], normalized=True)
+        else:
+            self._partitions.pop(org_id)
+        self.version += 1
+        return vector
+
+    def upsert(self, teacher_id: int, org_id: Optional[int], embedding: np.ndarray) -> None:
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove_locked(teacher_id)
+            addition = EmbeddingGallery(np.array([teacher_id]), np.asarray(embedding).reshape(1, -1))
+            partition = self._partitions.get(org_id)
+            if partition is not None:
+                addition = EmbeddingGallery(
+                    np.concatenate([partition.ids, addition.ids]),
+                    np.vstack([partition.matrix, addition.matrix]),
+                    normalized=True
+                )
+            self._partitions[org_id] = addition
+            self._teacher_org[teacher_id] = org_id
+            self.version += 1
+
+    def remove(self, teacher_id: int) -> None:
+        with self._lock:
+            self._remove_locked(teacher_id)
+
+    def move(self, teacher_id: int, org_id: Optional[int]) -> None:
+        """Follow a teacher moved to another organization"""
+        with self._lock:
+            if self._teacher_org.get(teacher_id, org_id) == org_id:
+                return
+            vector = self._remove_locked(teacher_id)
+            self.upsert(teacher_id, org_id, vector)
+
+    def get_embedding(self, teacher_id: int) -> Optional[np.ndarray]:
+        """A teacher's template for 1:1 checks (None if no Face ID)"""
+        with self._lock:
+            if teacher_id not in self._teacher_org:
+                return None
+            partition = self._partitions[self._teacher_org[teacher_id]]
+        return partition.matrix[partition.ids == teacher_id][0]
+
+    def partition(self, org_id: Optional[int]) -> EmbeddingGallery:
+        """Templates of one organization's teachers"""
+        return self._partitions.get(org_id) or EmbeddingGallery()
+
+    def searcher(self) -> EmbeddingGallery:
+        """All teachers across organizations (cached until the next write)"""
+        with self._lock:
+            version, view = self._everyone
+            if version != self.version:
+                partitions = [p for p in self._partitions.values() if len(p)]
+                if partitions:
+                    view = EmbeddingGallery(
+                        np.concatenate([p.ids for p in partitions]),
+                        np.vstack([p.matrix for p in partitions]),
+                        normalized=True
+                    )
+                else:
+                    view = EmbeddingGallery()
+                self._everyone = (self.version, view)
+            return view
+
+# Global singleton instances
+student_gallery = GalleryIndex()
+teacher_gallery = TeacherGalleryIndex()
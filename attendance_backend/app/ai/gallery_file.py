@@ -0,0 +1,227 @@
+"""On-disk gallery files: shared memory-mapped versions and startup snapshots"""
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from .matcher import EmbeddingGallery
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run a single worker
+    fcntl = None
+
+POINTER_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+
+class MappedGallery:
+    """One published gallery version, mapped read-only
+
+    Rows are sorted by (organization, class), so every class and every
+    organization is a contiguous slice of ``vectors``; ``offsets`` holds the
+    start row of each class in ``class_ids`` plus the total row count.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        class_ids: np.ndarray,
+        class_orgs: np.ndarray,
+        offsets: np.ndarray,
+        model: Optional[str] = None,
+    ):
+        self.version = version
+        self.ids = ids
+        self.vectors = vectors
+        self.class_ids = class_ids
+        self.class_orgs = class_orgs  # -1 for classes without an organization
+        self.offsets = offsets
+        self.model = model
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def partitions(self) -> Iterator[Tuple[int, Optional[int], int, int]]:
+        """(class_id, org_id, start, stop) for every class"""
+        for i, class_id in enumerate(self.class_ids.tolist()):
+            org_id = int(self.class_orgs[i])
+            yield class_id, (org_id if org_id >= 0 else None), int(self.offsets[i]), int(self.offsets[i + 1])
+
+def _sort_key(item: Tuple[int, Optional[int], EmbeddingGallery]) -> Tuple[int, int]:
+    class_id, org_id, _ = item
+    return (-1 if org_id is None else org_id), class_id
+
+class SharedGalleryFile:
+    """Directory of immutable gallery versions plus a CURRENT pointer
+
+    A writer takes the directory lock, writes ``v<version>/`` completely and
+    then swaps the pointer with ``os.replace``, so readers either see the old
+    or the new version, never a partial one. Old versions are removed after
+    ``keep_versions`` newer ones exist; a worker still mapping one keeps its
+    pages until it remaps (POSIX unlink semantics).
+    """
+
+    def __init__(self, directory: str, keep_versions: int = 3):
+        self.directory = directory
+        self.keep_versions = max(2, keep_versions)
+        os.makedirs(directory, exist_ok=True)
+
+    def _version_dir(self, version: int) -> str:
+        return os.path.join(self.directory, f"v{version:010d}")
+
+    def current_version(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.directory, POINTER_FILE)) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock across worker processes (publishers only; readers never wait)"""
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def open(self, version: Optional[int] = None) -> Optional[MappedGallery]:
+        """Map a version (default: the current one); None if it is missing or unreadable"""
+        version = self.current_version() if version is None else version
+        if version is None:
+            return None
+        path = self._version_dir(version)
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            return MappedGallery(
+                version, load("ids"), load("vectors"),
+                np.load(os.path.join(path, "classes.npy")),
+                np.load(os.path.join(path, "class_orgs.npy")),
+                np.load(os.path.join(path, "offsets.npy")),
+                meta.get("model"),
+            )
+        except (OSError, ValueError) as e:
+            print(f"[Gallery] Cannot map shared gallery version {version}: {e}")
+            return None
+
+    def publish(self, partitions: List[Tuple[int, Optional[int], EmbeddingGallery]], model: Optional[str]) -> MappedGallery:
+        """Write a new version from (class_id, org_id, gallery) and make it current
+
+        Call while holding ``locked()``. Partitions are copied one at a time
+        into a memory-mapped output, so publishing needs no second in-memory
+        copy of the gallery.
+        """
+        partitions = sorted((p for p in partitions if len(p[2])), key=_sort_key)
+        version = (self.current_version() or 0) + 1
+        path = self._version_dir(version)
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        sizes = [len(g) for _, _, g in partitions]
+        total = sum(sizes)
+        dim = partitions[0][2].dim if partitions else 0
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        ids = np.lib.format.open_memmap(os.path.join(tmp_path, "ids.npy"), mode="w+", dtype=np.int64, shape=(total,))
+        vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode="w+", dtype=np.float32, shape=(total, dim))
+        for (_, _, gallery), start, stop in zip(partitions, offsets[:-1], offsets[1:]):
+            ids[start:stop] = gallery.ids
+            vectors[start:stop] = gallery.matrix
+        ids.flush()
+        vectors.flush()
+        del ids, vectors
+        np.save(os.path.join(tmp_path, "classes.npy"), np.array([c for c, _, _ in partitions], dtype=np.int64))
+        np.save(os.path.join(tmp_path, "class_orgs.npy"), np.array([-1 if o is None else o for _, o, _ in partitions], dtype=np.int64))
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"version": version, "model": model, "count": total, "dim": dim}, f)
+
+        os.replace(tmp_path, path)
+        pointer_tmp = os.path.join(self.directory, f"{POINTER_FILE}.tmp")
+        with open(pointer_tmp, "w") as f:
+            f.write(str(version))
+        os.replace(pointer_tmp, os.path.join(self.directory, POINTER_FILE))
+        self._cleanup(version)
+        return self.open(version)
+
+    def _cleanup(self, current: int) -> None:
+        for name in os.listdir(self.directory):
+            if not name.startswith("v") or name.endswith(".tmp"):
+                continue
+            try:
+                version = int(name[1:])
+            except ValueError:
+                continue
+            if version <= current - self.keep_versions:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+class GallerySnapshot:
+    """Gallery contents as of a database high-water mark"""
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        vectors: np.ndarray,
+        model: Optional[str],
+        high_water_mark: Optional[datetime],
+    ):
+        self.ids = ids
+        self.vectors = vectors  # normalized float32, one row per id
+        self.model = model
+        self.high_water_mark = high_water_mark  # rows written at or after this are replayed
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+def write_gallery_snapshot(
+    path: str,
+    galleries: List[EmbeddingGallery],
+    model: Optional[str],
+    high_water_mark: Optional[datetime],
+) -> None:
+    """Dump galleries to ``path`` (replaced atomically)"""
+    galleries = [g for g in galleries if len(g)]
+    ids = np.concatenate([g.ids for g in galleries]) if galleries else np.empty(0, dtype=np.int64)
+    vectors = np.vstack([g.matrix for g in galleries]) if galleries else np.empty((0, 0), dtype=np.float32)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Workers sharing a gallery may snapshot at the same time; each writes its own temp file
+    tmp_path = f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp.npz"
+    try:
+        np.savez(
+            tmp_path, ids=ids, vectors=vectors,
+            model=np.array(model or ""),
+            high_water_mark=np.array(high_water_mark.isoformat() if high_water_mark else ""),
+        )
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def read_gallery_snapshot(path: str) -> Optional[GallerySnapshot]:
+    """Load a snapshot, or None if it is missing or unreadable"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            model = str(data["model"]) or None
+            mark = str(data["high_water_mark"])
+            return GallerySnapshot(
+                data["ids"].astype(np.int64), data["vectors"].astype(np.float32),
+                model, datetime.fromisoformat(mark) if mark else None,
+            )
+    except Exception as e:
+        print(f"[Gallery] Ignoring unreadable snapshot {path}: {e}")
+        return None
@@ -0,0 +1,113 @@
+"""Bounded thread pool that keeps model inference off the asyncio event loop"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import numpy as np
+from fastapi import HTTPException, status
+from ..core.config import settings
+
+class InferenceUnavailable(HTTPException):
+    """Inference could not be served; raised through the services as an HTTP error"""
+
+class InferenceQueueFull(InferenceUnavailable):
+    def __init__(self, detail: str = "Face recognition is busy, please retry shortly"):
+        super().__init__(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=detail)
+
+class InferenceTimeout(InferenceUnavailable):
+    def __init__(self, detail: str = "Face recognition timed out, please retry"):
+        super().__init__(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=detail)
+
+class InferenceExecutor:
+    """Run blocking ONNX Runtime / OpenCV work on a dedicated worker pool
+
+    At most ``workers + max_queue`` jobs are admitted at once; beyond that
+    callers get InferenceQueueFull immediately instead of piling up. Each job
+    has a timeout covering queue wait plus run time. Jobs that time out
+    before starting are cancelled; running jobs finish but their result is
+    discarded (ONNX Runtime calls cannot be interrupted).
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, timeout: float = None):
+        self.workers = workers or settings.inference_workers
+        self.max_queue = max_queue if max_queue is not None else settings.inference_max_queue
+        self.timeout = timeout or settings.inference_timeout_seconds
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_ms = deque(maxlen=1024)
+        self._run_ms = deque(maxlen=1024)
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _job(self, fn: Callable, submitted: float, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._wait_ms.append((started - submitted) * 1000)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+                self._run_ms.append((time.perf_counter() - started) * 1000)
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Await ``fn(*args, **kwargs)`` on the inference pool"""
+        with self._lock:
+            if self._admitted >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise InferenceQueueFull()
+            self._admitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_pool(), self._job, fn, time.perf_counter(), args, kwargs)
+            try:
+                return await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                with self._lock:
+                    self._timed_out += 1
+                raise InferenceTimeout()
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def metrics(self) -> dict:
+        """Queue depth, throughput counters and wait/run latency percentiles"""
+        with self._lock:
+            waits = np.array(self._wait_ms) if self._wait_ms else np.zeros(1)
+            runs = np.array(self._run_ms) if self._run_ms else np.zeros(1)
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queue_depth": max(0, self._admitted - self._running),
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "wait_ms_p50": round(float(np.percentile(waits, 50)), 2),
+                "wait_ms_p95": round(float(np.percentile(waits, 95)), 2),
+                "wait_ms_max": round(float(waits.max()), 2),
+                "run_ms_p50": round(float(np.percentile(runs, 50)), 2),
+                "run_ms_p95": round(float(np.percentile(runs, 95)), 2),
+            }
+
+# Global singleton instance
+inference_executor = InferenceExecutor()
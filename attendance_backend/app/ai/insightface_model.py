@@ -1,11 +1,65 @@
 """InsightFace model initialization"""
 import insightface
+import threading
+import time
 import numpy as np
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from insightface.app.common import Face
+from insightface.utils import face_align
+from .profiles import FACE_POLICIES, ModelProfile, get_profile
 from ..core.config import settings
 
+class DetectionStats:
+    """Per profile and detector scale: calls, hit rate and latency percentiles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, List[int]] = {}
+        self._latency_ms: Dict[str, deque] = {}
+
+    def record(self, key: str, found: bool, elapsed_ms: float) -> None:
+        with self._lock:
+            counts = self._calls.setdefault(key, [0, 0])
+            counts[0] += 1
+            counts[1] += int(found)
+            self._latency_ms.setdefault(key, deque(maxlen=512)).append(elapsed_ms)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            report = {}
+            for key, (calls, hits) in sorted(self._calls.items()):
+                latency = np.array(self._latency_ms[key])
+                report[key] = {
+                    "calls": calls,
+                    "hit_rate": round(hits / calls, 3),
+                    "ms_p50": round(float(np.percentile(latency, 50)), 2),
+                    "ms_p95": round(float(np.percentile(latency, 95)), 2),
+                }
+            return report
+
+def _nms(bboxes: np.ndarray, kpss: Optional[np.ndarray], iou_threshold: float = 0.4):
+    """Greedy non-maximum suppression over (N, 5) [x1, y1, x2, y2, score] boxes"""
+    order = np.argsort(-bboxes[:, 4])
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(bboxes[i, 0], bboxes[order[1:], 0])
+        yy1 = np.maximum(bboxes[i, 1], bboxes[order[1:], 1])
+        xx2 = np.minimum(bboxes[i, 2], bboxes[order[1:], 2])
+        yy2 = np.minimum(bboxes[i, 3], bboxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return bboxes[keep], kpss[keep] if kpss is not None else None
+
 class InsightFaceModel:
     _instance = None
     _model = None
+    _fixed_det_size = False
+    detection_stats = DetectionStats()
     
     def __new__(cls):
         if cls._instance is None:
@@ -15,9 +69,16 @@ class InsightFaceModel:
     def load_model(self):
         """Load InsightFace model once at startup"""
         if self._model is None:
-            self._model = insightface.app.FaceAnalysis(name=settings.insightface_model_name)
-            self._model.prepare(ctx_id=-1, det_size=(640, 640))
-            print(f"InsightFace model {settings.insightface_model_name} loaded successfully")
+            # Only the modules the backend uses; genderage and the 2D/3D landmark
+            # heads would otherwise run on every detected face
+            modules = [m.strip() for m in settings.insightface_modules.split(",") if m.strip()]
+            self._model = insightface.app.FaceAnalysis(name=settings.insightface_model_name, allowed_modules=modules)
+            self._model.prepare(ctx_id=-1, det_size=get_profile("enroll-quality").det_size)
+            det_shape = self._model.det_model.session.get_inputs()[0].shape
+            self._fixed_det_size = isinstance(det_shape[2], int) and isinstance(det_shape[3], int)
+            if self._fixed_det_size:
+                print(f"Detector has a fixed input size {det_shape[2:]}; profile det sizes are ignored")
+            print(f"InsightFace model {settings.insightface_model_name} loaded successfully (modules: {sorted(self._model.models)})")
     
     def get_model(self):
         """Get the loaded model instance"""
@@ -31,5 +92,99 @@ class InsightFaceModel:
         faces = model.get(image)
         return faces
 
+    @property
+    def recognition_model(self):
+        return self.get_model().models["recognition"]
+
+    @property
+    def recognition_model_name(self) -> str:
+        """Model pack whose recognition head produced (and must match) stored templates"""
+        return settings.insightface_model_name
+
+    def _run_detector(
+        self,
+        image: np.ndarray,
+        input_size: Optional[Tuple[int, int]],
+        max_num: int,
+        key: str,
+        metric: str = "default"
+    ):
+        started = time.perf_counter()
+        bboxes, kpss = self.get_model().det_model.detect(image, input_size=input_size, max_num=max_num, metric=metric)
+        self.detection_stats.record(key, bboxes.shape[0] > 0, (time.perf_counter() - started) * 1000)
+        return bboxes, kpss
+
+    def _detect_tiled(self, image: np.ndarray, profile: ModelProfile, input_size, bboxes, kpss):
+        """Add detections from overlapping tiles, then merge duplicates with NMS"""
+        height, width = image.shape[:2]
+        grid = profile.tiles
+        step_y, step_x = height / grid, width / grid
+        pad_y, pad_x = int(step_y * 0.15), int(step_x * 0.15)
+        # Tiles are smaller than the frame, so they do not need the full-frame input size
+        tile_size = None if input_size is None else tuple(min(v, 640) for v in input_size)
+        all_boxes, all_kps = [bboxes], [kpss]
+        for row in range(grid):
+            for col in range(grid):
+                y0, x0 = max(0, int(row * step_y) - pad_y), max(0, int(col * step_x) - pad_x)
+                y1, x1 = min(height, int((row + 1) * step_y) + pad_y), min(width, int((col + 1) * step_x) + pad_x)
+                tile_boxes, tile_kps = self._run_detector(image[y0:y1, x0:x1], tile_size, 0, f"{profile.name}@tile{grid}")
+                if tile_boxes.shape[0]:
+                    tile_boxes[:, [0, 2]] += x0
+                    tile_boxes[:, [1, 3]] += y0
+                    if tile_kps is not None:
+                        tile_kps = tile_kps + np.array([x0, y0], dtype=tile_kps.dtype)
+                    all_boxes.append(tile_boxes)
+                    all_kps.append(tile_kps)
+        merged = np.vstack(all_boxes)
+        merged_kps = None if any(k is None for k in all_kps) else np.vstack(all_kps)
+        return _nms(merged, merged_kps) if merged.shape[0] else (merged, merged_kps)
+
+    def detect(
+        self,
+        image: np.ndarray,
+        profile: Optional[ModelProfile] = None,
+        max_num: Optional[int] = None,
+        face_policy: Optional[str] = None
+    ) -> List[Face]:
+        """Run only the detector: faces carry bbox, kps and det_score but no embedding
+
+        Walks the profile's det_sizes ladder and stops at the first scale that
+        finds a face, so close-ups pay only for the smallest input. With a
+        "largest" or "central" face policy (the profile's unless overridden)
+        the detector keeps only that one face.
+        """
+        profile = profile or get_profile("enroll-quality")
+        face_policy = face_policy or profile.face_policy
+        metric = FACE_POLICIES[face_policy] or "default"
+        if FACE_POLICIES[face_policy]:
+            max_num = 1
+        max_num = profile.max_num if max_num is None else max_num
+        sizes = [None] if self._fixed_det_size else profile.det_sizes
+        for input_size in sizes:
+            key = f"{profile.name}@{input_size[0] if input_size else 'fixed'}"
+            bboxes, kpss = self._run_detector(image, input_size, 0 if profile.tiles > 1 else max_num, key, metric)
+            if profile.tiles > 1:
+                bboxes, kpss = self._detect_tiled(image, profile, input_size, bboxes, kpss)
+                if max_num and bboxes.shape[0] > max_num:
+                    bboxes, kpss = bboxes[:max_num], kpss[:max_num] if kpss is not None else None
+            if bboxes.shape[0]:
+                break
+        return [
+            Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for i in range(bboxes.shape[0])
+        ]
+
+    def align(self, image: np.ndarray, face: Face) -> np.ndarray:
+        """Similarity-transform a detected face to the recognition model's input crop"""
+        return face_align.norm_crop(image, landmark=face.kps, image_size=self.recognition_model.input_size[0])
+
+    def embed_crops(self, crops: List[np.ndarray]) -> np.ndarray:
+        """Run recognition on aligned crops in one batched ONNX call -> (N, dim)"""
+        rec = self.recognition_model
+        if isinstance(rec.input_shape[0], int) and rec.input_shape[0] == 1:
+            # Model exported with a fixed batch of one
+            return np.vstack([rec.get_feat(crop) for crop in crops])
+        return rec.get_feat(list(crops))
+
 # Global singleton instance
 face_model = InsightFaceModel()
\ No newline at end of file
@@ -1,6 +1,7 @@
 """Compare face embeddings"""
 import numpy as np
-from typing import Tuple, List
+from abc import ABC, abstractmethod
+from typing import Tuple, List, Optional, Union
 from ..core.config import settings
 
 def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
@@ -8,64 +9,286 @@ def cosine_similarity(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
     # Normalize the embeddings
     norm1 = np.linalg.norm(embedding1)
     norm2 = np.linalg.norm(embedding2)
-    
+
     if norm1 == 0 or norm2 == 0:
         return 0.0
-    
+
     # Calculate cosine similarity
     similarity = np.dot(embedding1, embedding2) / (norm1 * norm2)
     return float(similarity)
 
+def normalize_embeddings(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize embeddings row-wise into a contiguous float32 array
+
+    Zero vectors stay zero so they score 0.0 against every probe.
+    """
+    matrix = np.array(vectors, dtype=np.float32, copy=True, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return np.ascontiguousarray(matrix)
+
+class GallerySearch(ABC):
+    """Common matcher interface: subclasses implement search() and __len__()"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def search(self, target_embedding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        """Return the top-k (id, similarity) pairs, best first"""
+
+    def search_many(self, target_embeddings: np.ndarray, k: int = 1) -> List[List[Tuple[int, float]]]:
+        """Top-k search for each row of a probe matrix"""
+        return [self.search(probe, k) for probe in np.atleast_2d(target_embeddings)]
+
+    def best_match(self, target_embedding: np.ndarray, threshold: float = None) -> Tuple[Optional[int], float, bool, float]:
+        """Find the best matching gallery entry
+
+        Returns:
+            Tuple[best_id, best_similarity, is_match, margin] where margin is the
+            gap between the best and second-best similarity.
+        """
+        if threshold is None:
+            threshold = settings.face_similarity_threshold
+        top = self.search(target_embedding, k=2)
+        if not top:
+            return None, 0.0, False, 0.0
+        best_id, best_similarity = top[0]
+        second = top[1][1] if len(top) > 1 else 0.0
+        return best_id, best_similarity, best_similarity >= threshold, best_similarity - second
+
+class EmbeddingGallery(GallerySearch):
+    """Pre-normalized gallery matrix with a parallel id array
+
+    Every probe is scored with a single matrix-vector product, so matching
+    cost no longer grows with per-candidate Python overhead.
+    """
+
+    def __init__(self, ids: Optional[np.ndarray] = None, vectors: Optional[np.ndarray] = None, normalized: bool = False):
+        self._compressed = {}
+        if ids is None or len(ids) == 0:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.matrix = np.empty((0, 0), dtype=np.float32)
+            return
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if normalized:
+            self.matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        else:
+            self.matrix = normalize_embeddings(vectors)
+        if self.matrix.shape[0] != self.ids.shape[0]:
+            raise ValueError("Gallery ids and vectors must have the same length")
+
+    @classmethod
+    def from_candidates(cls, candidates: List[Tuple[int, np.ndarray]]) -> "EmbeddingGallery":
+        """Build a gallery from (id, embedding) tuples"""
+        if not candidates:
+            return cls()
+        ids = np.fromiter((int(c[0]) for c in candidates), dtype=np.int64, count=len(candidates))
+        vectors = np.stack([np.asarray(c[1], dtype=np.float32).ravel() for c in candidates])
+        return cls(ids, vectors)
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.matrix.shape[1]) if len(self) else 0
+
+    def scores(self, target_embedding: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the probe against every gallery entry"""
+        if not len(self):
+            return np.empty(0, dtype=np.float32)
+        probe = normalize_embeddings(np.asarray(target_embedding).ravel())[0]
+        return self.matrix @ probe
+
+    def search(self, target_embedding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        """Return the top-k (id, similarity) pairs, best first"""
+        scores = self.scores(target_embedding)
+        return top_k_from_scores(self.ids, scores, k)
+
+    def search_many(self, target_embeddings: np.ndarray, k: int = 1) -> List[List[Tuple[int, float]]]:
+        """Score every probe against the gallery with one matrix-matrix product"""
+        probes = normalize_embeddings(target_embeddings)
+        if not len(self):
+            return [[] for _ in range(probes.shape[0])]
+        scores = probes @ self.matrix.T
+        return [top_k_from_scores(self.ids, row, k) for row in scores]
+
+    def score_matrix(self, target_embeddings: np.ndarray) -> np.ndarray:
+        """(probes x gallery) cosine similarity matrix"""
+        probes = normalize_embeddings(target_embeddings)
+        if not len(self):
+            return np.empty((probes.shape[0], 0), dtype=np.float32)
+        return probes @ self.matrix.T
+
+    def compressed(self, precision: str) -> GallerySearch:
+        """This gallery scanned at reduced precision (built once per gallery; float32 is the gallery itself)"""
+        if precision == "float32" or not len(self):
+            return self
+        cached = self._compressed.get(precision)
+        if cached is None:
+            cached = self._compressed[precision] = QuantizedGallery(self, precision)
+        return cached
+
+GALLERY_PRECISIONS = ("float32", "float16", "int8")
+
+class QuantizedGallery(GallerySearch):
+    """Reduced-precision copy of an EmbeddingGallery, re-ranked in float32
+
+    float16 halves and int8 (symmetric, one scale per vector) quarters the
+    bytes read per probe. The scan picks ``gallery_rerank_candidates``
+    candidates from the compressed codes and re-scores them against the
+    exact float32 rows, so returned similarities are exact; only a true
+    match missing from the candidate list is lost.
+
+    numpy has no fast float16/int8 GEMM, so codes are widened to float32 a
+    block of rows at a time and scored with BLAS while the block is in cache.
+    """
+
+    block_rows = 4096
+
+    def __init__(self, exact: EmbeddingGallery, precision: str):
+        if precision not in GALLERY_PRECISIONS[1:]:
+            raise ValueError(f"Unknown gallery precision {precision!r}; use one of {GALLERY_PRECISIONS}")
+        self.exact = exact
+        self.ids = exact.ids
+        self.precision = precision
+        if precision == "float16":
+            self.codes = exact.matrix.astype(np.float16)
+            self.scales = None
+        else:
+            scales = np.abs(exact.matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes = np.round(exact.matrix / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory scanned per probe"""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, probes: np.ndarray) -> np.ndarray:
+        """(probes x gallery) similarities from the compressed codes"""
+        scores = np.empty((probes.shape[0], len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = self.codes[start:start + self.block_rows].astype(np.float32)
+            scores[:, start:start + block.shape[0]] = probes @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _rerank(self, probe: np.ndarray, approximate: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        n = approximate.shape[0]
+        candidates = min(n, max(k, settings.gallery_rerank_candidates))
+        # Rows stay in gallery order so exact ties rank as in the float32 gallery
+        rows = np.sort(np.argpartition(-approximate, candidates - 1)[:candidates]) if candidates < n else np.arange(n)
+        return top_k_from_scores(self.ids[rows], self.exact.matrix[rows] @ probe, k)
+
+    def search(self, target_embedding: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        return self.search_many(np.asarray(target_embedding).reshape(1, -1), k)[0]
+
+    def search_many(self, target_embeddings: np.ndarray, k: int = 1) -> List[List[Tuple[int, float]]]:
+        probes = normalize_embeddings(target_embeddings)
+        if not len(self) or k <= 0:
+            return [[] for _ in range(probes.shape[0])]
+        approximate = self.approximate_scores(probes)
+        return [self._rerank(probe, row, k) for probe, row in zip(probes, approximate)]
+
+def top_k_from_scores(ids: np.ndarray, scores: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Select the k highest scores with argpartition and return them sorted
+
+    Equal scores keep their order in ``ids``, so ties break the same way
+    whichever subset of a gallery is scored.
+    """
+    n = scores.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    k = min(k, n)
+    if k == 1:
+        idx = np.array([int(np.argmax(scores))])
+    elif k < n:
+        idx = np.sort(np.argpartition(-scores, k - 1)[:k])
+        idx = idx[np.argsort(-scores[idx], kind="stable")]
+    else:
+        idx = np.argsort(-scores, kind="stable")
+    return [(int(ids[i]), float(scores[i])) for i in idx]
+
+def assign_one_to_one(scores: np.ndarray, threshold: float) -> List[Tuple[int, int, float]]:
+    """Greedy one-to-one assignment of probes (rows) to gallery entries (columns)
+
+    Pairs are taken in descending similarity; a probe or gallery entry that
+    is already assigned is skipped, so no identity is matched twice.
+
+    Returns:
+        List of (probe_index, gallery_index, similarity) for pairs >= threshold
+    """
+    if scores.size == 0:
+        return []
+    rows, cols = np.nonzero(scores >= threshold)
+    order = np.argsort(-scores[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for i in order.tolist():
+        row, col = int(rows[i]), int(cols[i])
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        pairs.append((row, col, float(scores[row, col])))
+    return pairs
+
 def match_faces(embedding1: np.ndarray, embedding2: np.ndarray, threshold: float = None) -> Tuple[bool, float]:
     """Check if two embeddings match based on similarity threshold
-    
+
     Args:
         embedding1: First face embedding
         embedding2: Second face embedding
         threshold: Similarity threshold (uses config default if None)
-    
+
     Returns:
         Tuple[is_match, similarity_score]
     """
     if threshold is None:
         threshold = settings.face_similarity_threshold
-    
+
     similarity = cosine_similarity(embedding1, embedding2)
     is_match = similarity >= threshold
-    
+
     return is_match, similarity
 
-def find_best_match(target_embedding: np.ndarray, candidate_embeddings: List[Tuple[int, np.ndarray]], threshold: float = None) -> Tuple[int, float, bool]:
+def find_best_match(
+    target_embedding: np.ndarray,
+    candidate_embeddings: Union[GallerySearch, List[Tuple[int, np.ndarray]]],
+    threshold: float = None
+) -> Tuple[int, float, bool]:
     """Find the best matching embedding from a list of candidates
-    
+
     Args:
         target_embedding: The embedding to match against
-        candidate_embeddings: List of (student_id, embedding) tuples
+        candidate_embeddings: GallerySearch or list of (student_id, embedding) tuples
         threshold: Similarity threshold
-    
+
     Returns:
         Tuple[best_student_id, best_similarity, is_match]
     """
-    if not candidate_embeddings:
+    if isinstance(candidate_embeddings, GallerySearch):
+        gallery = candidate_embeddings
+    else:
+        gallery = EmbeddingGallery.from_candidates(candidate_embeddings)
+
+    if not len(gallery):
         print("⚠️ No candidate embeddings provided")
         return None, 0.0, False
-    
+
     if threshold is None:
         threshold = settings.face_similarity_threshold
-    
-    print(f"🔍 Matching against {len(candidate_embeddings)} candidates with threshold {threshold}")
-    
-    best_student_id = None
-    best_similarity = 0.0
-    
-    for student_id, candidate_embedding in candidate_embeddings:
-        similarity = cosine_similarity(target_embedding, candidate_embedding)
-        print(f"  Student {student_id}: similarity = {similarity:.4f}")
-        if similarity > best_similarity:
-            best_similarity = similarity
-            best_student_id = student_id
-    
-    is_match = best_similarity >= threshold
-    print(f"{'✅' if is_match else '❌'} Best match: Student {best_student_id} with {best_similarity:.4f} (threshold: {threshold})")
-    
-    return best_student_id, best_similarity, is_match
\ No newline at end of file
+
+    best_student_id, best_similarity, is_match, margin = gallery.best_match(target_embedding, threshold)
+    print(f"{'✅' if is_match else '❌'} Best match: Student {best_student_id} with {best_similarity:.4f} "
+          f"(threshold: {threshold}, margin: {margin:.4f}, candidates: {len(gallery)})")
+
+    return best_student_id, best_similarity, is_match
@@ -0,0 +1,120 @@
+"""Named inference profiles (detector resolution and limits per endpoint)"""
+from typing import Dict, List, Optional, Tuple
+from ..core.config import settings
+
+class QualityThresholds:
+    """Limits of the pre-recognition quality gate (see validator.check_quality_gate)"""
+
+    def __init__(
+        self,
+        min_face: float = 0,
+        max_yaw: float = 90,
+        max_pitch: float = 90,
+        min_sharpness: float = 0,
+        min_brightness: float = 0,
+        max_brightness: float = 255,
+    ):
+        self.min_face = min_face  # shorter box side, original pixels
+        self.max_yaw = max_yaw  # degrees, estimated from landmarks
+        self.max_pitch = max_pitch
+        self.min_sharpness = min_sharpness  # Laplacian variance of the aligned crop
+        self.min_brightness = min_brightness  # mean gray level of the aligned crop
+        self.max_brightness = max_brightness
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["QualityThresholds"]:
+        """Parse "min_face=64,max_yaw=35" (unset keys keep permissive defaults; empty disables the gate)"""
+        values = {}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            key, _, value = item.partition("=")
+            if key.strip() not in cls().__dict__:
+                raise ValueError(f"Unknown quality threshold: {key.strip()}")
+            values[key.strip()] = float(value)
+        return cls(**values) if values else None
+
+    def __repr__(self) -> str:
+        return f"QualityThresholds({', '.join(f'{k}={v:g}' for k, v in self.__dict__.items())})"
+
+# How single-face endpoints treat several faces in one frame:
+#   all      detect every face; more than one is rejected ("Multiple faces detected")
+#   largest  keep only the largest face (detector metric "max")
+#   central  keep the largest face weighted towards the image centre (metric "default")
+FACE_POLICIES = {"all": None, "largest": "max", "central": "default"}
+
+class ModelProfile:
+    """How an endpoint runs the shared detector
+
+    All profiles use the one loaded FaceAnalysis instance (detection +
+    recognition modules only) and the same recognition model, so their
+    embeddings are always comparable with the enrolled gallery. They differ
+    in detector input sizes, face limits and quality gate thresholds.
+
+    det_sizes is a ladder: the detector runs at the first (smallest) size and
+    only retries at the next one when nothing was found. tiles > 1 adds an
+    overlapping tiles x tiles pass for photos with many small faces.
+    quality (None disables the gate) rejects faces before recognition runs.
+    face_policy (see FACE_POLICIES) lets the detector itself keep only one
+    face (max_num=1), so bystanders cost neither alignment nor recognition.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        det_sizes: List[Tuple[int, int]],
+        max_num: int = 0,
+        tiles: int = 0,
+        quality: Optional[QualityThresholds] = None,
+        face_policy: str = "all"
+    ):
+        if face_policy not in FACE_POLICIES:
+            raise ValueError(f"Unknown face policy {face_policy!r} for profile {name}; use one of {sorted(FACE_POLICIES)}")
+        self.name = name
+        self.det_sizes = det_sizes
+        self.max_num = max_num
+        self.tiles = tiles
+        self.quality = quality
+        self.face_policy = face_policy
+
+    @property
+    def det_size(self) -> Tuple[int, int]:
+        """Largest detector input in the ladder"""
+        return max(self.det_sizes)
+
+    def __repr__(self) -> str:
+        return (f"ModelProfile({self.name!r}, det_sizes={self.det_sizes}, max_num={self.max_num}, "
+                f"tiles={self.tiles}, quality={self.quality}, face_policy={self.face_policy!r})")
+
+def _ladder(sizes: str) -> List[Tuple[int, int]]:
+    """Parse "320,640" into [(320, 320), (640, 640)], smallest first"""
+    values = sorted({int(v) for v in sizes.split(",") if v.strip()})
+    return [(v, v) for v in values]
+
+def _build_profiles() -> Dict[str, ModelProfile]:
+    return {
+        # Kiosk / selfie verification: one large face close to the camera
+        "verify-fast": ModelProfile(
+            "verify-fast", _ladder(settings.profile_verify_det_sizes),
+            quality=QualityThresholds.parse(settings.profile_verify_quality),
+            face_policy=settings.profile_verify_face_policy
+        ),
+        # Enrollment: slower, full resolution detector and a stricter gate for the best template
+        "enroll-quality": ModelProfile(
+            "enroll-quality", _ladder(settings.profile_enroll_det_sizes),
+            quality=QualityThresholds.parse(settings.profile_enroll_quality),
+            face_policy=settings.profile_enroll_face_policy
+        ),
+        # Inside a client-provided face box, or a padded client-aligned crop
+        "roi": ModelProfile("roi", _ladder(settings.profile_roi_det_sizes)),
+        # Classroom photos: many small faces
+        "group": ModelProfile("group", _ladder(settings.profile_group_det_sizes), tiles=settings.profile_group_tiles),
+    }
+
+MODEL_PROFILES = _build_profiles()
+
+def get_profile(name: str) -> ModelProfile:
+    profile = MODEL_PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown model profile: {name}")
+    return profile
@@ -0,0 +1,156 @@
+"""Per-session face tracking for streaming recognition"""
+import numpy as np
+from collections import Counter, deque
+from typing import List, Optional
+from ..core.config import settings
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """Intersection over union of two [x1, y1, x2, y2] boxes"""
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+class Track:
+    """One face followed across frames, with a window of recent match observations"""
+
+    def __init__(self, track_id: int, face, history: int):
+        self.track_id = track_id
+        self.face = face
+        self.hits = 1
+        self.missed = 0
+        self.frames_since_recognition: Optional[int] = None  # None until first recognized
+        self.observations = deque(maxlen=history)  # (student_id or None, similarity)
+        self.student_id: Optional[int] = None
+        self.confidence: Optional[float] = None
+        self.reused = False  # True when this frame's identity came from the track
+        self.quality_issue: Optional[str] = None  # quality gate reason when this frame was not recognized
+
+    @property
+    def box(self) -> np.ndarray:
+        return self.face.bbox
+
+    @property
+    def area(self) -> float:
+        box = self.box
+        return float((box[2] - box[0]) * (box[3] - box[1]))
+
+class FaceTracker:
+    """Greedy IoU tracker with temporally smoothed identities
+
+    Detections are associated with live tracks by box IoU; when a fast
+    movement breaks the overlap, a small landmark displacement still keeps
+    the track. A track whose smoothed similarity clears the threshold by
+    ``reuse_margin`` skips recognition and matching on later frames until
+    ``reverify_frames`` have passed, so a student standing at the kiosk
+    costs only detection per frame.
+
+    Smoothing: a track's identity is the student seen in the majority of its
+    last ``history`` observations, with their mean similarity. One blurred
+    frame just below the threshold no longer rejects a student who matched
+    on the frames around it, and a single stray match cannot flip identity.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: Optional[float] = None,
+        max_missed: Optional[int] = None,
+        history: Optional[int] = None,
+        reuse_margin: Optional[float] = None,
+        reverify_frames: Optional[int] = None,
+    ):
+        self.iou_threshold = settings.track_iou_threshold if iou_threshold is None else iou_threshold
+        self.max_missed = settings.track_max_missed if max_missed is None else max_missed
+        self.history = settings.track_history if history is None else history
+        self.reuse_margin = settings.track_reuse_margin if reuse_margin is None else reuse_margin
+        self.reverify_frames = settings.track_reverify_frames if reverify_frames is None else reverify_frames
+        self.tracks: List[Track] = []
+        self._next_id = 1
+
+    def _landmark_match(self, track: Track, face) -> bool:
+        if track.face.kps is None or face.kps is None:
+            return False
+        box = track.box
+        size = max(box[2] - box[0], box[3] - box[1])
+        return float(np.mean(np.linalg.norm(track.face.kps - face.kps, axis=1))) < 0.5 * size
+
+    def update(self, faces: list) -> List[Track]:
+        """Associate this frame's detections with tracks; returns the tracks seen in the frame"""
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for f, face in enumerate(faces):
+                iou = box_iou(track.box, face.bbox)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t, f))
+                elif self._landmark_match(track, face):
+                    pairs.append((self.iou_threshold * iou, t, f))
+        pairs.sort(key=lambda p: p[0], reverse=True)
+
+        matched_tracks, matched_faces, seen = set(), set(), []
+        for _, t, f in pairs:
+            if t in matched_tracks or f in matched_faces:
+                continue
+            matched_tracks.add(t)
+            matched_faces.add(f)
+            track = self.tracks[t]
+            track.face = faces[f]
+            track.hits += 1
+            track.missed = 0
+            seen.append(track)
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    continue
+            survivors.append(track)
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                track = Track(self._next_id, face, self.history)
+                self._next_id += 1
+                survivors.append(track)
+                seen.append(track)
+        self.tracks = survivors
+
+        for track in seen:
+            track.quality_issue = None
+            if track.frames_since_recognition is not None:
+                track.frames_since_recognition += 1
+            track.reused = not self.needs_recognition(track)
+        return seen
+
+    def needs_recognition(self, track: Track) -> bool:
+        """False while a confidently identified track is inside its re-verification window"""
+        if track.student_id is None or track.frames_since_recognition is None:
+            return True
+        if track.confidence < settings.face_similarity_threshold + self.reuse_margin:
+            return True
+        return track.frames_since_recognition >= self.reverify_frames
+
+    def observe(self, track: Track, student_id: Optional[int], similarity: float, threshold: float) -> None:
+        """Record a recognition result for a track and recompute its smoothed identity"""
+        track.observations.append((student_id, similarity))
+        track.frames_since_recognition = 0
+        track.reused = False
+
+        votes = Counter(sid for sid, _ in track.observations if sid is not None)
+        track.student_id, track.confidence = None, similarity
+        if not votes:
+            return
+        leader, count = votes.most_common(1)[0]
+        mean = float(np.mean([sim for sid, sim in track.observations if sid == leader]))
+        if count * 2 > len(track.observations) and mean >= threshold:
+            track.student_id, track.confidence = leader, mean
+
+    def invalidate(self) -> None:
+        """Force recognition on every track's next frame (e.g. after the gallery changed)"""
+        for track in self.tracks:
+            track.frames_since_recognition = None
+
+    def primary(self, tracks: List[Track]) -> Optional[Track]:
+        """The largest face in the frame (the one standing at the kiosk)"""
+        return max(tracks, key=lambda t: t.area) if tracks else None
@@ -1,18 +1,215 @@
 """Face validation and quality checks"""
+import cv2
+import numpy as np
+from typing import List, Optional, Tuple, Union
 from .insightface_model import face_model
+from .profiles import QualityThresholds, get_profile
 
-def validate_single_face(image):
+class FaceAnalysisResult:
+    """Detector output for one decoded image, computed once and shared
+
+    Validation, quality checks and embedding extraction all read this object
+    instead of running the model again. Aligned crops and embeddings are
+    computed lazily per face and cached.
+    """
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        faces: list,
+        scale: float = 1.0,
+        profile: str = "verify-fast",
+        face_policy: str = "all"
+    ):
+        self.image = image  # decoded working-size RGB image
+        self.faces = faces  # detector output: bbox, kps, det_score
+        self.scale = scale  # original pixels per working pixel
+        self.profile = profile
+        self.face_policy = face_policy  # "all" unless the detector already kept a single face
+        self._crops = {}
+        self._embeddings = {}
+
+    @property
+    def face_count(self) -> int:
+        return len(self.faces)
+
+    def face_area(self, index: int) -> float:
+        x1, y1, x2, y2 = self.faces[index].bbox
+        return float((x2 - x1) * (y2 - y1))
+
+    def largest_face_index(self) -> Optional[int]:
+        if not self.faces:
+            return None
+        return max(range(len(self.faces)), key=self.face_area)
+
+    def select_face(self, face_policy: str) -> Optional[int]:
+        """Index of the face a single-face endpoint uses (None: no face, or several under "all")"""
+        if not self.faces:
+            return None
+        if face_policy == "all":
+            return 0 if len(self.faces) == 1 else None
+        if face_policy == "largest":
+            return self.largest_face_index()
+        # central: the detector's "default" metric, area minus twice the squared centre offset
+        height, width = self.image.shape[:2]
+        def centred_area(index: int) -> float:
+            x1, y1, x2, y2 = self.faces[index].bbox
+            offset = ((x1 + x2) / 2 - width // 2) ** 2 + ((y1 + y2) / 2 - height // 2) ** 2
+            return self.face_area(index) - 2.0 * float(offset)
+        return max(range(len(self.faces)), key=centred_area)
+
+    def box(self, index: int) -> List[float]:
+        """Face box in original image pixels"""
+        return [float(v) * self.scale for v in self.faces[index].bbox]
+
+    def aligned_crop(self, index: int = 0) -> np.ndarray:
+        if index not in self._crops:
+            self._crops[index] = face_model.align(self.image, self.faces[index])
+        return self._crops[index]
+
+    def aligned_crops(self) -> List[np.ndarray]:
+        return [self.aligned_crop(i) for i in range(len(self.faces))]
+
+    def embedding(self, index: int = 0) -> np.ndarray:
+        """Recognition output for one face (blocking; async paths use the batcher on aligned_crop)"""
+        if index not in self._embeddings:
+            self._embeddings[index] = face_model.embed_crops([self.aligned_crop(index)])[0]
+        return self._embeddings[index]
+
+def analyze_image(
+    image: np.ndarray,
+    profile: str = "verify-fast",
+    scale: float = 1.0,
+    face_policy: Optional[str] = None
+) -> FaceAnalysisResult:
+    """Run the detector once for a decoded RGB image
+
+    ``face_policy`` overrides the profile's (see profiles.FACE_POLICIES);
+    paths that need every face, like /face/detect and streaming, pass "all".
+    """
+    model_profile = get_profile(profile)
+    face_policy = face_policy or model_profile.face_policy
+    faces = face_model.detect(image, model_profile, face_policy=face_policy)
+    return FaceAnalysisResult(image, faces, scale, profile, face_policy)
+
+def _as_analysis(analysis: Union[FaceAnalysisResult, np.ndarray]) -> FaceAnalysisResult:
+    # Raw images are still accepted; they are analyzed once here
+    return analysis if isinstance(analysis, FaceAnalysisResult) else analyze_image(analysis)
+
+def validate_single_face(analysis: Union[FaceAnalysisResult, np.ndarray]) -> Tuple[bool, int]:
     """Ensure only one face is detected"""
-    model = face_model.get_model()
-    faces = model.get(image)
-    return len(faces) == 1, len(faces)
-
-def check_face_quality(image):
-    """Check face quality and pose"""
-    model = face_model.get_model()
-    faces = model.get(image)
-    if faces:
-        face = faces[0]
-        # Basic quality checks
-        return True, "Good quality"
-    return False, "No face detected"
\ No newline at end of file
+    analysis = _as_analysis(analysis)
+    return analysis.face_count == 1, analysis.face_count
+
+def single_face_error(analysis: FaceAnalysisResult) -> Optional[str]:
+    """User-facing reason the image does not contain exactly one face (None if it does)"""
+    if analysis.face_count == 0:
+        return "No face detected in image"
+    if analysis.face_count > 1:
+        return "Multiple faces detected. Please ensure only one face is visible"
+    return None
+
+def estimate_pose(kps: np.ndarray) -> Tuple[float, float]:
+    """Rough (yaw, pitch) in degrees from the 5 detector landmarks
+
+    After removing roll (eye line made horizontal), yaw follows the nose's
+    horizontal position between the eyes and pitch its vertical position
+    between the eye line and the mouth line; both are 0 for a frontal face.
+    """
+    left_eye, right_eye, nose, left_mouth, right_mouth = np.asarray(kps, dtype=np.float64)
+    dx, dy = right_eye - left_eye
+    eye_distance = np.hypot(dx, dy)
+    if eye_distance < 1e-6:
+        return 90.0, 90.0
+    cos, sin = dx / eye_distance, dy / eye_distance
+    rotate = lambda p: np.array([cos * p[0] + sin * p[1], -sin * p[0] + cos * p[1]])
+    eye_l, eye_r, nose = rotate(left_eye), rotate(right_eye), rotate(nose)
+    mouth = (rotate(left_mouth) + rotate(right_mouth)) / 2
+
+    horizontal = (nose[0] - eye_l[0]) / (eye_r[0] - eye_l[0])  # 0.5 when frontal
+    yaw = np.degrees(np.arcsin(np.clip(2 * horizontal - 1, -1, 1)))
+    eye_y = (eye_l[1] + eye_r[1]) / 2
+    face_height = mouth[1] - eye_y
+    if face_height < 1e-6:
+        return float(abs(yaw)), 90.0
+    vertical = (nose[1] - eye_y) / face_height  # about 0.5 when frontal (ArcFace template: 0.495)
+    pitch = np.degrees(np.arcsin(np.clip(2 * vertical - 1, -1, 1)))
+    return float(abs(yaw)), float(abs(pitch))
+
+def face_quality_metrics(analysis: FaceAnalysisResult, index: int = 0) -> dict:
+    """Size, pose, sharpness and brightness of one face
+
+    Sharpness (Laplacian variance) and brightness are measured on the
+    112x112 aligned crop, so they do not depend on image resolution; the
+    crop is cached on the analysis and reused by recognition.
+    """
+    face = analysis.faces[index]
+    x1, y1, x2, y2 = face.bbox
+    gray = cv2.cvtColor(analysis.aligned_crop(index), cv2.COLOR_RGB2GRAY)
+    yaw, pitch = estimate_pose(face.kps) if face.kps is not None else (0.0, 0.0)
+    return {
+        "face": float(min(x2 - x1, y2 - y1) * analysis.scale),
+        "yaw": yaw,
+        "pitch": pitch,
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+    }
+
+# Gate failures in check order: (label for /face/detect, reason shown to the user)
+QUALITY_REASONS = {
+    "min_face": ("poor", "Face too small - move closer to the camera"),
+    "max_yaw": ("poor", "Face turned sideways - look straight at the camera"),
+    "max_pitch": ("poor", "Face tilted up or down - look straight at the camera"),
+    "min_brightness": ("dark", "Image too dark - improve lighting"),
+    "max_brightness": ("poor", "Image overexposed - avoid strong light behind or on the face"),
+    "min_sharpness": ("blurry", "Image too blurry - hold the camera steady"),
+}
+
+def quality_failure(metrics: dict, thresholds: QualityThresholds) -> Optional[str]:
+    """First threshold the metrics violate (a QUALITY_REASONS key), or None"""
+    checks = {
+        "min_face": metrics["face"] < thresholds.min_face,
+        "max_yaw": metrics["yaw"] > thresholds.max_yaw,
+        "max_pitch": metrics["pitch"] > thresholds.max_pitch,
+        "min_brightness": metrics["brightness"] < thresholds.min_brightness,
+        "max_brightness": metrics["brightness"] > thresholds.max_brightness,
+        "min_sharpness": metrics["sharpness"] < thresholds.min_sharpness,
+    }
+    return next((key for key in QUALITY_REASONS if checks[key]), None)
+
+def check_quality_gate(analysis: FaceAnalysisResult, index: int = 0, profile: Optional[str] = None) -> Optional[str]:
+    """Reason to reject a face before recognition under the profile's thresholds (None to accept)"""
+    thresholds = get_profile(profile or analysis.profile).quality
+    if thresholds is None:
+        return None
+    failure = quality_failure(face_quality_metrics(analysis, index), thresholds)
+    return QUALITY_REASONS[failure][1] if failure else None
+
+def assess_face_quality(analysis: FaceAnalysisResult, index: int = 0) -> Tuple[str, float]:
+    """Quality label (good, poor, blurry or dark) and 0..1 score for a detected face
+
+    The label follows the verification gate; the score is the weakest of
+    size, pose, sharpness and exposure, each relative to its threshold.
+    """
+    thresholds = get_profile("verify-fast").quality or QualityThresholds()
+    metrics = face_quality_metrics(analysis, index)
+    failure = quality_failure(metrics, thresholds)
+    margins = [
+        metrics["face"] / max(thresholds.min_face * 2, 1.0),
+        1.0 - metrics["yaw"] / 90.0,
+        1.0 - metrics["pitch"] / 90.0,
+        metrics["sharpness"] / max(thresholds.min_sharpness * 4, 1.0),
+        1.0 - abs(metrics["brightness"] - 128.0) / 128.0,
+    ]
+    score = round(float(np.clip(min(margins), 0.0, 1.0)), 3)
+    return (QUALITY_REASONS[failure][0] if failure else "good"), score
+
+def check_face_quality(analysis: Union[FaceAnalysisResult, np.ndarray], index: int = 0) -> Tuple[bool, str]:
+    """Check face quality and pose against the analysis profile's gate"""
+    analysis = _as_analysis(analysis)
+    if not analysis.face_count:
+        return False, "No face detected"
+    reason = check_quality_gate(analysis, index)
+    if reason:
+        return False, reason
+    return True, "Good quality"
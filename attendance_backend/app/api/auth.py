@@ -1,6 +1,6 @@
 """Authentication endpoints"""
 from datetime import timedelta
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
 from sqlalchemy.orm import Session
 from ..core.security import create_access_token
 from ..core.config import settings
@@ -8,7 +8,7 @@ from ..db.base import get_db
 from ..db import crud
 from ..services.teacher_service import TeacherService
 from ..services.teacher_face_service import TeacherFaceService
-from typing import Union
+from typing import Optional, Union
 from ..schemas.teacher import TeacherLogin, TeacherLoginLegacy, TokenResponse, TeacherResponse
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -53,9 +53,32 @@ async def login(login_data: Union[TeacherLogin, TeacherLoginLegacy], db: Session
     )
 
 @router.post("/face-login", response_model=TokenResponse)
-async def face_login(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """Login using Face ID"""
+async def face_login(
+    file: UploadFile = File(...),
+    org_code: Optional[str] = Form(None),
+    identifier: Optional[str] = Form(None),
+    db: Session = Depends(get_db)
+):
+    """Login using Face ID
+    
+    ``identifier`` (email or teacher ID) makes this a 1:1 check against that
+    teacher's Face ID; ``org_code`` limits the search to one organization.
+    Without either, every enrolled teacher is searched.
+    """
     try:
+        org_id = None
+        if org_code:
+            organization = crud.get_organization_by_code(db, org_code)
+            if not organization:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown organization code")
+            org_id = organization.id
+        claimed_teacher_id = None
+        if identifier:
+            claimed = crud.get_teacher_by_email(db, identifier) or crud.get_teacher_by_teacher_id(db, identifier)
+            if not claimed or (org_id is not None and claimed.organization_id != org_id):
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Face not recognized")
+            claimed_teacher_id = claimed.id
+
         allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
         is_image_type = file.content_type and file.content_type.startswith('image/')
         has_image_ext = any(file.filename.lower().endswith(ext) for ext in allowed_extensions) if file.filename else False
@@ -64,7 +87,9 @@ async def face_login(file: UploadFile = File(...), db: Session = Depends(get_db)
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an image")
 
         image_data = await file.read()
-        success, message, teacher_id, similarity, threshold = await teacher_face_service.verify_face_id(image_data, db)
+        success, message, teacher_id, similarity, threshold = await teacher_face_service.verify_face_id(
+            image_data, db, org_id=org_id, teacher_id=claimed_teacher_id
+        )
         if not success or not teacher_id:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=message)
 
@@ -7,6 +7,7 @@ from ..core.security import require_admin, require_admin_or_super_admin, verify_
 from ..db.base import get_db
 from ..db import crud
 from ..services.class_service import ClassService
+from ..ai.gallery import student_gallery
 
 router = APIRouter(prefix="/classes", tags=["classes"])
 class_service = ClassService()
@@ -215,6 +216,8 @@ async def update_class(
         
         if update_data:
             updated = crud.update_class(db, class_id, update_data)
+            if "organization_id" in update_data:
+                student_gallery.set_class_organization(class_id, updated.organization_id)
             return {
                 "success": True,
                 "id": updated.id,
@@ -246,6 +249,8 @@ async def delete_class(
                 raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied")
 
         result = crud.delete_class(db, class_id)
+        if result:
+            student_gallery.remove_class(class_id)
         return {"success": result}
     except Exception as e:
         return {"success": False, "error": str(e)}
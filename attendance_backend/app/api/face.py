@@ -1,27 +1,230 @@
 """Face registration and verification endpoints"""
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Form
-from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, status, Depends, Form, Query, WebSocket, WebSocketDisconnect
+from typing import Optional, List, Tuple
 from sqlalchemy.orm import Session
-from ..core.security import require_teacher, require_admin
-from ..db.base import get_db
+import asyncio
+import base64
+import binascii
+import time
+from ..core.config import settings
+from ..core.security import require_teacher, require_admin, verify_embedding_signature, authenticate_teacher_token
+from ..ai.gallery import student_gallery
+from ..ai.inference_executor import InferenceUnavailable
+from ..ai.tracker import FaceTracker
+from ..ai.detection_cache import CachedDetection, detection_cache
+from ..db.base import get_db, SessionLocal
 from ..services.face_service import FaceService
 from ..services.class_service import ClassService
 from ..services.attendance_service import AttendanceService
-from ..schemas.face import FaceRegisterResponse, FaceVerifyResponse
+from ..schemas.face import (
+    FaceRegisterResponse, FaceVerifyResponse, FaceSearchResponse, FaceSearchCandidate,
+    FaceBulkRegisterResponse, FaceBulkRegisterItem, FaceGroupResponse, FaceGroupMatch, FaceGroupUnmatched,
+    FaceVerifyBatchResponse, FaceEmbeddingVerifyRequest, FaceDetectResponse, FaceDetection
+)
 
 router = APIRouter(prefix="/face", tags=["face"])
 face_service = FaceService()
 class_service = ClassService()
 attendance_service = AttendanceService()
 
+def _ensure_image_upload(file: UploadFile) -> None:
+    """Reject uploads that are clearly not images (camera captures may lack a MIME type)"""
+    allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+    is_image_type = file.content_type and file.content_type.startswith('image/')
+    has_image_ext = any(file.filename.lower().endswith(ext) for ext in allowed_extensions) if file.filename else False
+    is_octet_stream = file.content_type == 'application/octet-stream'  # Sometimes sent by camera
+    
+    if not (is_image_type or has_image_ext or is_octet_stream):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File must be an image. Got: {file.content_type}, filename: {file.filename}"
+        )
+
+async def _read_upload_or_detection(
+    file: Optional[UploadFile],
+    detection_token: Optional[str],
+    current_user: dict
+) -> Tuple[bytes, Optional[CachedDetection]]:
+    """Image bytes for verify/register, reusing a /face/detect result when a live token is given"""
+    if detection_token:
+        detection = detection_cache.take(detection_token, current_user["user_id"])
+        if detection is not None:
+            # A token from another worker carries only the upload: decode and detect it again here
+            return detection.image_data, (detection if detection.analysis is not None else None)
+        if file is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Detection token expired or unknown; upload the image again"
+            )
+    if file is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Upload an image file or pass a detection_token")
+    # Validate file type - be lenient since camera captures may not have proper MIME type
+    _ensure_image_upload(file)
+    return await file.read(), None
+
+def _parse_hint(face_box: Optional[str], landmarks: Optional[str], aligned: bool) -> Optional[dict]:
+    """Parse the optional client face hint sent with /face/verify"""
+    if aligned:
+        return {"aligned": True}
+    if not face_box:
+        return None
+    try:
+        box = [float(v) for v in face_box.split(",")]
+        points = [float(v) for v in landmarks.split(",")] if landmarks else None
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="face_box and landmarks must be comma-separated numbers")
+    if len(box) != 4 or (points is not None and len(points) != 10):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="face_box needs 4 values (x1,y1,x2,y2) and landmarks 10 values (5 x,y points)"
+        )
+    return {"box": box, "landmarks": points}
+
+async def _verify_scope(class_id: Optional[int], current_user: dict, db: Session) -> Optional[List[int]]:
+    """Access check for verification; returns the class list to search when no class is given"""
+    if class_id:
+        has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
+        if not has_access:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this class")
+        return None
+    if current_user["role"] == "super_admin":
+        return None
+    accessible_classes = await class_service.get_accessible_classes(current_user, db)
+    if not accessible_classes:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No accessible classes")
+    return [cls.id for cls in accessible_classes]
+
+def _check_claim_scope(student_id: int, class_id: Optional[int], class_ids: Optional[List[int]], db: Session) -> None:
+    """A claimed student must belong to the class (or accessible classes) being verified"""
+    from ..db import crud
+    student = crud.get_student_by_id(db, student_id)
+    if not student:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
+    if (class_id and student.class_id != class_id) or (class_ids is not None and student.class_id not in class_ids):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this student")
+
+async def _verification_response(
+    db: Session,
+    success: bool,
+    message: str,
+    student_id: Optional[int],
+    confidence_score: Optional[float],
+    threshold: Optional[float],
+    class_id: Optional[int],
+    auto_mark: bool,
+    check_in_type: str
+) -> FaceVerifyResponse:
+    """Attach attendance state (and optionally mark it) for a verification result"""
+    attendance_marked = False
+    student_name = None
+    photo_path = None
+    target_class_id = None
+    
+    if success and student_id:
+        from ..db import crud
+        student = crud.get_student_by_id(db, student_id)
+        if student:
+            student_name = student.full_name
+            photo_path = student.photo_path
+            
+            # Determine class_id if not provided
+            target_class_id = class_id if class_id else student.class_id
+            
+            # Check today's attendance record (absent records should still allow check-in)
+            record = crud.get_attendance_record_for_date(
+                db,
+                student_id,
+                target_class_id,
+                check_in_type=check_in_type
+            )
+            is_marked = False
+            record_status = None
+            if record:
+                record_status = (getattr(record, "status", None) or "").strip().lower()
+                is_marked = record_status in ("present", "late")
+
+            attendance_marked = is_marked
+
+            if auto_mark and not is_marked:
+                try:
+                    # Mark attendance
+                    await attendance_service.mark_attendance(
+                        student_id,
+                        target_class_id,
+                        confidence_score,
+                        db,
+                        check_in_type=check_in_type
+                    )
+                    attendance_marked = True
+                    message += " (Attendance marked)"
+                except ValueError as e:
+                     # Should not happen given check above, but safe to catch
+                     pass
+            elif is_marked:
+                message = f"Face recognized: {student_name} (Already present)"
+            elif record and not is_marked:
+                if record_status == "absent":
+                    message = f"Face recognized: {student_name} (Marked absent earlier — ready to check in)"
+                else:
+                    message = f"Face recognized: {student_name} (Ready to check in)"
+
+    return FaceVerifyResponse(
+        success=success,
+        message=message,
+        student_id=student_id,
+        student_name=student_name,
+        confidence_score=confidence_score,
+        threshold=threshold,
+        attendance_marked=attendance_marked,
+        photo_path=photo_path,
+        class_id=target_class_id
+    )
+
+@router.post("/detect", response_model=FaceDetectResponse)
+async def detect_faces(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_teacher)
+):
+    """Detection only: face count, boxes and quality, plus a short-lived detection token
+    
+    Sending the token as ``detection_token`` to /face/verify or /face/register
+    (instead of the file) reuses the decoded image and detection.
+    """
+    _ensure_image_upload(file)
+    try:
+        image_data = await file.read()
+        success, message, faces, quality, quality_score, token = await face_service.detect_faces(
+            image_data, current_user["user_id"]
+        )
+        return FaceDetectResponse(
+            success=success,
+            message=message,
+            face_count=len(faces),
+            faces=[FaceDetection(**face) for face in faces],
+            quality=quality,
+            quality_score=quality_score,
+            detection_token=token,
+            expires_in=detection_cache.ttl_seconds if token else None
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing face detection: {str(e)}"
+        )
+
 @router.post("/register", response_model=FaceRegisterResponse)
 async def register_face(
     student_id: int = Form(...),
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    detection_token: Optional[str] = Form(None),
     db: Session = Depends(get_db),
     current_user: dict = Depends(require_admin)
 ):
-    """Register a face for a student"""
+    """Register a face for a student (upload a file or pass a /face/detect token)"""
     # Ensure admin has access to the student's class (org isolation)
     from ..db import crud
     student = crud.get_student_by_id(db, student_id)
@@ -31,24 +234,11 @@ async def register_face(
     if not has_access:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this student")
 
-    # Validate file type - be lenient since camera captures may not have proper MIME type
-    allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-    is_image_type = file.content_type and file.content_type.startswith('image/')
-    has_image_ext = any(file.filename.lower().endswith(ext) for ext in allowed_extensions) if file.filename else False
-    is_octet_stream = file.content_type == 'application/octet-stream'  # Sometimes sent by camera
-    
-    if not (is_image_type or has_image_ext or is_octet_stream):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File must be an image. Got: {file.content_type}, filename: {file.filename}"
-        )
+    image_data, detection = await _read_upload_or_detection(file, detection_token, current_user)
     
     try:
-        # Read image data
-        image_data = await file.read()
-        
         # Register face
-        success, message = await face_service.register_face(image_data, student_id, db)
+        success, message = await face_service.register_face(image_data, student_id, db, detection=detection)
         
         return FaceRegisterResponse(
             success=success,
@@ -56,128 +246,572 @@ async def register_face(
             student_id=student_id if success else None
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing face registration: {str(e)}"
         )
 
+@router.post("/register-bulk", response_model=FaceBulkRegisterResponse)
+async def register_faces_bulk(
+    student_ids: List[int] = Form(...),
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Register faces for many students; student_ids and files are paired by position"""
+    from ..db import crud
+    if len(student_ids) != len(files):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="student_ids and files must have the same length"
+        )
+    
+    # One access check per distinct class (org isolation)
+    checked_classes = {}
+    for student_id in student_ids:
+        student = crud.get_student_by_id(db, student_id)
+        if not student:
+            continue
+        if student.class_id not in checked_classes:
+            checked_classes[student.class_id] = await class_service.check_teacher_access(
+                student.class_id, current_user["user_id"], db
+            )
+        if not checked_classes[student.class_id]:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=f"Access denied to student {student_id}")
+    
+    for file in files:
+        _ensure_image_upload(file)
+    
+    try:
+        items = [(student_id, await file.read()) for student_id, file in zip(student_ids, files)]
+        results = await face_service.register_faces_bulk(items, db)
+        registered = sum(1 for _, ok, _ in results if ok)
+        return FaceBulkRegisterResponse(
+            success=registered > 0,
+            registered=registered,
+            failed=len(results) - registered,
+            results=[FaceBulkRegisterItem(student_id=sid, success=ok, message=msg) for sid, ok, msg in results]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing bulk face registration: {str(e)}"
+        )
+
 @router.post("/verify", response_model=FaceVerifyResponse)
 async def verify_face(
     class_id: Optional[int] = Form(None),
     auto_mark: bool = Form(False),
     check_in_type: str = Form("morning"),
-    file: UploadFile = File(...),
+    face_box: Optional[str] = Form(None),
+    landmarks: Optional[str] = Form(None),
+    aligned: bool = Form(False),
+    file: Optional[UploadFile] = File(None),
+    detection_token: Optional[str] = Form(None),
+    student_id: Optional[int] = Form(None),
     db: Session = Depends(get_db),
     current_user: dict = Depends(require_teacher)
 ):
-    """Verify a face and optionally mark attendance if recognized"""
-    # Check if teacher has access to this class IF class_id provided
-    if class_id:
-        has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
-        if not has_access:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this class")
-    elif current_user["role"] != "super_admin":
-        accessible_classes = await class_service.get_accessible_classes(current_user, db)
-        if not accessible_classes:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="No accessible classes")
+    """Verify a face and optionally mark attendance if recognized
     
-    # Validate file type - be lenient since camera captures may not have proper MIME type
-    allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
-    is_image_type = file.content_type and file.content_type.startswith('image/')
-    has_image_ext = any(file.filename.lower().endswith(ext) for ext in allowed_extensions) if file.filename else False
-    is_octet_stream = file.content_type == 'application/octet-stream'
+    Clients that already ran face detection can send ``face_box`` (x1,y1,x2,y2
+    in frame pixels) and optional ``landmarks`` (5 x,y points), or upload an
+    aligned 112x112 crop with ``aligned=true``, to skip most server detection.
+    A ``detection_token`` from /face/detect replaces the upload entirely.
+    A ``student_id`` claim switches to a 1:1 check against that student only.
+    """
+    hint = _parse_hint(face_box, landmarks, aligned)
+    class_ids = await _verify_scope(class_id, current_user, db)
+    if student_id is not None:
+        _check_claim_scope(student_id, class_id, class_ids, db)
+    image_data, detection = await _read_upload_or_detection(file, detection_token, current_user)
     
-    if not (is_image_type or has_image_ext or is_octet_stream):
+    try:
+        # Verify face
+        success, message, student_id, confidence_score, threshold = await face_service.verify_face(
+            image_data,
+            db,
+            class_id=class_id,
+            class_ids=class_ids,
+            hint=hint,
+            detection=detection,
+            claimed_student_id=student_id
+        )
+        return await _verification_response(
+            db, success, message, student_id, confidence_score, threshold, class_id, auto_mark, check_in_type
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing face verification: {str(e)}"
+        )
+
+@router.post("/verify-embedding", response_model=FaceVerifyResponse)
+async def verify_embedding(
+    request: FaceEmbeddingVerifyRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_teacher)
+):
+    """Verify an embedding computed on-device (no image upload, no server inference)
+    
+    ``embedding`` is the base64 binary embedding format (it records the model
+    pack); ``signature`` is hex HMAC-SHA256 over "<timestamp>." + blob bytes
+    with the shared device secret.
+    """
+    if not settings.device_embedding_secret:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Embedding verification is not enabled")
+    try:
+        blob = base64.b64decode(request.embedding, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="embedding must be base64")
+    if not verify_embedding_signature(blob, request.timestamp, request.signature):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired embedding signature")
+    
+    class_ids = await _verify_scope(request.class_id, current_user, db)
+    try:
+        success, message, student_id, confidence_score, threshold = await face_service.verify_embedding(
+            blob,
+            db,
+            class_id=request.class_id,
+            class_ids=class_ids
+        )
+        return await _verification_response(
+            db, success, message, student_id, confidence_score, threshold,
+            request.class_id, request.auto_mark, request.check_in_type
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing embedding verification: {str(e)}"
+        )
+
+MAX_BATCH_VERIFY_IMAGES = 10
+
+@router.post("/verify-batch", response_model=FaceVerifyBatchResponse)
+async def verify_faces_batch(
+    class_id: Optional[int] = Form(None),
+    auto_mark: bool = Form(False),
+    check_in_type: str = Form("morning"),
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_teacher)
+):
+    """Verify several queued captures in one call (one access check, one gallery snapshot)"""
+    if len(files) > MAX_BATCH_VERIFY_IMAGES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File must be an image. Got: {file.content_type}, filename: {file.filename}"
+            detail=f"At most {MAX_BATCH_VERIFY_IMAGES} images per request"
         )
+    class_ids = await _verify_scope(class_id, current_user, db)
+    
+    for file in files:
+        _ensure_image_upload(file)
     
     try:
-        # Read image data
-        image_data = await file.read()
+        from ..db import crud
+        images = [await file.read() for file in files]
+        threshold, outcomes = await face_service.verify_faces_batch(images, db, class_id=class_id, class_ids=class_ids)
         
-        # Verify face
-        class_ids = None
-        if not class_id and current_user["role"] != "super_admin":
-            class_ids = [cls.id for cls in accessible_classes]
+        recognized_ids = [student_id for ok, _, student_id, _ in outcomes if ok and student_id]
+        students = {s.id: s for s in crud.get_students_by_ids(db, recognized_ids)}
+        targets = {}  # position -> (student, target class)
+        for position, (ok, _, student_id, _) in enumerate(outcomes):
+            if ok and students.get(student_id):
+                targets[position] = (students[student_id], class_id if class_id else students[student_id].class_id)
+        
+        # Attendance state: one bulk write when auto-marking, otherwise one lookup per class
+        marked = {}
+        if auto_mark and targets:
+            items = [(student.id, target_class_id, outcomes[position][3]) for position, (student, target_class_id) in targets.items()]
+            for (position, _), (_, ok, note) in zip(targets.items(), await attendance_service.mark_attendance_bulk(items, db, check_in_type=check_in_type)):
+                marked[position] = (ok, note)
+        elif targets:
+            by_class = {}
+            for position, (student, target_class_id) in targets.items():
+                by_class.setdefault(target_class_id, []).append(student.id)
+            records = {}
+            for target_class_id, student_ids in by_class.items():
+                for sid, record in crud.get_attendance_records_for_date_bulk(
+                    db, student_ids, target_class_id, check_in_type=check_in_type
+                ).items():
+                    records[(sid, target_class_id)] = record
+            for position, (student, target_class_id) in targets.items():
+                record = records.get((student.id, target_class_id))
+                record_status = (getattr(record, "status", None) or "").strip().lower()
+                marked[position] = (record_status in ("present", "late"), None)
+        
+        results = []
+        for position, (ok, message, student_id, score) in enumerate(outcomes):
+            target = targets.get(position)
+            attendance_marked = False
+            if target:
+                attendance_marked, note = marked.get(position, (False, None))
+                if auto_mark and attendance_marked:
+                    message += " (Attendance marked)"
+                elif note == "Attendance already marked for today" or (not auto_mark and attendance_marked):
+                    attendance_marked = True
+                    message = f"Face recognized: {target[0].full_name} (Already present)"
+                elif note:
+                    message += f" ({note})"
+            results.append(FaceVerifyResponse(
+                success=ok,
+                message=message,
+                student_id=student_id,
+                student_name=target[0].full_name if target else None,
+                confidence_score=score,
+                threshold=threshold,
+                attendance_marked=attendance_marked,
+                photo_path=target[0].photo_path if target else None,
+                class_id=target[1] if target else None
+            ))
+        
+        recognized = sum(1 for r in results if r.success)
+        return FaceVerifyBatchResponse(
+            success=recognized > 0,
+            message=f"{recognized} of {len(results)} image(s) recognized",
+            threshold=threshold,
+            recognized=recognized,
+            results=results
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing batch face verification: {str(e)}"
+        )
 
-        success, message, student_id, confidence_score, threshold = await face_service.verify_face(
+@router.post("/search", response_model=FaceSearchResponse)
+async def search_face(
+    k: int = Form(5),
+    class_id: Optional[int] = Form(None),
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Top-k "who is this?" search over the admin's gallery scope"""
+    from ..db import crud
+    if k < 1 or k > 50:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="k must be between 1 and 50")
+    
+    org_id = None
+    if class_id:
+        has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
+        if not has_access:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this class")
+    elif current_user["role"] != "super_admin":
+        teacher = crud.get_teacher_by_id(db, current_user["user_id"])
+        if not teacher or teacher.organization_id is None:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Organization not set for user")
+        org_id = teacher.organization_id
+    
+    _ensure_image_upload(file)
+    
+    try:
+        image_data = await file.read()
+        success, message, matches, threshold = await face_service.search_face(
             image_data,
             db,
+            k=k,
             class_id=class_id,
-            class_ids=class_ids
+            org_id=org_id
         )
         
-        attendance_marked = False
-        student_name = None
-        photo_path = None
-        target_class_id = None
-        
-        if success and student_id:
-            from ..db import crud
+        candidates = []
+        for student_id, similarity in matches:
             student = crud.get_student_by_id(db, student_id)
-            if student:
-                student_name = student.full_name
-                photo_path = student.photo_path
-                
-                # Determine class_id if not provided
-                target_class_id = class_id if class_id else student.class_id
-                
-                # Check today's attendance record (absent records should still allow check-in)
-                record = crud.get_attendance_record_for_date(
-                    db,
-                    student_id,
-                    target_class_id,
-                    check_in_type=check_in_type
-                )
-                is_marked = False
-                record_status = None
-                if record:
-                    record_status = (getattr(record, "status", None) or "").strip().lower()
-                    is_marked = record_status in ("present", "late")
-
-                attendance_marked = is_marked
-
-                if auto_mark and not is_marked:
-                    try:
-                        # Mark attendance
-                        await attendance_service.mark_attendance(
-                            student_id,
-                            target_class_id,
-                            confidence_score,
-                            db,
-                            check_in_type=check_in_type
-                        )
-                        attendance_marked = True
-                        message += " (Attendance marked)"
-                    except ValueError as e:
-                         # Should not happen given check above, but safe to catch
-                         pass
-                elif is_marked:
-                    message = f"Face recognized: {student_name} (Already present)"
-                elif record and not is_marked:
-                    if record_status == "absent":
-                        message = f"Face recognized: {student_name} (Marked absent earlier — ready to check in)"
-                    else:
-                        message = f"Face recognized: {student_name} (Ready to check in)"
-
-        
-        return FaceVerifyResponse(
+            candidates.append(FaceSearchCandidate(
+                student_id=student_id,
+                student_name=student.full_name if student else None,
+                class_id=student.class_id if student else None,
+                similarity=similarity,
+                is_match=similarity >= threshold
+            ))
+        
+        return FaceSearchResponse(success=success, message=message, threshold=threshold, candidates=candidates)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error processing face search: {str(e)}"
+        )
+
+MAX_GROUP_PHOTOS = 5
+
+@router.post("/recognize-group", response_model=FaceGroupResponse)
+async def recognize_group(
+    class_id: int = Form(...),
+    auto_mark: bool = Form(True),
+    check_in_type: str = Form("morning"),
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_teacher)
+):
+    """Mark attendance for a whole class from one or a few classroom photos"""
+    has_access = await class_service.check_teacher_access(class_id, current_user["user_id"], db)
+    if not has_access:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this class")
+    if len(files) > MAX_GROUP_PHOTOS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_GROUP_PHOTOS} photos per request"
+        )
+    for file in files:
+        _ensure_image_upload(file)
+    
+    try:
+        from ..db import crud
+        images = [await file.read() for file in files]
+        success, message, matches, unmatched, threshold = await face_service.recognize_group(images, class_id, db)
+        
+        marked = {}
+        if success and auto_mark and matches:
+            results = await attendance_service.mark_attendance_bulk(
+                [(m["student_id"], class_id, m["similarity"]) for m in matches],
+                db,
+                check_in_type=check_in_type
+            )
+            marked = {student_id: (ok, note) for student_id, ok, note in results}
+        
+        students = {s.id: s for s in crud.get_students_by_ids(db, [m["student_id"] for m in matches])}
+        match_items = []
+        for m in matches:
+            student = students.get(m["student_id"])
+            ok, note = marked.get(m["student_id"], (False, None))
+            match_items.append(FaceGroupMatch(
+                student_id=m["student_id"],
+                student_name=student.full_name if student else None,
+                confidence_score=m["similarity"],
+                image_index=m["image_index"],
+                box=m["box"],
+                attendance_marked=ok,
+                message=note
+            ))
+        
+        marked_count = sum(1 for item in match_items if item.attendance_marked)
+        if auto_mark and success:
+            message += f" ({marked_count} attendance record(s) marked)"
+        return FaceGroupResponse(
             success=success,
             message=message,
-            student_id=student_id,
-            student_name=student_name,
-            confidence_score=confidence_score,
+            class_id=class_id,
             threshold=threshold,
-            attendance_marked=attendance_marked,
-            photo_path=photo_path,
-            class_id=target_class_id
+            faces_detected=len(matches) + len(unmatched),
+            attendance_marked=marked_count,
+            matches=match_items,
+            unmatched=[
+                FaceGroupUnmatched(
+                    image_index=u["image_index"],
+                    box=u["box"],
+                    det_score=u["det_score"],
+                    best_similarity=u["best_similarity"]
+                ) for u in unmatched
+            ]
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error processing face verification: {str(e)}"
+            detail=f"Error processing group photo: {str(e)}"
         )
+
+@router.delete("/{student_id}")
+async def delete_face(
+    student_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Delete a student's enrolled face"""
+    from ..db import crud
+    student = crud.get_student_by_id(db, student_id)
+    if not student:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
+    has_access = await class_service.check_teacher_access(student.class_id, current_user["user_id"], db)
+    if not has_access:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access denied to this student")
+
+    deleted = await face_service.delete_face(student_id, db)
+    return {
+        "success": deleted,
+        "message": "Face deleted successfully" if deleted else "No enrolled face found"
+    }
+
+MAX_STREAM_FRAME_BYTES = 2 * 1024 * 1024
+
+@router.websocket("/stream")
+async def stream_verify(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None),
+    class_id: Optional[int] = Query(None),
+    auto_mark: bool = Query(False),
+    check_in_type: str = Query("morning")
+):
+    """Streaming recognition session for kiosks
+    
+    Auth, class scope and the gallery are resolved once when the socket
+    opens. The client then sends JPEG frames as binary messages and gets one
+    JSON result per processed frame. Only the newest frame is kept: frames
+    that arrive while one is being recognized replace the waiting frame
+    and are counted as dropped, so the kiosk never falls behind real time.
+    
+    Faces are tracked across frames (see ai/tracker.py); a confidently
+    identified track skips recognition until it is re-verified, and each
+    result reports the smoothed identity of the largest face plus all tracks.
+    
+    Database sessions are short-lived (connect, then per identified face),
+    so an open socket does not hold a pooled connection. Unexpected errors
+    close the socket with 1011.
+    """
+    from ..db import crud
+    await websocket.accept()
+    db = SessionLocal()
+    try:
+        current_user = authenticate_teacher_token(token, db)
+        class_ids = await _verify_scope(class_id, current_user, db)
+        student_gallery.ensure_loaded(db)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    except Exception as e:
+        print(f"[Stream] Session setup failed: {e}")
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        return
+    finally:
+        db.close()
+    
+    gallery_version = student_gallery.version
+    gallery = student_gallery.searcher(class_id=class_id, class_ids=class_ids)
+    await websocket.send_json({"type": "ready", "class_id": class_id, "gallery_size": len(gallery)})
+    
+    latest = {"frame": None, "seq": 0}
+    frame_ready = asyncio.Event()
+    counters = {"received": 0, "processed": 0, "dropped": 0, "reused": 0}
+    tracker = FaceTracker()
+    responses = {}  # (track_id, student_id) -> FaceVerifyResponse
+    
+    async def receive_frames():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            frame = message.get("bytes")
+            if frame:
+                if len(frame) > MAX_STREAM_FRAME_BYTES:
+                    await websocket.send_json({"type": "error", "message": "Frame too large"})
+                    continue
+                counters["received"] += 1
+                if latest["frame"] is not None:
+                    counters["dropped"] += 1
+                latest["frame"] = frame
+                latest["seq"] = counters["received"]
+                frame_ready.set()
+            elif message.get("text") == "ping":
+                await websocket.send_json({"type": "pong", **counters})
+    
+    async def process_frames():
+        nonlocal gallery, gallery_version
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            frame, seq = latest["frame"], latest["seq"]
+            latest["frame"] = None
+            if frame is None:
+                continue
+            if student_gallery.version != gallery_version:
+                # Enrollment changed mid-session; views are cached so this is cheap
+                gallery_version = student_gallery.version
+                gallery = student_gallery.searcher(class_id=class_id, class_ids=class_ids)
+                tracker.invalidate()
+            started = time.perf_counter()
+            try:
+                message, tracks, scale = await face_service.verify_tracked_frame(frame, tracker, gallery)
+                primary = tracker.primary(tracks)
+                threshold = settings.face_similarity_threshold
+                if primary is None:
+                    result = FaceVerifyResponse(success=False, message=message, threshold=threshold)
+                elif primary.student_id is None and primary.quality_issue:
+                    result = FaceVerifyResponse(success=False, message=primary.quality_issue, threshold=threshold)
+                elif primary.student_id is None:
+                    result = FaceVerifyResponse(
+                        success=False,
+                        message=f"Face not recognized (confidence: {primary.confidence:.2%}, required: {threshold:.2%})",
+                        confidence_score=primary.confidence,
+                        threshold=threshold
+                    )
+                else:
+                    # Attendance lookup (and auto-mark) once per identified track
+                    key = (primary.track_id, primary.student_id)
+                    result = responses.get(key)
+                    if result is None:
+                        db = SessionLocal()
+                        try:
+                            student = crud.get_student_by_id(db, primary.student_id)
+                            name = student.full_name if student else "Unknown"
+                            result = await _verification_response(
+                                db, True, f"Face recognized: {name}", primary.student_id, primary.confidence,
+                                threshold, class_id, auto_mark, check_in_type
+                            )
+                        finally:
+                            db.close()
+                        responses[key] = result
+                    result = result.model_copy(update={"confidence_score": primary.confidence})
+            except InferenceUnavailable as e:
+                await websocket.send_json({"type": "error", "frame": seq, "message": e.detail})
+                continue
+            counters["processed"] += 1
+            counters["reused"] += sum(1 for track in tracks if track.reused)
+            await websocket.send_json({
+                "type": "result",
+                "frame": seq,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "dropped": counters["dropped"],
+                "track_id": primary.track_id if primary else None,
+                "reused": primary.reused if primary else False,
+                "tracks": [
+                    {
+                        "track_id": track.track_id,
+                        "student_id": track.student_id,
+                        "confidence": track.confidence,
+                        "box": [float(v) * scale for v in track.box],
+                        "reused": track.reused,
+                        "quality_issue": track.quality_issue,
+                    }
+                    for track in tracks
+                ],
+                **result.model_dump()
+            })
+    
+    tasks = [asyncio.ensure_future(receive_frames()), asyncio.ensure_future(process_frames())]
+    try:
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        errors = [task.exception() for task in done if task.exception() is not None]
+        errors = [e for e in errors if not isinstance(e, WebSocketDisconnect)]
+        if errors:
+            print(f"[Stream] Session error: {errors[0]!r}")
+            try:
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+            except Exception:
+                pass  # the client is already gone
+    finally:
+        for task in tasks:
+            task.cancel()
+    print(f"[Stream] Session closed: {counters['received']} frame(s) received, "
+          f"{counters['processed']} processed, {counters['dropped']} dropped, "
+          f"{counters['reused']} recognition(s) reused from tracks")
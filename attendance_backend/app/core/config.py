@@ -10,10 +10,68 @@ class Settings(BaseSettings):
     secret_key: str = "your-super-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    device_embedding_secret: Optional[str] = None  # enables /face/verify-embedding
+    device_embedding_max_age_seconds: int = 300
     
     # Face Recognition
     face_similarity_threshold: float = 0.6
+    face_claim_threshold: float = 0.65  # 1:1 check when the client claims a student_id
     insightface_model_name: str = "buffalo_l"
+    duplicate_check_scope: str = "organization"  # organization, global or off
+    insightface_modules: str = "detection,recognition"  # FaceAnalysis allowed_modules
+    
+    # Model profiles: detector input sizes per endpoint family, smallest first;
+    # larger sizes are only tried when the smaller one finds no face
+    profile_verify_det_sizes: str = "320,640"
+    profile_enroll_det_sizes: str = "640"
+    profile_group_det_sizes: str = "1024"
+    profile_group_tiles: int = 0  # >1 adds an overlapping NxN tiled pass for group photos
+    profile_roi_det_sizes: str = "160"  # detection inside a client-provided face box
+    roi_margin: float = 0.4  # fraction of the client face box added on each side
+    # Several faces in a verify/enroll frame: all (reject), largest or central (keep one)
+    profile_verify_face_policy: str = "largest"
+    profile_enroll_face_policy: str = "all"
+    # Quality gate per profile, checked before recognition; empty string disables it
+    profile_verify_quality: str = "min_face=64,max_yaw=40,max_pitch=30,min_sharpness=25,min_brightness=40,max_brightness=225"
+    profile_enroll_quality: str = "min_face=112,max_yaw=25,max_pitch=20,min_sharpness=50,min_brightness=60,max_brightness=215"
+    
+    # Inference executor: model calls run on a bounded worker pool, off the event loop
+    inference_workers: int = 2
+    inference_max_queue: int = 16
+    inference_timeout_seconds: float = 15.0
+    recognition_max_batch: int = 16  # aligned crops per batched recognition call
+    recognition_max_wait_ms: float = 4.0  # how long the first crop waits for company
+    
+    # /face/detect result tokens (let verify/register skip upload, decode and detection)
+    detection_token_ttl_seconds: float = 60.0
+    detection_cache_max_entries: int = 32  # per worker; each entry holds a decoded working-size image
+    
+    # Streaming sessions: per-session face tracking and result reuse
+    track_iou_threshold: float = 0.3
+    track_max_missed: int = 5  # frames a lost face is kept before its track is dropped
+    track_history: int = 5  # recognition results per track used for smoothing
+    track_reuse_margin: float = 0.1  # smoothed similarity above threshold needed to skip recognition
+    track_reverify_frames: int = 15  # re-run recognition on an identified track this often
+    
+    # Approximate nearest-neighbour search for large galleries
+    ann_enabled: bool = True
+    ann_backend: str = "numpy"  # numpy or faiss (requires faiss-cpu)
+    ann_min_gallery_size: int = 20000
+    ann_nprobe: int = 8
+    ann_rerank_factor: int = 4
+    ann_index_path: Optional[str] = None  # e.g. data/gallery_ann.npz to persist the index
+    # Exact gallery scans at reduced precision (float32, float16 or int8), top candidates re-ranked in float32
+    gallery_precision: str = "float32"
+    gallery_rerank_candidates: int = 32
+    
+    # Shared gallery file: workers memory-map one copy of the student gallery instead of each
+    # building its own; writes publish a new version that the others pick up
+    gallery_shared_dir: Optional[str] = None  # e.g. data/gallery (same host, local filesystem)
+    gallery_shared_poll_seconds: float = 1.0
+    gallery_shared_keep_versions: int = 3
+    # Gallery snapshot: restored at startup so only rows changed since are read from the DB
+    gallery_snapshot_path: Optional[str] = None  # e.g. data/gallery_snapshot.npz
+    gallery_snapshot_delay_seconds: float = 30.0  # written this long after the first unsaved change
     
     # App
     app_name: str = "Face Recognition Attendance System"
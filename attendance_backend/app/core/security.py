@@ -2,6 +2,9 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
+import hashlib
+import hmac
+import time
 import bcrypt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -35,6 +38,19 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
+def sign_embedding(blob: bytes, timestamp: int, secret: Optional[str] = None) -> str:
+    """HMAC-SHA256 over "<timestamp>." + embedding bytes (used by on-device clients)"""
+    key = (secret or settings.device_embedding_secret or "").encode()
+    return hmac.new(key, f"{timestamp}.".encode() + blob, hashlib.sha256).hexdigest()
+
+def verify_embedding_signature(blob: bytes, timestamp: int, signature: str) -> bool:
+    """Check a device embedding signature and reject stale timestamps (replay window)"""
+    if not settings.device_embedding_secret:
+        return False
+    if abs(time.time() - timestamp) > settings.device_embedding_max_age_seconds:
+        return False
+    return hmac.compare_digest(sign_embedding(blob, timestamp), signature.lower())
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     # 🔧 DEV MODE: Skip authentication
     if DEV_MODE:
@@ -43,8 +59,11 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if credentials is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     
+    return decode_access_token(credentials.credentials)
+
+def decode_access_token(token: str) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=[settings.algorithm])
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         user_id: str = payload.get("sub")
         role: str = payload.get("role")
         if user_id is None:
@@ -85,6 +104,14 @@ def require_teacher(current_user: dict = Depends(verify_token), db: Session = De
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Teacher access required")
     return current_user
 
+def authenticate_teacher_token(token: Optional[str], db: Session) -> dict:
+    """require_teacher for connections that cannot send an Authorization header (WebSockets)"""
+    if DEV_MODE:
+        return {"user_id": 1, "role": "super_admin"}
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    return require_teacher(decode_access_token(token), db)
+
 def require_admin_or_super_admin(current_user: dict = Depends(verify_token), db: Session = Depends(get_db)):
     if DEV_MODE:
         return {"user_id": 1, "role": "super_admin"}
@@ -1,9 +1,11 @@
 """Database CRUD operations"""
 from typing import List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, func, Date
+from sqlalchemy import and_, or_, func, Date
 from datetime import datetime, date
+import numpy as np
 from . import models
+from ..utils.embedding_blob import embedding_to_blob
 from ..core.security import get_password_hash, verify_password
 
 # Organization CRUD
@@ -116,6 +118,11 @@ def get_student_by_id(db: Session, student_id: int) -> Optional[models.Student]:
 def get_student_by_student_id(db: Session, student_id: str) -> Optional[models.Student]:
     return db.query(models.Student).filter(models.Student.student_id == student_id).first()
 
+def get_students_by_ids(db: Session, student_ids: List[int]) -> List[models.Student]:
+    if not student_ids:
+        return []
+    return db.query(models.Student).filter(models.Student.id.in_(student_ids)).all()
+
 def get_students(db: Session, class_id: Optional[int] = None, class_ids: Optional[List[int]] = None) -> List[models.Student]:
     query = db.query(models.Student)
     if class_id:
@@ -202,19 +209,37 @@ def delete_class(db: Session, class_id: int) -> bool:
     return False
 
 # Face Embedding CRUD
-def create_face_embedding(db: Session, student_id: int, embedding: str) -> models.FaceEmbedding:
+def create_face_embedding(db: Session, student_id: int, embedding: np.ndarray) -> models.FaceEmbedding:
     # Delete existing embedding if any
     db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).delete()
     
     db_embedding = models.FaceEmbedding(
         student_id=student_id,
-        embedding=embedding
+        embedding_blob=embedding_to_blob(embedding)
     )
     db.add(db_embedding)
     db.commit()
     db.refresh(db_embedding)
     return db_embedding
 
+def create_face_embeddings_bulk(db: Session, records: List[tuple]) -> None:
+    """Insert or replace (student_id, embedding, photo_path) rows and mark students enrolled in one transaction"""
+    student_ids = [record[0] for record in records]
+    db.query(models.FaceEmbedding).filter(
+        models.FaceEmbedding.student_id.in_(student_ids)
+    ).delete(synchronize_session=False)
+    
+    photo_paths = {}
+    for student_id, embedding, photo_path in records:
+        db.add(models.FaceEmbedding(student_id=student_id, embedding_blob=embedding_to_blob(embedding)))
+        photo_paths[student_id] = photo_path
+    
+    for student in db.query(models.Student).filter(models.Student.id.in_(student_ids)).all():
+        student.face_enrolled = True
+        if photo_paths.get(student.id):
+            student.photo_path = photo_paths[student.id]
+    db.commit()
+
 def get_face_embedding(db: Session, student_id: int) -> Optional[models.FaceEmbedding]:
     return db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).first()
 
@@ -231,6 +256,58 @@ def get_all_face_embeddings_by_class_ids(db: Session, class_ids: List[int]) -> L
 def get_all_face_embeddings(db: Session) -> List[models.FaceEmbedding]:
     return db.query(models.FaceEmbedding).all()
 
+def get_face_embedding_gallery_rows(
+    db: Session,
+    updated_since: Optional[datetime] = None,
+    student_ids: Optional[List[int]] = None
+) -> List[tuple]:
+    """Face embeddings with their student's class and organization
+
+    ``updated_since`` keeps rows written at or after that time (and rows
+    without a timestamp); ``student_ids`` keeps those students only.
+    """
+    query = db.query(
+        models.FaceEmbedding,
+        models.Student.class_id,
+        models.Class.organization_id
+    ).join(
+        models.Student, models.Student.id == models.FaceEmbedding.student_id
+    ).outerjoin(
+        models.Class, models.Class.id == models.Student.class_id
+    )
+    if updated_since is not None:
+        query = query.filter(or_(
+            models.FaceEmbedding.updated_at >= updated_since,
+            models.FaceEmbedding.updated_at.is_(None)
+        ))
+    if student_ids is not None:
+        query = query.filter(models.FaceEmbedding.student_id.in_(student_ids))
+    return query.all()
+
+def get_face_embedding_owners(db: Session) -> List[tuple]:
+    """(student_id, class_id, organization_id) of every face embedding, without the vectors"""
+    return db.query(
+        models.FaceEmbedding.student_id,
+        models.Student.class_id,
+        models.Class.organization_id
+    ).join(
+        models.Student, models.Student.id == models.FaceEmbedding.student_id
+    ).outerjoin(
+        models.Class, models.Class.id == models.Student.class_id
+    ).all()
+
+def get_face_embedding_high_water_mark(db: Session) -> Optional[datetime]:
+    """Latest face embedding write time"""
+    return db.query(func.max(models.FaceEmbedding.updated_at)).scalar()
+
+def delete_face_embedding(db: Session, student_id: int) -> bool:
+    deleted = db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == student_id).delete()
+    student = get_student_by_id(db, student_id)
+    if student:
+        student.face_enrolled = False
+    db.commit()
+    return deleted > 0
+
 
 # Attendance CRUD
 def create_attendance(
@@ -308,6 +385,49 @@ def get_attendance_record_for_date(
         query = query.filter(models.Attendance.check_in_type == check_in_type)
     return query.first()
 
+def get_attendance_records_for_date_bulk(
+    db: Session,
+    student_ids: List[int],
+    class_id: int,
+    check_date: date = None,
+    check_in_type: Optional[str] = None
+) -> dict:
+    """Today's attendance records for many students, keyed by student id"""
+    if not check_date:
+        check_date = date.today()
+    if not student_ids:
+        return {}
+
+    query = db.query(models.Attendance).filter(
+        models.Attendance.student_id.in_(student_ids),
+        models.Attendance.class_id == class_id,
+        func.date(models.Attendance.marked_at) == check_date,
+    )
+    if check_in_type:
+        query = query.filter(models.Attendance.check_in_type == check_in_type)
+    records = {}
+    for record in query.all():
+        records.setdefault(record.student_id, record)
+    return records
+
+def save_attendance_bulk(
+    db: Session,
+    new_records: List[dict],
+    updates: List[tuple]
+) -> List[models.Attendance]:
+    """Insert new attendance rows and apply (record, changes) updates in one transaction"""
+    created = [models.Attendance(**values) for values in new_records]
+    try:
+        db.add_all(created)
+        for record, changes in updates:
+            for key, value in changes.items():
+                setattr(record, key, value)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return created
+
 def update_attendance(db: Session, attendance_id: int, update_data: dict) -> Optional[models.Attendance]:
     attendance = db.query(models.Attendance).filter(models.Attendance.id == attendance_id).first()
     if attendance:
@@ -380,11 +500,11 @@ def get_attendance_by_student(db: Session, student_id: int, start_date: date = N
 
 # Teacher Face Embedding CRUD
 
-def create_teacher_face_embedding(db: Session, teacher_id: int, embedding: str) -> models.TeacherFaceEmbedding:
+def create_teacher_face_embedding(db: Session, teacher_id: int, embedding: np.ndarray) -> models.TeacherFaceEmbedding:
     db.query(models.TeacherFaceEmbedding).filter(models.TeacherFaceEmbedding.teacher_id == teacher_id).delete()
     db_embedding = models.TeacherFaceEmbedding(
         teacher_id=teacher_id,
-        embedding=embedding
+        embedding_blob=embedding_to_blob(embedding)
     )
     db.add(db_embedding)
     db.commit()
@@ -397,3 +517,12 @@ def get_teacher_face_embedding(db: Session, teacher_id: int) -> Optional[models.
 def get_all_teacher_face_embeddings(db: Session) -> List[models.TeacherFaceEmbedding]:
     return db.query(models.TeacherFaceEmbedding).all()
 
+def get_teacher_face_embedding_gallery_rows(db: Session) -> List[tuple]:
+    """Every teacher Face ID embedding with the teacher's organization"""
+    return db.query(
+        models.TeacherFaceEmbedding,
+        models.Teacher.organization_id
+    ).join(
+        models.Teacher, models.Teacher.id == models.TeacherFaceEmbedding.teacher_id
+    ).all()
+
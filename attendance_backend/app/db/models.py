@@ -1,5 +1,5 @@
 """Database ORM models"""
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .base import Base
@@ -76,7 +76,8 @@ class FaceEmbedding(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("students.id"), unique=True, nullable=False)
-    embedding = Column(Text, nullable=False)  # JSON serialized embedding
+    embedding = Column(Text, nullable=True)  # Legacy JSON serialized embedding
+    embedding_blob = Column(LargeBinary, nullable=True)  # Normalized float32 with header (see ai.embedding)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -89,7 +90,8 @@ class TeacherFaceEmbedding(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     teacher_id = Column(Integer, ForeignKey("teachers.id"), unique=True, nullable=False)
-    embedding = Column(Text, nullable=False)
+    embedding = Column(Text, nullable=True)  # Legacy JSON serialized embedding
+    embedding_blob = Column(LargeBinary, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -5,8 +5,11 @@ from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
 from .core.config import settings
-from .db.base import engine, Base
+from .db.base import engine, Base, SessionLocal
 from .ai.insightface_model import face_model
+from .ai.gallery import student_gallery, teacher_gallery
+from .ai.inference_executor import inference_executor
+from .ai.batcher import recognition_batcher
 from .api import auth, teachers, classes, students, attendance, face, dashboard, reports, organizations, attendance_settings
 
 # Create database tables
@@ -23,9 +26,20 @@ async def lifespan(app: FastAPI):
     print("Loading InsightFace model...")
     face_model.load_model()
     print("InsightFace model loaded successfully")
+    # Build the in-memory face gallery once so verify never reloads it from the DB
+    # (from the gallery snapshot plus rows changed since, when one exists)
+    db = SessionLocal()
+    try:
+        student_gallery.load(db)
+        teacher_gallery.load(db)
+    finally:
+        db.close()
     yield
     # Shutdown: cleanup if needed
     print("Shutting down...")
+    inference_executor.shutdown()
+    student_gallery.save_ann()
+    student_gallery.save_snapshot()
 
 app = FastAPI(
     title=settings.app_name,
@@ -69,3 +83,12 @@ def root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+@app.get("/health/inference")
+def inference_health():
+    """Inference queue depth, wait times and rejection counters"""
+    return {
+        **inference_executor.metrics(),
+        "recognition_batches": recognition_batcher.metrics(),
+        "detection": face_model.detection_stats.metrics(),
+    }
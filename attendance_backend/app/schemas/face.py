@@ -1,12 +1,23 @@
 """Face recognition request/response schemas"""
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 
 class FaceRegisterResponse(BaseModel):
     success: bool
     message: str
     student_id: Optional[int] = None
 
+class FaceBulkRegisterItem(BaseModel):
+    student_id: int
+    success: bool
+    message: str
+
+class FaceBulkRegisterResponse(BaseModel):
+    success: bool
+    registered: int
+    failed: int
+    results: List[FaceBulkRegisterItem] = []
+
 class FaceVerifyResponse(BaseModel):
     success: bool
     message: str
@@ -18,5 +29,74 @@ class FaceVerifyResponse(BaseModel):
     photo_path: Optional[str] = None
     class_id: Optional[int] = None
 
+class FaceDetection(BaseModel):
+    box: List[float]  # x1, y1, x2, y2 in original image pixels
+    det_score: float
+    quality: str  # good, poor, blurry or dark
+    quality_score: float
+
+class FaceDetectResponse(BaseModel):
+    success: bool
+    message: str
+    face_count: int = 0
+    faces: List[FaceDetection] = []
+    quality: str = "unknown"  # quality of the largest face
+    quality_score: Optional[float] = None
+    detection_token: Optional[str] = None  # pass to /face/verify or /face/register instead of re-uploading
+    expires_in: Optional[float] = None  # seconds the token stays valid
+
+class FaceEmbeddingVerifyRequest(BaseModel):
+    embedding: str  # base64 of the binary embedding format (header names the model pack)
+    timestamp: int  # unix seconds, covered by the signature
+    signature: str  # hex HMAC-SHA256 of "<timestamp>." + embedding bytes
+    class_id: Optional[int] = None
+    auto_mark: bool = False
+    check_in_type: str = "morning"
+
+class FaceVerifyBatchResponse(BaseModel):
+    success: bool
+    message: str
+    threshold: Optional[float] = None
+    recognized: int = 0
+    results: List[FaceVerifyResponse] = []  # one per uploaded image, in order
+
+class FaceSearchCandidate(BaseModel):
+    student_id: int
+    student_name: Optional[str] = None
+    class_id: Optional[int] = None
+    similarity: float
+    is_match: bool
+
+class FaceSearchResponse(BaseModel):
+    success: bool
+    message: str
+    threshold: Optional[float] = None
+    candidates: List[FaceSearchCandidate] = []
+
+class FaceGroupMatch(BaseModel):
+    student_id: int
+    student_name: Optional[str] = None
+    confidence_score: float
+    image_index: int
+    box: List[float]  # x1, y1, x2, y2 in original image pixels
+    attendance_marked: bool = False
+    message: Optional[str] = None
+
+class FaceGroupUnmatched(BaseModel):
+    image_index: int
+    box: List[float]
+    det_score: float
+    best_similarity: float
+
+class FaceGroupResponse(BaseModel):
+    success: bool
+    message: str
+    class_id: int
+    threshold: Optional[float] = None
+    faces_detected: int = 0
+    attendance_marked: int = 0
+    matches: List[FaceGroupMatch] = []
+    unmatched: List[FaceGroupUnmatched] = []
+
 class FaceVerifyRequest(BaseModel):
     class_id: int
\ No newline at end of file
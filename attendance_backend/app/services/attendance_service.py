@@ -1,5 +1,5 @@
 """Attendance business logic"""
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
 from datetime import date, datetime, time
 from ..db import crud, models
@@ -138,6 +138,86 @@ class AttendanceService:
             check_in_type=check_in_type
         )
     
+    async def mark_attendance_bulk(
+        self,
+        items: List[Tuple[int, int, Optional[float]]],
+        db: Session,
+        check_in_type: str = "morning"
+    ) -> List[Tuple[int, bool, str]]:
+        """Mark attendance for many recognized students in one transaction
+        
+        Applies the same rules as mark_attendance, with one settings lookup
+        and one existing-records query per class.
+        
+        Args:
+            items: (student_id, class_id, confidence_score) tuples
+            
+        Returns:
+            List of (student_id, marked, message) in input order
+        """
+        now = datetime.now()
+        results: List[Optional[Tuple[int, bool, str]]] = [None] * len(items)
+        new_records, updates = [], []
+        marked_now = set()
+        by_class = {}
+        for position, (student_id, class_id, confidence_score) in enumerate(items):
+            by_class.setdefault(class_id, []).append(position)
+        
+        for class_id, positions in by_class.items():
+            settings = self._get_settings_for_class(class_id, db)
+            status = self._determine_status(now, settings)
+            if not settings["allow_late_arrivals"] and now.time() > settings["school_start_time"]:
+                for position in positions:
+                    results[position] = (items[position][0], False, "Late arrivals are not allowed")
+                continue
+            
+            student_ids = [items[position][0] for position in positions]
+            students = {s.id: s for s in crud.get_students_by_ids(db, student_ids)}
+            existing = crud.get_attendance_records_for_date_bulk(
+                db,
+                student_ids,
+                class_id,
+                check_in_type=check_in_type if settings["multiple_checkins"] else None
+            )
+            for position in positions:
+                student_id, _, confidence_score = items[position]
+                student = students.get(student_id)
+                if not student:
+                    results[position] = (student_id, False, "Student not found")
+                    continue
+                if student.class_id != class_id:
+                    results[position] = (student_id, False, "Student does not belong to this class")
+                    continue
+                record = existing.get(student_id)
+                if student_id in marked_now:
+                    results[position] = (student_id, False, "Attendance already marked for today")
+                    continue
+                marked_now.add(student_id)
+                if record:
+                    if record.status == "absent" and status != "absent":
+                        updates.append((record, {
+                            "status": status,
+                            "marked_at": now,
+                            "confidence_score": confidence_score,
+                            "check_in_type": check_in_type
+                        }))
+                        results[position] = (student_id, True, status)
+                    else:
+                        results[position] = (student_id, False, "Attendance already marked for today")
+                    continue
+                new_records.append({
+                    "student_id": student_id,
+                    "class_id": class_id,
+                    "confidence_score": confidence_score,
+                    "status": status,
+                    "check_in_type": check_in_type
+                })
+                results[position] = (student_id, True, status)
+        
+        if new_records or updates:
+            crud.save_attendance_bulk(db, new_records, updates)
+        return results
+    
     async def get_attendance_today(self, db: Session, class_id: Optional[int] = None, class_ids: Optional[List[int]] = None) -> List[models.Attendance]:
         """Get today's attendance records"""
         if class_id:
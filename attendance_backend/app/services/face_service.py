@@ -1,14 +1,22 @@
 """Face recognition business logic using InsightFace"""
 from typing import Tuple, Optional, List
 from sqlalchemy.orm import Session
-from ..ai.embedding import generate_embedding, embedding_from_json
-from ..ai.matcher import find_best_match
+from ..ai.embedding import (
+    embed_image_bytes, embed_detection, align_all_faces, decode_device_embedding, detect_frame, align_gated_faces
+)
+from ..ai.detection_cache import CachedDetection, detection_cache
+from ..ai.validator import FaceAnalysisResult, assess_face_quality
+from ..ai.gallery import student_gallery
+from ..ai.batcher import recognition_batcher
+from ..ai.matcher import GallerySearch, assign_one_to_one
+from ..ai.tracker import FaceTracker, Track
+from ..ai.inference_executor import inference_executor, InferenceUnavailable
 from ..db import crud
-from ..utils.image_utils import preprocess_image, validate_image_format, resize_image_if_needed
+from ..core.config import settings
+import asyncio
 import numpy as np
 import os
 import uuid
-import time
 
 # Directory to save student photos
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "uploads", "students")
@@ -17,54 +25,91 @@ class FaceService:
     def __init__(self):
         # Ensure upload directory exists
         os.makedirs(UPLOAD_DIR, exist_ok=True)
-        self._candidate_cache = {}
-        self._candidate_cache_ttl_seconds = 120
-        self._embedding_vector_cache = {}
-
-    def _invalidate_candidate_cache(self) -> None:
-        self._candidate_cache.clear()
-        self._embedding_vector_cache.clear()
-
-    def _cache_key(self, class_id: Optional[int], class_ids: Optional[List[int]]) -> tuple:
-        if class_id:
-            return ("class", int(class_id))
-        if class_ids:
-            return ("classes", tuple(sorted(int(x) for x in class_ids)))
-        return ("all", None)
-
-    def _get_candidates_cached(
+
+    def _class_organization(self, class_id: int, db: Session) -> Optional[int]:
+        class_obj = crud.get_class_by_id(db, class_id)
+        return class_obj.organization_id if class_obj else None
+
+    async def _embed(
         self,
-        db: Session,
-        class_id: Optional[int] = None,
-        class_ids: Optional[List[int]] = None,
-    ):
-        key = self._cache_key(class_id, class_ids)
-        now = time.time()
-        entry = self._candidate_cache.get(key)
-        if entry and (now - entry["loaded_at"]) < self._candidate_cache_ttl_seconds:
-            return entry["candidates"]
-
-        if class_id:
-            face_embeddings = crud.get_all_face_embeddings_by_class(db, class_id)
-        elif class_ids:
-            face_embeddings = crud.get_all_face_embeddings_by_class_ids(db, class_ids)
-        else:
-            face_embeddings = crud.get_all_face_embeddings(db)
+        image_data: bytes,
+        profile: str = "verify-fast",
+        hint: Optional[dict] = None,
+        detection: Optional[CachedDetection] = None
+    ) -> Tuple[Optional[np.ndarray], str]:
+        """Validate, decode and embed an upload off the event loop
+        
+        With a cached /face/detect result only alignment and recognition run.
+        """
+        if detection is not None:
+            return await embed_detection(detection, profile)
+        return await embed_image_bytes(image_data, profile, hint)
 
-        candidates = []
-        for face_embed in face_embeddings or []:
-            candidates.append((face_embed.student_id, embedding_from_json(face_embed.embedding)))
+    def _duplicate_scope(self, class_id: int, db: Session) -> Tuple[Optional[int], Optional[int]]:
+        """(org_id, class_id) to search for duplicates under settings.duplicate_check_scope
+
+        Under "organization", a class without an organization is its own
+        scope; searching with org_id=None would silently check globally.
+        """
+        if settings.duplicate_check_scope != "organization":
+            return None, None
+        org_id = self._class_organization(class_id, db)
+        return (org_id, None) if org_id is not None else (None, class_id)
+
+    def _find_duplicates(
+        self,
+        embeddings: np.ndarray,
+        student_ids: List[int],
+        scope_key: Tuple[Optional[int], Optional[int]],
+        db: Session
+    ) -> List[Optional[Tuple[int, float]]]:
+        """Check new templates against enrolled faces in one vectorized query
+
+        ``scope_key`` comes from _duplicate_scope; each row's own student is
+        ignored so re-enrollment is not reported as a duplicate.
+        """
+        if settings.duplicate_check_scope == "off":
+            return [None] * len(student_ids)
+        
+        student_gallery.ensure_loaded(db)
+        org_id, class_id = scope_key
+        searcher = student_gallery.searcher(class_id=class_id, org_id=org_id)
+        duplicates = []
+        for student_id, top in zip(student_ids, searcher.search_many(embeddings, k=2)):
+            others = [(sid, sim) for sid, sim in top if sid != student_id]
+            if others and others[0][1] >= settings.face_similarity_threshold:
+                duplicates.append(others[0])
+            else:
+                duplicates.append(None)
+        return duplicates
 
-        self._candidate_cache[key] = {"loaded_at": now, "candidates": candidates}
-        return candidates
+    def _save_photo(self, student_id: int, image_data: bytes) -> str:
+        """Store the enrollment photo and return its path relative to uploads/"""
+        photo_filename = f"{student_id}_{uuid.uuid4().hex[:8]}.jpg"
+        with open(os.path.join(UPLOAD_DIR, photo_filename), 'wb') as f:
+            f.write(image_data)
+        return f"students/{photo_filename}"
+
+    async def delete_face(self, student_id: int, db: Session) -> bool:
+        """Remove a student's enrolled face"""
+        deleted = crud.delete_face_embedding(db, student_id)
+        student_gallery.remove(student_id)
+        return deleted
     
-    async def register_face(self, image_data: bytes, student_id: int, db: Session) -> Tuple[bool, str]:
+    async def register_face(
+        self,
+        image_data: bytes,
+        student_id: int,
+        db: Session,
+        detection: Optional[CachedDetection] = None
+    ) -> Tuple[bool, str]:
         """Register a face for a student
         
         Args:
             image_data: Raw image bytes
             student_id: Student ID to register face for
             db: Database session
+            detection: Cached /face/detect result for the same image (skips decode and detection)
             
         Returns:
             Tuple[success, message]
@@ -75,160 +120,497 @@ class FaceService:
             if not student:
                 return False, "Student not found"
             
-            # Validate image format
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                return False, message
-            
-            # Save the photo as student profile picture
-            photo_filename = f"{student_id}_{uuid.uuid4().hex[:8]}.jpg"
-            photo_path = os.path.join(UPLOAD_DIR, photo_filename)
-            with open(photo_path, 'wb') as f:
-                f.write(image_data)
-            
-            # Preprocess image
-            image = preprocess_image(image_data)
-            if image is None:
-                return False, "Failed to process image"
-            
-            # Resize if needed
-            image = resize_image_if_needed(image)
-            
-            # Generate embedding
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            # Validate, decode and embed off the event loop
+            target_embedding, embed_message = await self._embed(image_data, "enroll-quality", detection=detection)
+            if target_embedding is None:
                 return False, embed_message
             
-            # Check if face is already registered
-            target_embedding = embedding_from_json(embedding_json)
-            all_embeddings = crud.get_all_face_embeddings(db)
+            # Check if face is already registered (scoped per settings.duplicate_check_scope)
+            org_id = self._class_organization(student.class_id, db)
+            scope_key = self._duplicate_scope(student.class_id, db)
+            duplicate = self._find_duplicates(target_embedding.reshape(1, -1), [student_id], scope_key, db)[0]
+            if duplicate:
+                existing_student = crud.get_student_by_id(db, duplicate[0])
+                existing_name = existing_student.full_name if existing_student else "Unknown"
+                return False, f"Face already registered for student: {existing_name} (Similarity: {duplicate[1]:.2f})"
             
-            candidates = []
-            for face_embed in all_embeddings:
-                # Skip checking against the student's own previous embedding if it exists (re-enrollment)
-                if face_embed.student_id == student_id:
-                    continue
-                candidate_embedding = embedding_from_json(face_embed.embedding)
-                candidates.append((face_embed.student_id, candidate_embedding))
-            
-            if candidates:
-                best_id, best_sim, is_match = find_best_match(target_embedding, candidates)
-                if is_match:
-                    existing_student = crud.get_student_by_id(db, best_id)
-                    return False, f"Face already registered for student: {existing_student.full_name} (Similarity: {best_sim:.2f})"
+            # Save the photo as student profile picture
+            photo_path = self._save_photo(student_id, image_data)
             
             # Save embedding to database
-            crud.create_face_embedding(db, student_id, embedding_json)
+            crud.create_face_embedding(db, student_id, target_embedding)
             
             # Update student face_enrolled status and photo_path
-            crud.update_student_face_enrolled(db, student_id, True, photo_path=f"students/{photo_filename}")
+            crud.update_student_face_enrolled(db, student_id, True, photo_path=photo_path)
 
-            # Ensure newly registered faces are immediately searchable
-            self._invalidate_candidate_cache()
+            # Make the new template searchable without reloading the gallery
+            student_gallery.upsert(student_id, student.class_id, org_id, target_embedding)
             
             return True, "Face registered successfully"
             
+        except InferenceUnavailable:
+            raise
         except Exception as e:
             return False, f"Error registering face: {str(e)}"
     
+    async def register_faces_bulk(self, items: List[Tuple[int, bytes]], db: Session) -> List[Tuple[int, bool, str]]:
+        """Register many faces at once
+        
+        Images are embedded concurrently (filling the recognition batcher).
+        New templates are checked against the enrolled gallery with one
+        matrix product per organization, and against each other with a
+        single Gram matrix, then written in one transaction.
+        
+        Args:
+            items: (student_id, image bytes) pairs
+            db: Database session
+            
+        Returns:
+            List of (student_id, success, message) in input order
+        """
+        results: List[Optional[Tuple[int, bool, str]]] = [None] * len(items)
+        candidates = []  # (position, student, image_data)
+        seen_students = set()
+        
+        for position, (student_id, image_data) in enumerate(items):
+            if student_id in seen_students:
+                results[position] = (student_id, False, "Student appears more than once in this batch")
+                continue
+            seen_students.add(student_id)
+            student = crud.get_student_by_id(db, student_id)
+            if not student:
+                results[position] = (student_id, False, "Student not found")
+                continue
+            candidates.append((position, student, image_data))
+        
+        outcomes = await asyncio.gather(
+            *[self._embed(image_data, "enroll-quality") for _, _, image_data in candidates],
+            return_exceptions=True
+        )
+        for outcome in outcomes:
+            if isinstance(outcome, InferenceUnavailable):
+                raise outcome
+        
+        pending = []  # (position, student, embedding, image_data)
+        for (position, student, image_data), outcome in zip(candidates, outcomes):
+            if isinstance(outcome, Exception):
+                results[position] = (student.id, False, f"Error registering face: {str(outcome)}")
+            elif outcome[0] is None:
+                results[position] = (student.id, False, outcome[1])
+            else:
+                pending.append((position, student, outcome[0], image_data))
+        
+        if pending:
+            # Duplicates against already-enrolled faces, one query per organization
+            org_ids = {}
+            scope_keys = {}
+            by_scope = {}
+            for row, (_, student, _, _) in enumerate(pending):
+                org_ids[row] = self._class_organization(student.class_id, db)
+                scope_keys[row] = self._duplicate_scope(student.class_id, db)
+                by_scope.setdefault(scope_keys[row], []).append(row)
+            matrix = np.vstack([p[2] for p in pending])
+            rejected = set()
+            for scope_key, rows in by_scope.items():
+                duplicates = self._find_duplicates(matrix[rows], [pending[r][1].id for r in rows], scope_key, db)
+                for row, duplicate in zip(rows, duplicates):
+                    if duplicate:
+                        existing_student = crud.get_student_by_id(db, duplicate[0])
+                        existing_name = existing_student.full_name if existing_student else "Unknown"
+                        results[pending[row][0]] = (
+                            pending[row][1].id, False,
+                            f"Face already registered for student: {existing_name} (Similarity: {duplicate[1]:.2f})"
+                        )
+                        rejected.add(row)
+            
+            # Duplicates within the batch: a face matching an earlier accepted face is rejected
+            if settings.duplicate_check_scope != "off":
+                gram = matrix @ matrix.T
+                accepted = []
+                for row in range(len(pending)):
+                    if row in rejected:
+                        continue
+                    same_scope = [a for a in accepted if scope_keys[a] == scope_keys[row]]
+                    if same_scope:
+                        best = max(same_scope, key=lambda a: gram[row, a])
+                        if gram[row, best] >= settings.face_similarity_threshold:
+                            results[pending[row][0]] = (
+                                pending[row][1].id, False,
+                                f"Face matches {pending[best][1].full_name} in this batch (Similarity: {gram[row, best]:.2f})"
+                            )
+                            rejected.add(row)
+                            continue
+                    accepted.append(row)
+            
+            to_write = [row for row in range(len(pending)) if row not in rejected]
+            if to_write:
+                records = []
+                for row in to_write:
+                    _, student, embedding, image_data = pending[row]
+                    records.append((student.id, embedding, self._save_photo(student.id, image_data)))
+                crud.create_face_embeddings_bulk(db, records)
+                student_gallery.upsert_many([
+                    (pending[row][1].id, pending[row][1].class_id, org_ids[row], pending[row][2]) for row in to_write
+                ])
+                for row in to_write:
+                    position, student, _, _ = pending[row]
+                    results[position] = (student.id, True, "Face registered successfully")
+        
+        return results
+
+    def _detect_with_quality(self, image_data: bytes) -> Tuple[Optional[FaceAnalysisResult], str, List[Tuple[str, float]]]:
+        analysis, message = detect_frame(image_data)
+        if analysis is None:
+            return None, message, []
+        return analysis, message, [assess_face_quality(analysis, i) for i in range(analysis.face_count)]
+
+    async def detect_faces(
+        self,
+        image_data: bytes,
+        user_id: int
+    ) -> Tuple[bool, str, List[dict], str, Optional[float], Optional[str]]:
+        """Detection-only pass (verify-fast ladder) with a reusable result token
+        
+        The decoded image and its face analysis are cached under a short-lived,
+        single-use token; /face/verify and /face/register accept it instead of
+        a new upload and then only align and embed.
+        
+        Returns:
+            Tuple[success, message, faces, quality, quality_score, detection_token]
+        """
+        analysis, message, qualities = await inference_executor.run(self._detect_with_quality, image_data)
+        if analysis is None:
+            return False, message, [], "unknown", None, None
+        if not analysis.face_count:
+            return True, message, [], "unknown", None, None
+        
+        face_info = [
+            {
+                "box": analysis.box(i),
+                "det_score": float(face.det_score),
+                "quality": label,
+                "quality_score": score,
+            }
+            for i, (face, (label, score)) in enumerate(zip(analysis.faces, qualities))
+        ]
+        # Overall quality describes the largest face (the one verify/register would use)
+        quality, quality_score = qualities[analysis.largest_face_index()]
+        token = detection_cache.put(CachedDetection(user_id, image_data, analysis))
+        return True, message, face_info, quality, quality_score, token
+
     async def verify_face(
         self,
         image_data: bytes,
         db: Session,
         class_id: Optional[int] = None,
-        class_ids: Optional[List[int]] = None
+        class_ids: Optional[List[int]] = None,
+        hint: Optional[dict] = None,
+        gallery: Optional[GallerySearch] = None,
+        detection: Optional[CachedDetection] = None,
+        claimed_student_id: Optional[int] = None
     ) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
         """Verify a face against enrolled students, optionally filtered by class
         
+        With ``claimed_student_id`` (student picked on the roster, card scan)
+        the probe is compared 1:1 with that student's template only, at the
+        stricter settings.face_claim_threshold.
+        
         Args:
             image_data: Raw image bytes
             db: Database session
             class_id: Optional Class ID to search within
+            hint: Optional client face hint (box/landmarks or aligned crop)
+            gallery: Pre-resolved gallery for the scope (streaming sessions)
+            detection: Cached /face/detect result (skips decode and detection)
+            claimed_student_id: Student the face must belong to (1:1 mode)
             
         Returns:
             Tuple[success, message, student_id, confidence_score, threshold]
         """
         try:
-            from ..core.config import settings
             threshold = settings.face_similarity_threshold
+            if claimed_student_id is not None:
+                threshold = settings.face_claim_threshold
+                student_gallery.ensure_loaded(db)
+                template = student_gallery.get_embedding(claimed_student_id)
+                if template is None:
+                    return False, "No face enrolled for this student", None, None, threshold
             
             print(f"\n{'='*60}")
             print(f"🔍 FACE VERIFICATION STARTED {'for class ' + str(class_id) if class_id else 'GLOBAL SEARCH'}")
             print(f"{'='*60}")
             
-            # Validate image format
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                print(f"❌ Image validation failed: {message}")
-                return False, message, None, None, threshold
-            
-            # Preprocess image
-            image = preprocess_image(image_data)
-            if image is None:
-                print("❌ Image preprocessing failed")
-                return False, "Failed to process image", None, None, threshold
-            
-            # Resize if needed
-            image = resize_image_if_needed(image)
-            
-            # Generate embedding for input image
+            # Validate, decode and embed the captured face
             print("📊 Generating embedding for captured face...")
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            target_embedding, embed_message = await self._embed(image_data, hint=hint, detection=detection)
+            if target_embedding is None:
                 print(f"❌ Embedding generation failed: {embed_message}")
                 return False, embed_message, None, None, threshold
             
-            print(f"✅ Embedding generated successfully (length: {len(embedding_json)} chars)")
-            target_embedding = embedding_from_json(embedding_json)
+            print(f"✅ Embedding generated successfully (dim: {target_embedding.shape[0]})")
             
-            # Get face embeddings
-            if class_id:
-                print(f"[Face] Fetching enrolled faces for class {class_id}...")
-                face_embeddings = crud.get_all_face_embeddings_by_class(db, class_id)
-            elif class_ids:
-                print(f"[Face] Fetching enrolled faces for {len(class_ids)} class(es)...")
-                face_embeddings = crud.get_all_face_embeddings_by_class_ids(db, class_ids)
-            else:
-                print("[Face] Fetching ALL enrolled faces...")
-                face_embeddings = crud.get_all_face_embeddings(db)
-
-            if not face_embeddings:
-                print(f"⚠️ No enrolled faces found")
-                return False, "No enrolled faces found", None, None, threshold
-            
-            print(f"✅ Found {len(face_embeddings)} enrolled face(s)")
-            
-            # Prepare candidate embeddings
-            candidates = []
-            for face_embed in face_embeddings:
-                cache_key = face_embed.student_id
-                cached = self._embedding_vector_cache.get(cache_key)
-                updated_at = getattr(face_embed, "updated_at", None)
-                if cached and cached.get("updated_at") == updated_at:
-                    candidate_embedding = cached["vector"]
-                else:
-                    candidate_embedding = embedding_from_json(face_embed.embedding)
-                    self._embedding_vector_cache[cache_key] = {
-                        "updated_at": updated_at,
-                        "vector": candidate_embedding,
-                    }
-                candidates.append((face_embed.student_id, candidate_embedding))
-            
-            # Find best match
-            print("\n🎯 Starting face matching...")
-            best_student_id, best_similarity, is_match = find_best_match(target_embedding, candidates)
-            
-            if is_match:
-                student = crud.get_student_by_id(db, best_student_id)
-                print(f"\n✅ MATCH FOUND: {student.full_name} (ID: {best_student_id})")
-                print(f"{'='*60}\n")
-                return True, f"Face recognized: {student.full_name}", best_student_id, best_similarity, threshold
-            else:
-                print(f"\n❌ NO MATCH: Best similarity {best_similarity:.4f} below threshold {threshold}")
-                print(f"{'='*60}\n")
-                return False, f"Face not recognized (confidence: {best_similarity:.2%}, required: {threshold:.2%})", None, best_similarity, threshold
+            if claimed_student_id is not None:
+                return self._match_claim(target_embedding, template, claimed_student_id, db, threshold)
+            return self._match_embedding(target_embedding, db, class_id, class_ids, threshold, gallery)
                 
+        except InferenceUnavailable:
+            raise
         except Exception as e:
             print(f"\n❌ ERROR in verify_face: {str(e)}")
             print(f"{'='*60}\n")
             return False, f"Error verifying face: {str(e)}", None, None, None
+
+    async def verify_tracked_frame(
+        self,
+        image_data: bytes,
+        tracker: FaceTracker,
+        gallery: GallerySearch
+    ) -> Tuple[str, List[Track], float]:
+        """Streaming frame: detect every face, recognize only tracks that need it
+        
+        Tracks the tracker already identified with high confidence reuse their
+        identity, so such frames cost one detector pass. The rest pass the
+        quality gate (failures keep their reason in track.quality_issue) and
+        are then embedded in one batch and matched against the session's gallery.
+        
+        Returns:
+            Tuple[message, tracks seen in the frame, scale to original pixels]
+        """
+        threshold = settings.face_similarity_threshold
+        analysis, message = await inference_executor.run(detect_frame, image_data)
+        if analysis is None:
+            return message, [], 1.0
+        
+        tracks = tracker.update(analysis.faces)
+        pending = [track for track in tracks if not track.reused]
+        if pending:
+            gated = await inference_executor.run(align_gated_faces, analysis, [track.face for track in pending])
+            for track, (_, reason) in zip(pending, gated):
+                track.quality_issue = reason
+            pending = [track for track, (crop, _) in zip(pending, gated) if crop is not None]
+            crops = [crop for crop, _ in gated if crop is not None]
+        if pending:
+            probes = await recognition_batcher.embed_many(crops)
+            for track, top in zip(pending, gallery.search_many(probes, k=1)):
+                student_id, similarity = top[0] if top else (None, 0.0)
+                tracker.observe(track, student_id, similarity, threshold)
+        return message, tracks, analysis.scale
+
+    def _match_claim(
+        self,
+        target_embedding: np.ndarray,
+        template: np.ndarray,
+        student_id: int,
+        db: Session,
+        threshold: float
+    ) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
+        """1:1 comparison with a claimed student's template (cost independent of gallery size)"""
+        similarity = float(template @ target_embedding)
+        print(f"🎯 1:1 check against student {student_id}: similarity {similarity:.4f} (threshold {threshold})")
+        if similarity >= threshold:
+            student = crud.get_student_by_id(db, student_id)
+            name = student.full_name if student else "Unknown"
+            return True, f"Face recognized: {name}", student_id, similarity, threshold
+        return False, f"Face does not match the selected student (confidence: {similarity:.2%}, required: {threshold:.2%})", None, similarity, threshold
+
+    def _match_embedding(
+        self,
+        target_embedding: np.ndarray,
+        db: Session,
+        class_id: Optional[int],
+        class_ids: Optional[List[int]],
+        threshold: float,
+        gallery: Optional[GallerySearch] = None
+    ) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
+        """Match one probe against the in-memory gallery for a scope"""
+        # Read the in-memory gallery snapshot for this scope (no DB round trip)
+        if gallery is None:
+            student_gallery.ensure_loaded(db)
+            gallery = student_gallery.searcher(class_id=class_id, class_ids=class_ids)
+
+        if not len(gallery):
+            print(f"⚠️ No enrolled faces found")
+            return False, "No enrolled faces found", None, None, threshold
+        
+        print(f"✅ Found {len(gallery)} enrolled face(s) (gallery version {student_gallery.version})")
+        
+        # Find best match with a single matrix-vector product over the gallery
+        print("\n🎯 Starting face matching...")
+        top = gallery.search(target_embedding, k=3)
+        best_student_id, best_similarity = top[0] if top else (None, 0.0)
+        is_match = bool(top) and best_similarity >= threshold
+        margin = best_similarity - (top[1][1] if len(top) > 1 else 0.0)
+        print(f"  Top matches: {top} (margin: {margin:.4f})")
+        
+        if is_match:
+            student = crud.get_student_by_id(db, best_student_id)
+            print(f"\n✅ MATCH FOUND: {student.full_name} (ID: {best_student_id})")
+            print(f"{'='*60}\n")
+            return True, f"Face recognized: {student.full_name}", best_student_id, best_similarity, threshold
+        else:
+            print(f"\n❌ NO MATCH: Best similarity {best_similarity:.4f} below threshold {threshold}")
+            print(f"{'='*60}\n")
+            return False, f"Face not recognized (confidence: {best_similarity:.2%}, required: {threshold:.2%})", None, best_similarity, threshold
+
+    async def verify_embedding(
+        self,
+        blob: bytes,
+        db: Session,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None
+    ) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
+        """Verify an embedding computed on-device: only the gallery match runs here
+        
+        Returns:
+            Tuple[success, message, student_id, confidence_score, threshold]
+        """
+        threshold = settings.face_similarity_threshold
+        target_embedding, message = decode_device_embedding(blob)
+        if target_embedding is None:
+            return False, message, None, None, threshold
+        return self._match_embedding(target_embedding, db, class_id, class_ids, threshold)
+
+    async def verify_faces_batch(
+        self,
+        images: List[bytes],
+        db: Session,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None
+    ) -> Tuple[float, List[Tuple[bool, str, Optional[int], Optional[float]]]]:
+        """Verify several independent captures against one gallery snapshot
+        
+        Images are decoded and detected concurrently on the inference
+        executor and their crops share recognition batches; all probes are
+        then matched with a single search_many call.
+        
+        Returns:
+            Tuple[threshold, [(success, message, student_id, confidence_score), ...]]
+        """
+        threshold = settings.face_similarity_threshold
+        outcomes = await asyncio.gather(*[self._embed(data) for data in images], return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, InferenceUnavailable):
+                raise outcome
+        
+        results: List[Tuple[bool, str, Optional[int], Optional[float]]] = []
+        rows, probes = [], []
+        for position, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                results.append((False, f"Error verifying face: {str(outcome)}", None, None))
+            elif outcome[0] is None:
+                results.append((False, outcome[1], None, None))
+            else:
+                results.append(None)
+                rows.append(position)
+                probes.append(outcome[0])
+        if not probes:
+            return threshold, results
+        
+        student_gallery.ensure_loaded(db)
+        gallery = student_gallery.searcher(class_id=class_id, class_ids=class_ids)
+        if not len(gallery):
+            for position in rows:
+                results[position] = (False, "No enrolled faces found", None, None)
+            return threshold, results
+        
+        matched = {}
+        for position, top in zip(rows, gallery.search_many(np.vstack(probes), k=1)):
+            best_id, best_similarity = top[0] if top else (None, 0.0)
+            if best_id is not None and best_similarity >= threshold:
+                matched[position] = (best_id, best_similarity)
+            else:
+                results[position] = (
+                    False,
+                    f"Face not recognized (confidence: {best_similarity:.2%}, required: {threshold:.2%})",
+                    None, best_similarity
+                )
+        students = {s.id: s for s in crud.get_students_by_ids(db, [sid for sid, _ in matched.values()])}
+        for position, (student_id, similarity) in matched.items():
+            student = students.get(student_id)
+            name = student.full_name if student else "Unknown"
+            results[position] = (True, f"Face recognized: {name}", student_id, similarity)
+        print(f"[VerifyBatch] {len(matched)} of {len(images)} capture(s) recognized (gallery {len(gallery)})")
+        return threshold, results
+
+    async def search_face(
+        self,
+        image_data: bytes,
+        db: Session,
+        k: int = 5,
+        class_id: Optional[int] = None,
+        class_ids: Optional[List[int]] = None,
+        org_id: Optional[int] = None
+    ) -> Tuple[bool, str, List[Tuple[int, float]], float]:
+        """Top-k "who is this?" search within a scope
+        
+        Returns:
+            Tuple[success, message, [(student_id, similarity), ...], threshold]
+        """
+        threshold = settings.face_similarity_threshold
+        try:
+            target_embedding, embed_message = await self._embed(image_data)
+            if target_embedding is None:
+                return False, embed_message, [], threshold
+            
+            student_gallery.ensure_loaded(db)
+            gallery = student_gallery.searcher(class_id=class_id, class_ids=class_ids, org_id=org_id)
+            if not len(gallery):
+                return False, "No enrolled faces found", [], threshold
+            
+            candidates = gallery.search(target_embedding, k=k)
+            return True, f"{len(candidates)} candidate(s) found", candidates, threshold
+        except InferenceUnavailable:
+            raise
+        except Exception as e:
+            return False, f"Error searching face: {str(e)}", [], threshold
+
+    async def recognize_group(
+        self,
+        images: List[bytes],
+        class_id: int,
+        db: Session
+    ) -> Tuple[bool, str, List[dict], List[dict], float]:
+        """Recognize every face in one or more classroom photos
+        
+        All faces are embedded through the recognition batcher and scored
+        against the class gallery with one matrix product; a greedy
+        one-to-one assignment keeps any student from being matched twice.
+        
+        Returns:
+            Tuple[success, message, matches, unmatched, threshold] where matches
+            carry student_id/similarity and unmatched carry the best similarity
+        """
+        threshold = settings.face_similarity_threshold
+        try:
+            detections = await asyncio.gather(*[inference_executor.run(align_all_faces, data) for data in images])
+            faces, crops = [], []
+            for image_index, (boxes, image_crops, _) in enumerate(detections):
+                for box in boxes:
+                    faces.append({"image_index": image_index, **box})
+                crops.extend(image_crops)
+            if not faces:
+                return False, detections[0][2] if len(detections) == 1 else "No face detected in images", [], [], threshold
+            
+            probes = await recognition_batcher.embed_many(crops)
+            student_gallery.ensure_loaded(db)
+            gallery = student_gallery.snapshot(class_id=class_id)
+            scores = gallery.score_matrix(probes)
+            
+            matches = []
+            assigned = set()
+            for row, col, similarity in assign_one_to_one(scores, threshold):
+                matches.append({**faces[row], "student_id": int(gallery.ids[col]), "similarity": similarity})
+                assigned.add(row)
+            unmatched = []
+            for row, face in enumerate(faces):
+                if row not in assigned:
+                    best = float(scores[row].max()) if scores.shape[1] else 0.0
+                    unmatched.append({**face, "best_similarity": best})
+            
+            print(f"[Group] {len(faces)} face(s) in {len(images)} photo(s): "
+                  f"{len(matches)} matched, {len(unmatched)} unmatched (class {class_id}, gallery {len(gallery)})")
+            return True, f"{len(matches)} of {len(faces)} face(s) recognized", matches, unmatched, threshold
+        except InferenceUnavailable:
+            raise
+        except Exception as e:
+            return False, f"Error recognizing group photo: {str(e)}", [], [], threshold
@@ -2,6 +2,7 @@
 from typing import List, Optional
 from sqlalchemy.orm import Session
 from ..db import crud, models
+from ..ai.gallery import student_gallery
 from ..schemas.student import StudentCreate, StudentUpdate, StudentResponse
 
 class StudentService:
@@ -53,8 +54,15 @@ class StudentService:
             if not class_obj:
                 raise ValueError("Class not found")
         
+        previous_class_id = student.class_id
         update_dict = student_data.model_dump(exclude_unset=True)
-        return crud.update_student(db, student_id, update_dict)
+        updated = crud.update_student(db, student_id, update_dict)
+
+        # Keep the face gallery partitioned by the student's current class
+        if updated and updated.class_id != previous_class_id:
+            org_id = updated.class_obj.organization_id if updated.class_obj else None
+            student_gallery.move(student_id, updated.class_id, org_id)
+        return updated
     
     async def delete_student(self, student_id: int, db: Session) -> bool:
         """Delete a student"""
@@ -62,4 +70,6 @@ class StudentService:
         if not student:
             raise ValueError("Student not found")
         
-        return crud.delete_student(db, student_id)
+        deleted = crud.delete_student(db, student_id)
+        student_gallery.remove(student_id)
+        return deleted
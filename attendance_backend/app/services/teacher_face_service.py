@@ -1,10 +1,11 @@
 """Teacher Face ID business logic using embeddings"""
 from typing import Tuple, Optional
 from sqlalchemy.orm import Session
-from ..ai.embedding import generate_embedding, embedding_from_json
-from ..ai.matcher import find_best_match
+from ..ai.embedding import embed_image_bytes
+from ..ai.gallery import teacher_gallery
+from ..ai.inference_executor import InferenceUnavailable
 from ..db import crud
-from ..utils.image_utils import preprocess_image, validate_image_format, resize_image_if_needed
+from ..core.config import settings
 
 class TeacherFaceService:
     def __init__(self):
@@ -17,76 +18,72 @@ class TeacherFaceService:
             if not teacher:
                 return False, "Teacher not found"
 
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                return False, message
-
-            image = preprocess_image(image_data)
-            if image is None:
-                return False, "Failed to process image"
-
-            image = resize_image_if_needed(image)
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            target_embedding, embed_message = await embed_image_bytes(image_data, "enroll-quality")
+            if target_embedding is None:
                 return False, embed_message
 
-            target_embedding = embedding_from_json(embedding_json)
-            all_embeddings = crud.get_all_teacher_face_embeddings(db)
-
-            candidates = []
-            for face_embed in all_embeddings:
-                if face_embed.teacher_id == teacher_id:
-                    continue
-                candidate_embedding = embedding_from_json(face_embed.embedding)
-                candidates.append((face_embed.teacher_id, candidate_embedding))
-
-            if candidates:
-                best_id, best_sim, is_match = find_best_match(target_embedding, candidates)
-                if is_match:
+            # Duplicate Face IDs are checked across every organization
+            teacher_gallery.ensure_loaded(db)
+            others = [(tid, sim) for tid, sim in teacher_gallery.searcher().search(target_embedding, k=2) if tid != teacher_id]
+            if others:
+                best_id, best_sim = others[0]
+                if best_sim >= settings.face_similarity_threshold:
                     existing_teacher = crud.get_teacher_by_id(db, best_id)
                     existing_name = existing_teacher.full_name if existing_teacher else "Unknown"
                     return False, f"Face already registered for teacher: {existing_name} (Similarity: {best_sim:.2f})"
 
-            crud.create_teacher_face_embedding(db, teacher_id, embedding_json)
+            crud.create_teacher_face_embedding(db, teacher_id, target_embedding)
+            teacher_gallery.upsert(teacher_id, teacher.organization_id, target_embedding)
             return True, "Face ID registered successfully"
+        except InferenceUnavailable:
+            raise
         except Exception as e:
             return False, f"Error registering Face ID: {str(e)}"
 
-    async def verify_face_id(self, image_data: bytes, db: Session) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
-        """Verify a face against enrolled teacher embeddings."""
+    async def verify_face_id(
+        self,
+        image_data: bytes,
+        db: Session,
+        org_id: Optional[int] = None,
+        teacher_id: Optional[int] = None
+    ) -> Tuple[bool, str, Optional[int], Optional[float], Optional[float]]:
+        """Verify a face against enrolled teacher embeddings.
+
+        With ``teacher_id`` (the login identifier was given) this is a 1:1
+        check against that teacher's template, failing with the same generic
+        message whether or not the account has a Face ID; with ``org_id``
+        only that organization's teachers are searched; otherwise all are.
+        """
         try:
-            from ..core.config import settings
             threshold = settings.face_similarity_threshold
 
-            is_valid, message = validate_image_format(image_data)
-            if not is_valid:
-                return False, message, None, None, threshold
-
-            image = preprocess_image(image_data)
-            if image is None:
-                return False, "Failed to process image", None, None, threshold
-
-            image = resize_image_if_needed(image)
-            embedding_json, embed_message = generate_embedding(image)
-            if embedding_json is None:
+            teacher_gallery.ensure_loaded(db)
+            if teacher_id is not None:
+                # May be None; still embed and answer like a mismatch so callers can't probe which accounts have Face ID
+                template = teacher_gallery.get_embedding(teacher_id)
+            else:
+                gallery = teacher_gallery.partition(org_id) if org_id is not None else teacher_gallery.searcher()
+                if not len(gallery):
+                    return False, "No Face ID registered", None, None, threshold
+
+            target_embedding, embed_message = await embed_image_bytes(image_data)
+            if target_embedding is None:
                 return False, embed_message, None, None, threshold
 
-            target_embedding = embedding_from_json(embedding_json)
-            face_embeddings = crud.get_all_teacher_face_embeddings(db)
-            if not face_embeddings:
-                return False, "No Face ID registered", None, None, threshold
-
-            candidates = []
-            for face_embed in face_embeddings:
-                candidate_embedding = embedding_from_json(face_embed.embedding)
-                candidates.append((face_embed.teacher_id, candidate_embedding))
-
-            best_teacher_id, best_similarity, is_match = find_best_match(target_embedding, candidates)
+            if teacher_id is not None:
+                best_similarity = float(template @ target_embedding) if template is not None else 0.0
+                if best_similarity < threshold:
+                    return False, "Face not recognized", None, None, threshold
+                best_teacher_id, is_match = teacher_id, True
+            else:
+                best_teacher_id, best_similarity, is_match, _ = gallery.best_match(target_embedding, threshold)
             if is_match:
                 teacher = crud.get_teacher_by_id(db, best_teacher_id)
                 name = teacher.full_name if teacher else "Unknown"
                 return True, f"Face recognized: {name}", best_teacher_id, best_similarity, threshold
 
             return False, f"Face not recognized (confidence: {best_similarity:.2%}, required: {threshold:.2%})", None, best_similarity, threshold
+        except InferenceUnavailable:
+            raise
         except Exception as e:
             return False, f"Error verifying Face ID: {str(e)}", None, None, None
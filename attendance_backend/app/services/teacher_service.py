@@ -2,6 +2,7 @@
 from typing import List, Optional
 from sqlalchemy.orm import Session
 from ..db import crud, models
+from ..ai.gallery import teacher_gallery
 from ..schemas.teacher import TeacherCreate, TeacherUpdate
 
 class TeacherService:
@@ -54,7 +55,11 @@ class TeacherService:
         # Remove None values
         update_data = {k: v for k, v in update_data.items() if v is not None}
         
-        return crud.update_teacher(db, teacher_id, update_data)
+        updated = crud.update_teacher(db, teacher_id, update_data)
+        # Keep the Face ID gallery partitioned by the teacher's organization
+        if updated:
+            teacher_gallery.move(teacher_id, updated.organization_id)
+        return updated
     
     async def delete_teacher(self, teacher_id: int, db: Session) -> bool:
         """Delete a teacher"""
@@ -62,7 +67,9 @@ class TeacherService:
         if not teacher:
             raise ValueError("Teacher not found")
         
-        return crud.delete_teacher(db, teacher_id)
+        deleted = crud.delete_teacher(db, teacher_id)
+        teacher_gallery.remove(teacher_id)
+        return deleted
     
     async def bulk_delete_teachers(self, teacher_ids: List[int], db: Session) -> int:
         """Delete multiple teachers"""
@@ -70,6 +77,7 @@ class TeacherService:
         for teacher_id in teacher_ids:
             try:
                 if crud.delete_teacher(db, teacher_id):
+                    teacher_gallery.remove(teacher_id)
                     deleted_count += 1
             except Exception:
                 # Continue deleting other teachers even if one fails
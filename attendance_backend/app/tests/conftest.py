@@ -0,0 +1,56 @@
+"""Shared fixtures: an in-memory database and a face service over a fresh gallery"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.db import models
+from app.ai.gallery import GalleryIndex
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        models.Organization(id=1, name="Org A", code="A"),
+        models.Organization(id=2, name="Org B", code="B"),
+        models.Teacher(id=1, teacher_id="t1", full_name="T", email="t@x.io", password_hash="x", organization_id=1),
+        models.Class(id=10, class_name="A1", class_code="A1", teacher_id=1, organization_id=1),
+        models.Class(id=11, class_name="A2", class_code="A2", teacher_id=1, organization_id=1),
+        models.Class(id=20, class_name="B1", class_code="B1", teacher_id=1, organization_id=2),
+    ])
+    for student_id, class_id in [(1, 10), (2, 10), (3, 11), (4, 20)]:
+        session.add(models.Student(id=student_id, student_id=f"s{student_id}", full_name=f"S{student_id}", class_id=class_id))
+    session.commit()
+    yield session
+    session.close()
+
+@pytest.fixture
+def face_gallery(monkeypatch):
+    """An empty GalleryIndex installed as the face service's student gallery"""
+    from app.services import face_service as face_service_module
+    index = GalleryIndex()
+    monkeypatch.setattr(face_service_module, "student_gallery", index)
+    return index
+
+@pytest.fixture
+def embed_probes():
+    """Image bytes -> embedding (or an (embedding, message) pair) returned by fake_embed"""
+    return {}
+
+@pytest.fixture
+def fake_embed(embed_probes):
+    """Stand-in for the detector and recognition model, answering from embed_probes"""
+    async def embed(data, profile="verify-fast", *args, **kwargs):
+        probe = embed_probes[data]
+        return probe if isinstance(probe, tuple) else (probe, "ok")
+    return embed
+
+@pytest.fixture
+def face_service(face_gallery, fake_embed, monkeypatch, tmp_path):
+    """FaceService over face_gallery, embedding through fake_embed and saving photos to tmp_path"""
+    from app.services import face_service as face_service_module
+    monkeypatch.setattr(face_service_module, "UPLOAD_DIR", str(tmp_path))
+    service = face_service_module.FaceService()
+    monkeypatch.setattr(service, "_embed", fake_embed)
+    return service
@@ -20,4 +20,463 @@ def test_match_faces():
     
     is_match, similarity = match_faces(embedding1, embedding2)
     assert is_match == True
-    assert similarity > 0.9
\ No newline at end of file
+    assert similarity > 0.9
+
+
+def test_embedding_gallery_matches_loop():
+    """Vectorized gallery search agrees with per-candidate cosine similarity"""
+    import numpy as np
+    from app.ai.matcher import EmbeddingGallery, find_best_match
+    rng = np.random.default_rng(0)
+    candidates = [(i + 1, rng.standard_normal(512).astype(np.float32)) for i in range(50)]
+    probe = candidates[17][1] + 0.1 * rng.standard_normal(512).astype(np.float32)
+
+    gallery = EmbeddingGallery.from_candidates(candidates)
+    expected = sorted(((sid, cosine_similarity(probe, emb)) for sid, emb in candidates), key=lambda x: -x[1])
+
+    top = gallery.search(probe, k=3)
+    assert [sid for sid, _ in top] == [sid for sid, _ in expected[:3]]
+    assert abs(top[0][1] - expected[0][1]) < 1e-5
+
+    best_id, best_sim, is_match, margin = gallery.best_match(probe, threshold=0.5)
+    assert best_id == 18 and is_match
+    assert abs(margin - (expected[0][1] - expected[1][1])) < 1e-5
+    assert find_best_match(probe, candidates, threshold=0.5)[0] == 18
+
+def test_embedding_gallery_empty():
+    """Empty galleries never match"""
+    import numpy as np
+    from app.ai.matcher import EmbeddingGallery
+    assert EmbeddingGallery().best_match(np.ones(512)) == (None, 0.0, False, 0.0)
+
+def test_gallery_search_subclasses_must_implement_search():
+    """A matcher missing search() fails when constructed, not when a request uses it"""
+    import pytest
+    from app.ai.matcher import GallerySearch
+    class Incomplete(GallerySearch):
+        def __len__(self):
+            return 0
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_quantized_gallery_reranks_to_exact_scores(monkeypatch):
+    """float16/int8 scans return the float32 top-k with exact similarities"""
+    import numpy as np
+    from app.ai.matcher import EmbeddingGallery
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "gallery_rerank_candidates", 8)
+    rng = np.random.default_rng(1)
+    gallery = EmbeddingGallery(np.arange(5000), rng.standard_normal((5000, 512)).astype(np.float32))
+    probes = gallery.matrix[[7, 4321]] + 0.05 * rng.standard_normal((2, 512)).astype(np.float32)
+    expected = gallery.search_many(probes, k=3)
+
+    assert gallery.compressed("float32") is gallery
+    for precision in ("float16", "int8"):
+        quantized = gallery.compressed(precision)
+        assert quantized is gallery.compressed(precision)
+        assert quantized.nbytes < gallery.matrix.nbytes
+        for got, want in zip(quantized.search_many(probes, k=3), expected):
+            assert [sid for sid, _ in got] == [sid for sid, _ in want]
+            assert np.allclose([s for _, s in got], [s for _, s in want], atol=1e-6)
+        assert quantized.best_match(probes[0], threshold=0.5)[0] == 7
+    with pytest.raises(ValueError):
+        gallery.compressed("int4")
+
+def test_quantized_gallery_matches_float32_at_ties_and_threshold(monkeypatch):
+    """Near-ties, exact ties and scores either side of the match threshold rank as in float32"""
+    import numpy as np
+    from app.ai.matcher import EmbeddingGallery, normalize_embeddings
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "gallery_rerank_candidates", 8)
+    threshold = settings.face_similarity_threshold
+    rng = np.random.default_rng(3)
+
+    def at(anchor, similarity):
+        """Unit vector with the given cosine similarity to a unit anchor"""
+        noise = rng.standard_normal(anchor.shape[0]).astype(np.float64)
+        noise -= (noise @ anchor) * anchor
+        return similarity * anchor + np.sqrt(1 - similarity ** 2) * noise / np.linalg.norm(noise)
+
+    probe = normalize_embeddings(rng.standard_normal(512))[0].astype(np.float64)
+    vectors = normalize_embeddings(rng.standard_normal((5000, 512)))
+    # Closer than int8 quantization error: only the float32 re-rank orders them
+    vectors[1234] = at(probe, threshold + 2e-4)
+    vectors[77] = at(probe, threshold + 1e-4)
+    vectors[4000] = vectors[3000] = at(probe, threshold - 1e-4)  # exact tie just below threshold
+    gallery = EmbeddingGallery(np.arange(5000), vectors)
+    expected = gallery.search(probe, k=4)
+    assert [sid for sid, _ in expected] == [1234, 77, 3000, 4000]
+
+    # Probes whose true match sits just above or just below the threshold
+    truth = rng.choice(5000, 100, replace=False)
+    margins = np.where(np.arange(100) % 2, 1e-3, -1e-3)
+    probes = np.stack([at(gallery.matrix[t].astype(np.float64), threshold + m) for t, m in zip(truth, margins)])
+    expected_matches = [gallery.best_match(p, threshold)[:3] for p in probes]
+    assert [m[2] for m in expected_matches] == [bool(m > 0) for m in margins]
+
+    for precision in ("float16", "int8"):
+        quantized = gallery.compressed(precision)
+        got = quantized.search(probe, k=4)
+        assert [sid for sid, _ in got] == [sid for sid, _ in expected]
+        assert np.allclose([s for _, s in got], [s for _, s in expected], atol=1e-6)
+        assert quantized.best_match(probe, threshold)[:3] == gallery.best_match(probe, threshold)[:3]
+        matches = [quantized.best_match(p, threshold)[:3] for p in probes]
+        assert [(sid, ok) for sid, _, ok in matches] == [(sid, ok) for sid, _, ok in expected_matches]
+        assert np.allclose([s for _, s, _ in matches], [s for _, s, _ in expected_matches], atol=1e-6)
+
+def test_embedding_blob_roundtrip():
+    """Binary storage keeps a normalized float32 vector readable without copying"""
+    import json
+    import numpy as np
+    from types import SimpleNamespace
+    from app.ai.embedding import embedding_to_blob, embedding_from_blob, read_blob_header, decode_stored_embedding
+    embedding = np.random.rand(512).astype(np.float32)
+    blob = embedding_to_blob(embedding, model_name="buffalo_l")
+
+    model_name, dim, offset = read_blob_header(blob)
+    assert (model_name, dim) == ("buffalo_l", 512)
+    assert len(blob) == offset + 512 * 4
+
+    vector = embedding_from_blob(blob)
+    assert not vector.flags.owndata
+    assert np.allclose(vector, embedding / np.linalg.norm(embedding), atol=1e-6)
+
+    legacy = SimpleNamespace(embedding=json.dumps(embedding.tolist()), embedding_blob=None)
+    assert np.allclose(decode_stored_embedding(legacy), vector, atol=1e-6)
+
+def test_inference_executor_bounds_queue_and_times_out():
+    import asyncio
+    import threading
+    from app.ai.inference_executor import InferenceExecutor, InferenceQueueFull, InferenceTimeout
+    executor = InferenceExecutor(workers=1, max_queue=1, timeout=5)
+    release = threading.Event()
+
+    async def scenario():
+        blocked = asyncio.ensure_future(executor.run(release.wait))
+        queued = asyncio.ensure_future(executor.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        assert executor.metrics()["queue_depth"] == 1
+        with pytest.raises(InferenceQueueFull):
+            await executor.run(lambda: None)
+        release.set()
+        assert await queued == "queued"
+        await blocked
+        with pytest.raises(InferenceTimeout):
+            await executor.run(threading.Event().wait, 0.5, timeout=0.05)
+
+    asyncio.run(scenario())
+    metrics = executor.metrics()
+    assert metrics["rejected"] == 1 and metrics["timed_out"] == 1
+    executor.shutdown()
+
+def test_recognition_batcher_coalesces_concurrent_crops():
+    import asyncio
+    import numpy as np
+    from app.ai.batcher import RecognitionBatcher
+    calls = []
+    def embed_fn(crops):
+        calls.append(len(crops))
+        return np.stack([np.full(4, crop[0, 0, 0], dtype=np.float32) for crop in crops])
+    batcher = RecognitionBatcher(max_batch=4, max_wait_ms=20, embed_fn=embed_fn)
+    crops = [np.full((112, 112, 3), i, dtype=np.uint8) for i in range(6)]
+
+    async def scenario():
+        return await asyncio.gather(*[batcher.embed(crop) for crop in crops])
+
+    results = asyncio.run(scenario())
+    assert calls == [4, 2]
+    assert [int(r[0]) for r in results] == list(range(6))
+
+def test_assign_one_to_one_never_reuses_a_student():
+    import numpy as np
+    from app.ai.matcher import assign_one_to_one
+    # Both probes prefer gallery entry 0; the weaker one falls back to entry 1
+    scores = np.array([[0.9, 0.7], [0.8, 0.65], [0.3, 0.2]], dtype=np.float32)
+    pairs = assign_one_to_one(scores, threshold=0.6)
+    assert [(r, c) for r, c, _ in pairs] == [(0, 0), (1, 1)]
+
+def test_detector_ladder_retries_larger_scale_only_when_empty(monkeypatch):
+    import numpy as np
+    from app.ai.insightface_model import InsightFaceModel, DetectionStats
+    from app.ai.profiles import ModelProfile
+    calls = []
+    class StubDetector:
+        def detect(self, image, input_size=None, max_num=0, metric="default"):
+            calls.append(input_size)
+            if input_size[0] < 640:
+                return np.empty((0, 5), dtype=np.float32), None
+            return np.array([[10, 10, 60, 60, 0.9]], dtype=np.float32), np.zeros((1, 5, 2), dtype=np.float32)
+    class StubAnalysis:
+        det_model = StubDetector()
+
+    model = InsightFaceModel()
+    monkeypatch.setattr(model, "get_model", lambda: StubAnalysis())
+    monkeypatch.setattr(model, "detection_stats", DetectionStats())
+    profile = ModelProfile("verify-fast", [(320, 320), (640, 640)])
+    faces = model.detect(np.zeros((480, 640, 3), dtype=np.uint8), profile)
+    assert len(faces) == 1 and calls == [(320, 320), (640, 640)]
+    stats = model.detection_stats.metrics()
+    assert stats["verify-fast@320"]["hit_rate"] == 0.0 and stats["verify-fast@640"]["calls"] == 1
+
+def test_face_hint_crops_roi_and_falls_back_to_full_detection(monkeypatch):
+    import cv2
+    import numpy as np
+    from insightface.app.common import Face
+    from app.ai import embedding
+    frame = cv2.imencode(".jpg", np.full((400, 600, 3), 128, dtype=np.uint8))[1].tobytes()
+    seen = []
+    def fake_detect(image, profile=None, max_num=None, face_policy=None):
+        seen.append((profile.name, image.shape[:2]))
+        if profile.name == "roi" and roi_has_face:
+            return [Face(bbox=np.array([10, 10, 50, 50]), kps=np.zeros((5, 2)), det_score=0.9)]
+        if profile.name == "verify-fast":
+            return [Face(bbox=np.array([100, 100, 200, 200]), kps=np.zeros((5, 2)), det_score=0.9)]
+        return []
+    monkeypatch.setattr(embedding.face_model, "detect", fake_detect)
+    monkeypatch.setattr(embedding.face_model, "align", lambda image, face: np.zeros((112, 112, 3), dtype=np.uint8))
+    monkeypatch.setattr(embedding.get_profile("verify-fast"), "quality", None)
+
+    roi_has_face = True
+    crop, message = embedding.align_with_hint(frame, box=[200, 100, 300, 200])
+    assert crop is not None and "client ROI" in message
+    assert seen == [("roi", (180, 180))]
+
+    roi_has_face = False
+    seen.clear()
+    crop, message = embedding.align_with_hint(frame, box=[200, 100, 300, 200])
+    assert crop is not None and message == "Face detected"
+    assert [name for name, _ in seen] == ["roi", "verify-fast"]
+
+def test_decode_image_uses_reduced_jpeg_decode():
+    import cv2
+    import numpy as np
+    from app.utils.image_utils import decode_image
+    frame = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    frame[:, :, 2] = 255  # red in BGR
+    jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+    image, _, scale = decode_image(jpeg, max_size=1024)
+    assert image.shape == (750, 1000, 3) and scale == 4.0
+    assert image[0, 0, 0] > 200 and image[0, 0, 2] < 50  # RGB order
+
+    # EXIF orientation 6 (rotate 90): decoded upright as 3000x4000, still 4 original pixels per pixel
+    import io
+    from PIL import Image
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.new("RGB", (4000, 3000), (255, 0, 0)).save(buffer, "JPEG", exif=exif)
+    image, _, scale = decode_image(buffer.getvalue(), max_size=1024)
+    assert image.shape == (1000, 750, 3) and scale == 4.0
+
+    png = cv2.imencode(".png", frame[:600, :800])[1].tobytes()
+    image, _, scale = decode_image(png, max_size=1024)
+    assert image.shape == (600, 800, 3) and scale == 1.0
+    assert decode_image(b"not an image")[0] is None
+
+def test_tracker_reuses_confident_identity_and_smooths_dips():
+    """Identified tracks skip recognition until re-verification; one weak frame does not reject"""
+    import numpy as np
+    from insightface.app.common import Face
+    from app.ai.tracker import FaceTracker
+    tracker = FaceTracker(iou_threshold=0.3, max_missed=2, history=5, reuse_margin=0.1, reverify_frames=3)
+    face = lambda x: Face(bbox=np.array([x, 100, x + 100, 200], dtype=np.float32), kps=None, det_score=0.9)
+
+    (track,) = tracker.update([face(100)])
+    assert not track.reused
+    tracker.observe(track, 7, 0.66, 0.6)
+    assert track.student_id == 7
+    (same,) = tracker.update([face(105)])
+    assert same is track and not same.reused  # matched, but not confident enough to skip
+    tracker.observe(track, 7, 0.55, 0.6)  # dip below threshold is smoothed away
+    assert track.student_id == 7
+    tracker.observe(track, 7, 0.95, 0.6)
+
+    reused = [tracker.update([face(110)])[0].reused for _ in range(3)]
+    assert reused == [True, True, False]  # re-verified on the third frame
+
+    (new_track,) = tracker.update([face(400)])
+    assert new_track is not track and not new_track.reused
+
+def test_detection_cache_tokens_are_single_use_owned_and_expire(monkeypatch):
+    """A /face/detect token works once, only for its creator, and only within the TTL"""
+    import numpy as np
+    from app.ai import detection_cache as cache_module
+    from app.ai.detection_cache import CachedDetection, DetectionCache
+    from app.ai.validator import FaceAnalysisResult
+    cache = DetectionCache(ttl_seconds=60, max_entries=2)
+    entry = lambda: CachedDetection(1, b"jpeg", FaceAnalysisResult(np.zeros((8, 8, 3), dtype=np.uint8), []))
+
+    token = cache.put(entry())
+    assert cache.take(token, user_id=2) is None
+    assert cache.take(token, user_id=1) is not None
+    assert cache.take(token, user_id=1) is None
+
+    first, _, third = cache.put(entry()), cache.put(entry()), cache.put(entry())
+    assert len(cache) == 2 and cache.take(first, 1) is None  # oldest evicted
+
+    now = cache_module.time.monotonic()
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now + 61)
+    assert cache.take(third, 1) is None
+
+def test_detection_tokens_are_redeemable_on_another_worker(monkeypatch, tmp_path):
+    """With a shared directory, any worker can redeem a token, once, for its owner only"""
+    import numpy as np
+    from app.ai import detection_cache as cache_module
+    from app.ai.detection_cache import CachedDetection, DetectionCache
+    from app.ai.validator import FaceAnalysisResult
+    # Two caches stand in for two worker processes
+    detect_worker = DetectionCache(ttl_seconds=60, max_entries=4, shared_dir=str(tmp_path))
+    other_worker = DetectionCache(ttl_seconds=60, max_entries=4, shared_dir=str(tmp_path))
+    analysis = FaceAnalysisResult(np.zeros((8, 8, 3), dtype=np.uint8), [])
+
+    token = detect_worker.put(CachedDetection(1, b"jpeg", analysis))
+    assert other_worker.take(token, user_id=2) is None
+    redeemed = other_worker.take(token, user_id=1)
+    assert redeemed.image_data == b"jpeg" and redeemed.analysis is None
+    assert detect_worker.take(token, user_id=1) is None  # single use across workers
+    assert other_worker.take("../" + token, user_id=1) is None
+
+    token = detect_worker.put(CachedDetection(1, b"jpeg", analysis))
+    assert detect_worker.take(token, user_id=1).analysis is analysis
+    assert other_worker.take(token, user_id=1) is None
+
+    token = detect_worker.put(CachedDetection(1, b"jpeg", analysis))
+    now = cache_module.time.time()
+    monkeypatch.setattr(cache_module.time, "time", lambda: now + 61)
+    assert other_worker.take(token, user_id=1) is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_face_analysis_is_computed_once_and_shared(monkeypatch):
+    """Validation, quality and embedding read one FaceAnalysisResult; the detector runs once"""
+    import numpy as np
+    from insightface.app.common import Face
+    from app.ai import validator
+    calls = {"detect": 0, "align": 0}
+    face = Face(bbox=np.array([20, 20, 180, 180], dtype=np.float32), kps=None, det_score=0.9)
+
+    def fake_detect(image, profile=None, max_num=None, face_policy=None):
+        calls["detect"] += 1
+        return [face]
+
+    def fake_align(image, detected):
+        calls["align"] += 1
+        return np.random.default_rng(1).integers(60, 200, (112, 112, 3), dtype=np.uint8)
+
+    monkeypatch.setattr(validator.face_model, "detect", fake_detect)
+    monkeypatch.setattr(validator.face_model, "align", fake_align)
+    monkeypatch.setattr(validator.face_model, "embed_crops", lambda crops: np.ones((len(crops), 512), dtype=np.float32))
+
+    image = np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+    analysis = validator.analyze_image(image)
+    assert validator.validate_single_face(analysis) == (True, 1)
+    assert validator.assess_face_quality(analysis)[0] == "good"
+    analysis.embedding(0)
+    analysis.embedding(0)
+    assert calls == {"detect": 1, "align": 1}
+
+def test_quality_gate_rejects_before_recognition_with_reason(monkeypatch):
+    """Small, turned, dark or blurry faces are rejected with a reason; recognition never runs"""
+    import numpy as np
+    from insightface.app.common import Face
+    from insightface.utils import face_align
+    from app.ai import validator
+    from app.ai.profiles import QualityThresholds
+    monkeypatch.setattr(validator.get_profile("verify-fast"), "quality", QualityThresholds.parse(
+        "min_face=64,max_yaw=30,max_pitch=30,min_sharpness=25,min_brightness=40,max_brightness=225"
+    ))
+    monkeypatch.setattr(validator.face_model, "embed_crops", lambda crops: pytest.fail("recognition ran"))
+    textured = np.random.default_rng(2).integers(60, 200, (112, 112, 3), dtype=np.uint8)
+    crop = {"image": textured}
+    monkeypatch.setattr(validator.face_model, "align", lambda image, face: crop["image"])
+
+    def analysis(size=160, kps=face_align.arcface_dst):
+        face = Face(bbox=np.array([0, 0, size, size], dtype=np.float32), kps=kps.copy(), det_score=0.9)
+        return validator.FaceAnalysisResult(np.zeros((200, 200, 3), dtype=np.uint8), [face])
+
+    assert validator.check_quality_gate(analysis()) is None
+    assert "too small" in validator.check_quality_gate(analysis(size=40))
+    turned = face_align.arcface_dst.copy()
+    turned[2, 0] += 14  # nose towards one eye
+    assert "sideways" in validator.check_quality_gate(analysis(kps=turned))
+    crop["image"] = np.full((112, 112, 3), 15, dtype=np.uint8)
+    assert "too dark" in validator.check_quality_gate(analysis())
+    crop["image"] = np.full((112, 112, 3), 128, dtype=np.uint8)
+    assert "blurry" in validator.check_quality_gate(analysis())
+    assert validator.assess_face_quality(analysis())[0] == "blurry"
+
+def test_face_policy_limits_detector_and_selects_one_face(monkeypatch):
+    """largest/central policies make the detector keep one face; token analyses select it in Python"""
+    import numpy as np
+    from insightface.app.common import Face
+    from app.ai.insightface_model import InsightFaceModel, DetectionStats
+    from app.ai.profiles import ModelProfile
+    from app.ai.validator import FaceAnalysisResult
+    calls = []
+    class StubDetector:
+        def detect(self, image, input_size=None, max_num=0, metric="default"):
+            calls.append((max_num, metric))
+            return np.array([[10, 10, 60, 60, 0.9]], dtype=np.float32), np.zeros((1, 5, 2), dtype=np.float32)
+    class StubAnalysis:
+        det_model = StubDetector()
+
+    model = InsightFaceModel()
+    monkeypatch.setattr(model, "get_model", lambda: StubAnalysis())
+    monkeypatch.setattr(model, "detection_stats", DetectionStats())
+    image = np.zeros((400, 400, 3), dtype=np.uint8)
+    model.detect(image, ModelProfile("verify-fast", [(320, 320)], face_policy="largest"))
+    model.detect(image, ModelProfile("verify-fast", [(320, 320)], face_policy="largest"), face_policy="central")
+    model.detect(image, ModelProfile("enroll-quality", [(640, 640)]))
+    assert calls == [(1, "max"), (1, "default"), (0, "default")]
+
+    box = lambda x1, y1, size: Face(bbox=np.array([x1, y1, x1 + size, y1 + size], dtype=np.float32), kps=None, det_score=0.9)
+    analysis = FaceAnalysisResult(image, [box(0, 0, 120), box(150, 150, 100)])
+    assert analysis.select_face("all") is None
+    assert analysis.select_face("largest") == 0
+    assert analysis.select_face("central") == 1
+
+def test_stream_socket_returns_results_and_closes_on_errors(monkeypatch):
+    """/face/stream answers each frame; unexpected errors close the socket with 1011"""
+    from types import SimpleNamespace
+    from fastapi.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+    from app.main import app
+    from app.api import face as face_api
+    from app.ai.matcher import EmbeddingGallery
+
+    sessions = []
+    class Session:
+        def close(self):
+            sessions.remove(self)
+    def open_session():
+        sessions.append(Session())
+        return sessions[-1]
+    async def any_scope(class_id, user, db):
+        return None
+    monkeypatch.setattr(face_api, "SessionLocal", open_session)
+    monkeypatch.setattr(face_api, "authenticate_teacher_token", lambda token, db: SimpleNamespace(id=1))
+    monkeypatch.setattr(face_api, "_verify_scope", any_scope)
+    monkeypatch.setattr(face_api, "student_gallery", SimpleNamespace(
+        version=1, ensure_loaded=lambda db: None, searcher=lambda **kwargs: EmbeddingGallery()
+    ))
+    async def no_faces(frame, tracker, gallery):
+        return "No face detected in image", [], 1.0
+    monkeypatch.setattr(face_api.face_service, "verify_tracked_frame", no_faces)
+
+    client = TestClient(app)
+    with client.websocket_connect("/face/stream?token=t") as socket:
+        assert socket.receive_json()["type"] == "ready"
+        assert not sessions  # no DB connection held while the socket is open
+        socket.send_bytes(b"frame")
+        result = socket.receive_json()
+        assert result["type"] == "result" and result["frame"] == 1
+        assert result["success"] is False and result["tracks"] == []
+
+    async def broken(frame, tracker, gallery):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(face_api.face_service, "verify_tracked_frame", broken)
+    with client.websocket_connect("/face/stream?token=t") as socket:
+        socket.receive_json()
+        socket.send_bytes(b"frame")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            socket.receive_json()
+        assert closed.value.code == 1011
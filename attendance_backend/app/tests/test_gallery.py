@@ -0,0 +1,447 @@
+"""Gallery index unit tests (fixtures in conftest.py)"""
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.db import models, crud
+from app.ai.gallery import GalleryIndex
+
+def _vector(seed):
+    return np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+
+def test_gallery_scopes_and_incremental_updates(db):
+    for student_id in (1, 2, 3, 4):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+
+    index = GalleryIndex()
+    index.load(db)
+    assert sorted(index.snapshot(class_id=10).ids.tolist()) == [1, 2]
+    assert sorted(index.snapshot(org_id=1).ids.tolist()) == [1, 2, 3]
+    assert sorted(index.snapshot().ids.tolist()) == [1, 2, 3, 4]
+
+    org_view = index.snapshot(org_id=1)
+    other_view = index.snapshot(class_ids=[20])
+    index.upsert(2, 10, 1, _vector(99))
+    assert index.snapshot(org_id=1) is not org_view
+    assert index.snapshot(class_ids=[20]) is other_view
+    assert index.snapshot(class_id=10).best_match(_vector(99), threshold=0.9)[0] == 2
+
+    index.move(3, 20, 2)
+    assert sorted(index.snapshot(org_id=2).ids.tolist()) == [3, 4]
+    assert len(index.snapshot(class_id=11)) == 0
+
+    index.remove(1)
+    index.remove_class(20)
+    assert sorted(index.snapshot().ids.tolist()) == [2]
+    assert index.get_embedding(4) is None
+
+def test_ivf_index_recall_persistence_and_updates(tmp_path):
+    from app.ai.ann import IVFFlatIndex, AnnGallery, default_nlist
+    from app.ai.matcher import EmbeddingGallery
+    rng = np.random.default_rng(1)
+    ids = np.arange(1, 4001)
+    vectors = rng.standard_normal((4000, 64)).astype(np.float32)
+    exact = EmbeddingGallery(ids, vectors)
+
+    index = IVFFlatIndex(64, default_nlist(4000), nprobe=16)
+    index.train(exact.matrix)
+    index.add(ids, exact.matrix)
+    lookup = lambda found: (found, exact.matrix[found - 1])
+    ann = AnnGallery(index, len(exact), lookup)
+
+    # Probes are noisy copies of gallery entries: the ANN path must find them
+    probes = exact.matrix[:200] + 0.05 * rng.standard_normal((200, 64)).astype(np.float32)
+    hits = sum(ann.search(p, k=1)[0][0] == exact.search(p, k=1)[0][0] for p in probes)
+    assert hits / len(probes) >= 0.95
+
+    index.remove([1])
+    assert all(vid != 1 for vid, _ in ann.search(exact.matrix[0], k=5))
+
+    path = str(tmp_path / "ann.npz")
+    index.save(path)
+    assert [p.name for p in tmp_path.iterdir()] == ["ann.npz"]
+    restored = IVFFlatIndex.load(path)
+    assert len(restored) == len(index) == 3999
+    assert restored.search(exact.matrix[5], 1)[0][0] == 6
+
+def test_ivf_index_search_is_consistent_during_writes():
+    """Scores returned while lists are rewritten belong to the ids they are reported for"""
+    import threading
+    from app.ai.ann import IVFFlatIndex
+    from app.ai.matcher import normalize_embeddings
+    rng = np.random.default_rng(2)
+    vectors = normalize_embeddings(rng.standard_normal((400, 32)).astype(np.float32))
+    ids = np.arange(400)
+    index = IVFFlatIndex(32, 4, nprobe=4)
+    index.train(vectors)
+    index.add(ids[:200], vectors[:200])
+
+    stop = threading.Event()
+    def write():
+        while not stop.is_set():
+            index.add(ids[200:], vectors[200:])
+            index.remove(ids[200:])
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for probe in vectors[rng.choice(400, 300)]:
+            found, scores = index.search(probe, 10)
+            assert np.allclose(scores, vectors[found] @ probe, atol=1e-5)
+    finally:
+        stop.set()
+        writer.join()
+
+def test_gallery_switches_to_ann_for_large_scopes(db, monkeypatch):
+    from app.ai.ann import AnnGallery
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "ann_min_gallery_size", 3)
+    for student_id in (1, 2, 3, 4):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+
+    index = GalleryIndex()
+    index.load(db)
+    assert isinstance(index.searcher(), AnnGallery)
+    assert not isinstance(index.searcher(class_id=10), AnnGallery)
+    assert index.searcher().search(_vector(4), k=1)[0][0] == 4
+
+    # Org scopes filter ANN candidates down to their own classes
+    assert isinstance(index.searcher(org_id=1), AnnGallery)
+    assert 4 not in [vid for vid, _ in index.searcher(org_id=1).search(_vector(4), k=3)]
+
+    index.remove(4)
+    index.upsert(5, 20, 2, _vector(5))
+    assert index.searcher().search(_vector(5), k=1)[0][0] == 5
+
+def test_org_scoped_ann_widens_candidates_and_falls_back_to_exact():
+    from app.ai.ann import AnnGallery
+    from app.ai.matcher import EmbeddingGallery
+    vectors = np.stack([_vector(i) for i in range(1000)])
+
+    class RankedEngine:
+        """Returns ids 0..999 in order; the scope's ids (990+) rank last"""
+        def __init__(self, reachable):
+            self.reachable = reachable
+        def __len__(self):
+            return 1000
+        def search(self, probe, k):
+            ids = np.arange(min(k, self.reachable), dtype=np.int64)
+            return ids, np.zeros(ids.size, dtype=np.float32)
+
+    lookup = lambda ids: (ids, vectors[ids])
+    in_scope = lambda ids: ids >= 990
+    scope = EmbeddingGallery(np.arange(990, 1000), vectors[990:])
+    widened = AnnGallery(RankedEngine(1000), 10, lookup, id_filter=in_scope, rerank_factor=4)
+    assert widened.search(_vector(995), k=1)[0][0] == 995
+
+    # Probed lists never reach the scope: answer from the exact scan instead of nothing
+    capped = AnnGallery(RankedEngine(100), 10, lookup, id_filter=in_scope, rerank_factor=4, exact=lambda: scope)
+    assert capped.search(_vector(995), k=1)[0][0] == 995
+
+def test_lazy_ann_build_runs_once_under_concurrency(db, monkeypatch):
+    import threading
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "ann_min_gallery_size", 3)
+    for student_id in (1, 2, 3, 4):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+    monkeypatch.setattr(settings, "ann_enabled", False)
+    index = GalleryIndex()
+    index.load(db)
+    monkeypatch.setattr(settings, "ann_enabled", True)
+
+    builds = []
+    build = index._build_ann_locked
+    monkeypatch.setattr(index, "_build_ann_locked", lambda: builds.append(1) or build())
+    threads = [threading.Thread(target=index.searcher) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+
+def test_bulk_registration_duplicate_scopes(db, monkeypatch, face_service, face_gallery, embed_probes):
+    import asyncio
+    from app.core.config import settings
+    embed_probes.update({b"a": _vector(1) + 0.1 * _vector(7), b"b": _vector(2), b"b2": _vector(2) + 0.1 * _vector(8)})
+    crud.create_face_embedding(db, 1, _vector(1))
+    face_gallery.load(db)
+
+    # Org scope: student 4 (org 2) may share a face with student 3 (org 1)
+    results = asyncio.run(face_service.register_faces_bulk([(2, b"a"), (3, b"b"), (4, b"b2")], db))
+    assert [ok for _, ok, _ in results] == [False, True, True]
+    assert "already registered" in results[0][2]
+    assert sorted(face_gallery.snapshot().ids.tolist()) == [1, 3, 4]
+
+    # Global scope: the same pair is rejected within the batch
+    monkeypatch.setattr(settings, "duplicate_check_scope", "global")
+    face_gallery.remove(3)
+    face_gallery.remove(4)
+    results = asyncio.run(face_service.register_faces_bulk([(3, b"b"), (4, b"b2")], db))
+    assert [ok for _, ok, _ in results] == [True, False]
+    assert "in this batch" in results[1][2]
+
+def test_bulk_registration_embeds_concurrently_and_scopes_classes_without_org(
+    db, monkeypatch, face_service, face_gallery, embed_probes
+):
+    import asyncio
+    db.add_all([
+        models.Class(id=30, class_name="N1", class_code="N1", teacher_id=1, organization_id=None),
+        models.Class(id=31, class_name="N2", class_code="N2", teacher_id=1, organization_id=None),
+        models.Student(id=5, student_id="s5", full_name="S5", class_id=30),
+        models.Student(id=6, student_id="s6", full_name="S6", class_id=31),
+        models.Student(id=7, student_id="s7", full_name="S7", class_id=30),
+    ])
+    db.commit()
+    embed_probes.update({data: _vector(4) + 0.1 * _vector(len(data)) for data in (b"a", b"bb", b"ccc")})
+    embed = face_service._embed
+    in_flight, peak = [0], [0]
+    async def counting_embed(data, profile="verify-fast"):
+        in_flight[0] += 1
+        peak[0] = max(peak[0], in_flight[0])
+        await asyncio.sleep(0)
+        in_flight[0] -= 1
+        return await embed(data, profile)
+    monkeypatch.setattr(face_service, "_embed", counting_embed)
+    crud.create_face_embedding(db, 4, _vector(4))
+    face_gallery.load(db)
+
+    # Classes without an organization are their own duplicate scope, not the whole gallery
+    results = asyncio.run(face_service.register_faces_bulk([(5, b"a"), (6, b"bb"), (7, b"ccc")], db))
+    assert [(sid, ok) for sid, ok, _ in results] == [(5, True), (6, True), (7, False)]
+    assert "in this batch" in results[2][2]
+    assert peak[0] == 3
+
+def test_group_recognition_marks_attendance_in_bulk(db, monkeypatch, face_service, face_gallery):
+    import asyncio
+    from app.services import face_service as face_service_module
+    from app.services.attendance_service import AttendanceService
+    for student_id in (1, 2):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+    face_gallery.load(db)
+
+    # Two faces of student 1 (one is weaker) and a stranger
+    probes = np.stack([_vector(1) + 0.1 * _vector(7), _vector(1) + 0.3 * _vector(8), _vector(50)])
+    boxes = [{"box": [0.0, 0.0, 10.0, 10.0], "det_score": 0.9} for _ in range(3)]
+    monkeypatch.setattr(face_service_module, "align_all_faces", lambda data: (boxes, [None] * 3, "3 face(s) detected"))
+    async def fake_embed_many(crops):
+        return probes
+    monkeypatch.setattr(face_service_module.recognition_batcher, "embed_many", fake_embed_many)
+
+    success, _, matches, unmatched, _ = asyncio.run(face_service.recognize_group([b"photo"], 10, db))
+    assert success and [m["student_id"] for m in matches] == [1]
+    assert len(unmatched) == 2
+
+    attendance = AttendanceService()
+    monkeypatch.setattr(attendance, "_determine_status", lambda now, settings: "present")
+    monkeypatch.setattr(attendance, "_get_settings_for_class", lambda class_id, db: {
+        "allow_late_arrivals": True, "multiple_checkins": False, "school_start_time": None,
+    })
+    results = asyncio.run(attendance.mark_attendance_bulk([(1, 10, 0.9), (3, 10, 0.8), (1, 10, 0.9)], db))
+    assert [ok for _, ok, _ in results] == [True, False, False]
+    assert len(crud.get_attendance_today(db, class_id=10)) == 1
+
+def test_verify_faces_batch_shares_one_snapshot(db, face_service, face_gallery, embed_probes):
+    import asyncio
+    for student_id in (1, 2, 3):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+    face_gallery.load(db)
+    embed_probes.update({b"s2": _vector(2), b"stranger": _vector(60), b"blank": (None, "No face detected in image")})
+
+    threshold, results = asyncio.run(face_service.verify_faces_batch([b"s2", b"stranger", b"blank"], db, class_id=10))
+    assert [(ok, sid) for ok, _, sid, _ in results] == [(True, 2), (False, None), (False, None)]
+    assert results[2][1] == "No face detected in image"
+
+def test_workers_share_one_memory_mapped_gallery(db, monkeypatch, tmp_path):
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "gallery_shared_dir", str(tmp_path / "gallery"))
+    monkeypatch.setattr(settings, "gallery_shared_poll_seconds", 0.0)
+    for student_id in (1, 2, 3, 4):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+
+    # Two GalleryIndex instances stand in for two worker processes
+    first, second = GalleryIndex(), GalleryIndex()
+    first.load(db)
+    second.load(db)
+    mapped = second._mapped.vectors
+    assert np.shares_memory(second.snapshot(class_id=10).matrix, mapped)
+    assert np.shares_memory(second.snapshot(org_id=1).matrix, mapped)
+    assert sorted(second.snapshot(org_id=1).ids.tolist()) == [1, 2, 3]
+
+    first.upsert(2, 10, 1, _vector(99))
+    first.move(3, 20, 2)
+    assert second.snapshot(class_id=10).best_match(_vector(99), threshold=0.9)[0] == 2
+    assert sorted(second.snapshot(org_id=2).ids.tolist()) == [3, 4]
+
+    # A batch is published once, not once per student
+    published = []
+    publish = first._shared.publish
+    monkeypatch.setattr(first._shared, "publish", lambda *args: published.append(1) or publish(*args))
+    first.upsert_many([(2, 10, 1, _vector(99)), (4, 20, 2, _vector(4))])
+    assert len(published) == 1
+
+    # A write in the second worker starts from the first worker's latest version
+    second.remove(1)
+    assert sorted(first.snapshot().ids.tolist()) == [2, 3, 4]
+    assert first.get_embedding(2) @ _vector(99) / np.linalg.norm(_vector(99)) > 0.99
+
+def test_gallery_snapshot_restores_and_replays_changes(db, monkeypatch, tmp_path):
+    from datetime import datetime, timedelta
+    from app.core.config import settings
+    from app.ai import gallery as gallery_module
+    monkeypatch.setattr(settings, "gallery_snapshot_path", str(tmp_path / "gallery.npz"))
+    monkeypatch.setattr(settings, "gallery_snapshot_delay_seconds", 3600.0)
+    for student_id in (1, 2, 3):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+    # Rows older than the snapshot's replay margin are taken from the snapshot
+    for student_id, age in [(1, 1), (2, 2), (3, 2)]:
+        row = crud.get_face_embedding(db, student_id)
+        row.updated_at = datetime(2026, 1, 10) - timedelta(days=age)
+    db.commit()
+
+    index = GalleryIndex()
+    index.load(db)
+    index.save_snapshot(db)
+
+    # Changes made while no worker was running
+    crud.delete_face_embedding(db, 1)
+    crud.create_face_embedding(db, 4, _vector(4))
+    db.query(models.Student).filter(models.Student.id == 2).update({models.Student.class_id: 20})
+    db.commit()
+
+    decoded = []
+    decode = gallery_module.decode_stored_embedding
+    monkeypatch.setattr(gallery_module, "decode_stored_embedding", lambda row: decoded.append(row.student_id) or decode(row))
+    restored = GalleryIndex()
+    restored.load(db)
+    assert decoded == [4]
+    assert sorted(restored.snapshot().ids.tolist()) == [2, 3, 4]
+    assert sorted(restored.snapshot(org_id=2).ids.tolist()) == [2, 4]
+    assert restored.snapshot(org_id=2).best_match(_vector(2), threshold=0.99)[0] == 2
+
+def test_binary_embedding_migration_keeps_defaults_and_verifies_before_clearing_json(monkeypatch, tmp_path):
+    import json
+    import sqlite3
+    import migrate_binary_embeddings
+    from app.utils.embedding_blob import embedding_to_blob
+    path = tmp_path / "legacy.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    conn = sqlite3.connect(path)
+    for table, owner in [("face_embeddings", "student_id"), ("teacher_face_embeddings", "teacher_id")]:
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, {owner} INTEGER NOT NULL UNIQUE, "
+                     f"embedding TEXT NOT NULL, created_at DATETIME, updated_at DATETIME)")
+    conn.execute("INSERT INTO face_embeddings (student_id, embedding) VALUES (1, ?)", (json.dumps(_vector(1).tolist()),))
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(migrate_binary_embeddings, "db_path", str(path))
+    migrate_binary_embeddings.migrate()
+
+    session = sessionmaker(bind=engine)()
+    session.add(models.Student(id=2, student_id="s2", full_name="S2", class_id=1))
+    session.commit()
+    row = crud.create_face_embedding(session, 2, _vector(2))
+    assert row.created_at is not None and row.updated_at is not None
+    assert crud.get_face_embedding(session, 1).embedding_blob is not None
+    session.close()
+
+    # JSON is kept until --clear-json has verified every blob
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT embedding FROM face_embeddings WHERE student_id = 1").fetchone()[0] is not None
+    good_blob = conn.execute("SELECT embedding_blob FROM face_embeddings WHERE student_id = 1").fetchone()[0]
+    conn.execute("UPDATE face_embeddings SET embedding_blob = ? WHERE student_id = 1", (embedding_to_blob(_vector(3)),))
+    conn.commit()
+    migrate_binary_embeddings.migrate(clear_json=True)
+    assert conn.execute("SELECT embedding FROM face_embeddings WHERE student_id = 1").fetchone()[0] is not None
+    conn.execute("UPDATE face_embeddings SET embedding_blob = ? WHERE student_id = 1", (good_blob,))
+    conn.commit()
+    migrate_binary_embeddings.migrate(clear_json=True)
+    assert conn.execute("SELECT embedding FROM face_embeddings WHERE student_id = 1").fetchone()[0] is None
+    conn.close()
+
+def test_gallery_skips_templates_from_another_model(db):
+    from app.ai.embedding import embedding_to_blob
+    crud.create_face_embedding(db, 1, _vector(1))
+    crud.create_face_embedding(db, 2, _vector(2))
+    row = db.query(models.FaceEmbedding).filter(models.FaceEmbedding.student_id == 2).first()
+    row.embedding_blob = embedding_to_blob(_vector(2), model_name="antelopev2")
+    db.commit()
+
+    index = GalleryIndex()
+    index.load(db)
+    assert index.snapshot().ids.tolist() == [1]
+
+def test_verify_signed_device_embedding(db, monkeypatch, face_service, face_gallery):
+    import asyncio
+    import time
+    from app.ai.embedding import embedding_to_blob
+    from app.core.config import settings
+    from app.core.security import sign_embedding, verify_embedding_signature
+    monkeypatch.setattr(settings, "device_embedding_secret", "kiosk-secret")
+    crud.create_face_embedding(db, 1, _vector(1))
+    face_gallery.load(db)
+
+    blob = embedding_to_blob(_vector(1) + 0.1 * _vector(9))
+    now = int(time.time())
+    assert verify_embedding_signature(blob, now, sign_embedding(blob, now))
+    assert not verify_embedding_signature(blob, now, sign_embedding(blob + b"x", now))
+    assert not verify_embedding_signature(blob, now - 3600, sign_embedding(blob, now - 3600))
+
+    success, _, student_id, _, _ = asyncio.run(face_service.verify_embedding(blob, db, class_id=10))
+    assert success and student_id == 1
+    foreign = embedding_to_blob(_vector(1), model_name="antelopev2")
+    success, message, _, _, _ = asyncio.run(face_service.verify_embedding(foreign, db, class_id=10))
+    assert not success and "does not match" in message
+
+def test_teacher_gallery_partitions_by_org_and_face_login_claims(db, monkeypatch, fake_embed, embed_probes):
+    """Face-login searches one org, or compares 1:1 with a claimed teacher"""
+    import asyncio
+    from app.ai.gallery import TeacherGalleryIndex
+    from app.services import teacher_face_service as module
+    db.add(models.Teacher(id=2, teacher_id="t2", full_name="U", email="u@x.io", password_hash="x", organization_id=2))
+    db.commit()
+    crud.create_teacher_face_embedding(db, 1, _vector(1))
+    crud.create_teacher_face_embedding(db, 2, _vector(2))
+    index = TeacherGalleryIndex()
+    index.load(db)
+    assert len(index.partition(1)) == 1 and len(index.partition(2)) == 1 and len(index.searcher()) == 2
+
+    monkeypatch.setattr(module, "teacher_gallery", index)
+    monkeypatch.setattr(module, "embed_image_bytes", fake_embed)
+    embed_probes[b""] = _vector(2) / np.linalg.norm(_vector(2))
+    service = module.TeacherFaceService()
+
+    assert asyncio.run(service.verify_face_id(b"", db))[2] == 2
+    assert asyncio.run(service.verify_face_id(b"", db, org_id=2))[2] == 2
+    assert asyncio.run(service.verify_face_id(b"", db, org_id=1))[0] is False
+    assert asyncio.run(service.verify_face_id(b"", db, teacher_id=1))[:2] == (False, "Face not recognized")
+    db.add(models.Teacher(id=3, teacher_id="t3", full_name="V", email="v@x.io", password_hash="x", organization_id=1))
+    db.commit()
+    assert asyncio.run(service.verify_face_id(b"", db, teacher_id=3))[:2] == (False, "Face not recognized")
+    assert asyncio.run(service.verify_face_id(b"", db, teacher_id=2))[2] == 2
+
+    index.move(2, 1)
+    assert len(index.partition(1)) == 2 and len(index.partition(2)) == 0
+    index.remove(2)
+    assert index.get_embedding(2) is None and len(index.searcher()) == 1
+
+def test_verify_claimed_student_is_one_to_one(db, monkeypatch, face_service, face_gallery, embed_probes):
+    """A student_id claim compares only with that template, at the claim threshold"""
+    import asyncio
+    from app.core.config import settings
+    monkeypatch.setattr(settings, "face_claim_threshold", 0.8)
+    for student_id in (1, 2):
+        crud.create_face_embedding(db, student_id, _vector(student_id))
+    face_gallery.load(db)
+
+    probe = _vector(2) + 0.6 * _vector(7)  # similarity to student 2 about 0.86
+    embed_probes[b""] = probe / np.linalg.norm(probe)
+    monkeypatch.setattr(face_gallery, "searcher", lambda **kwargs: pytest.fail("claim searched the gallery"))
+
+    success, _, student_id, score, threshold = asyncio.run(face_service.verify_face(b"", db, claimed_student_id=2))
+    assert success and student_id == 2 and threshold == 0.8 and score > 0.8
+    success, message, _, _, _ = asyncio.run(face_service.verify_face(b"", db, claimed_student_id=1))
+    assert not success and "selected student" in message
+    success, message, _, _, _ = asyncio.run(face_service.verify_face(b"", db, claimed_student_id=3))
+    assert not success and message == "No face enrolled for this student"
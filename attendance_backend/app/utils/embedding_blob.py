@@ -0,0 +1,48 @@
+"""Binary storage format for face embeddings (no model or image dependencies)"""
+import struct
+from typing import Optional, Tuple
+import numpy as np
+from ..core.config import settings
+
+# Binary embedding layout: fixed header, model name, zero padding up to a
+# 16-byte boundary, then raw little-endian float32 values (L2-normalized).
+EMBEDDING_BLOB_MAGIC = b"FEMB"
+EMBEDDING_BLOB_VERSION = 1
+EMBEDDING_DTYPE_CODES = {1: np.dtype("<f4")}
+_HEADER = struct.Struct("<4sBBHB")
+
+def normalize_embedding(embedding: np.ndarray) -> np.ndarray:
+    """Return a contiguous L2-normalized float32 copy of an embedding"""
+    vector = np.asarray(embedding, dtype=np.float32).ravel().copy()
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+def embedding_to_blob(embedding: np.ndarray, model_name: Optional[str] = None) -> bytes:
+    """Serialize an embedding to the compact binary storage format"""
+    vector = normalize_embedding(embedding).astype("<f4", copy=False)
+    name = (model_name or settings.insightface_model_name).encode("ascii")[:255]
+    header = _HEADER.pack(EMBEDDING_BLOB_MAGIC, EMBEDDING_BLOB_VERSION, 1, vector.shape[0], len(name)) + name
+    header += b"\x00" * (-len(header) % 16)
+    return header + vector.tobytes()
+
+def read_blob_header(blob: bytes) -> Tuple[str, int, int]:
+    """Parse a binary embedding header
+
+    Returns:
+        Tuple[model_name, dim, data_offset]
+    """
+    magic, version, dtype_code, dim, name_len = _HEADER.unpack_from(blob, 0)
+    if magic != EMBEDDING_BLOB_MAGIC or version != EMBEDDING_BLOB_VERSION:
+        raise ValueError("Unrecognized embedding blob header")
+    if dtype_code not in EMBEDDING_DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype code: {dtype_code}")
+    name_end = _HEADER.size + name_len
+    model_name = bytes(blob[_HEADER.size:name_end]).decode("ascii")
+    return model_name, dim, name_end + (-name_end % 16)
+
+def embedding_from_blob(blob: bytes) -> np.ndarray:
+    """Read a binary embedding without copying (returns a read-only view)"""
+    _, dim, offset = read_blob_header(blob)
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE_CODES[1], count=dim, offset=offset)
@@ -49,6 +49,63 @@ def validate_image_format(image_bytes: bytes) -> Tuple[bool, str]:
     except Exception as e:
         return False, f"Invalid image file: {str(e)}"
 
+# JPEG can be decoded straight to 1/2, 1/4 or 1/8 scale in the DCT domain
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+_EXIF_ORIENTATION = 0x0112
+
+def decode_image(image_bytes: bytes, max_size: int = 1024) -> Tuple[Optional[np.ndarray], str, float]:
+    """Validate and decode an upload in a single pass to roughly max_size
+
+    The header is read with PIL without decoding pixels. JPEGs are then
+    decoded by libjpeg at the largest 1/2, 1/4 or 1/8 reduction that keeps
+    the long side at or above 3/4 of max_size, so a 12 MP photo never exists
+    at full resolution. The BGR->RGB swap is done in place, and an INTER_AREA
+    resize only runs when the reduced image is still larger than max_size.
+
+    Returns:
+        Tuple[RGB image or None, message, scale] where scale is original pixels per decoded pixel
+    """
+    try:
+        header = Image.open(io.BytesIO(image_bytes))
+        image_format = header.format
+        width, height = header.size
+        orientation = header.getexif().get(_EXIF_ORIENTATION, 1)
+    except Exception as e:
+        return None, f"Invalid image file: {str(e)}", 1.0
+    
+    if image_format not in ['JPEG', 'PNG', 'JPG']:
+        return None, "Unsupported image format. Please use JPEG or PNG", 1.0
+    if width < 100 or height < 100:
+        return None, "Image too small. Minimum size is 100x100 pixels", 1.0
+    if width > 4000 or height > 4000:
+        return None, "Image too large. Maximum size is 4000x4000 pixels", 1.0
+    
+    reduction = 1
+    if image_format == 'JPEG':
+        for factor in (8, 4, 2):
+            if max(width, height) / factor >= max_size * 0.75:
+                reduction = factor
+                break
+    
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), _REDUCED_DECODE_FLAGS[reduction])
+    if image is None:
+        return None, "Failed to process image", 1.0
+    
+    # Convert BGR to RGB in place (InsightFace is fed RGB throughout this backend)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    
+    if max(image.shape[:2]) > max_size:
+        image = resize_image_if_needed(image, max_size=max_size)
+    # imdecode applies EXIF orientation; 5-8 are transposed, so the upright width is the header height
+    upright_width = height if orientation in (5, 6, 7, 8) else width
+    return image, "Image decoded", upright_width / image.shape[1]
+
 def resize_image_if_needed(image: np.ndarray, max_size: int = 1024) -> np.ndarray:
     """Resize image if it's too large while maintaining aspect ratio"""
     height, width = image.shape[:2]
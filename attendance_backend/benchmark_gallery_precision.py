@@ -0,0 +1,91 @@
+"""Recall and latency of gallery precisions (float32 / float16 / int8) against the cosine_similarity loop
+
+Uses synthetic 512-d templates: every probe is a noisy view of one gallery
+entry (similarity around --match-similarity, 0.7 is typical for a live
+capture against its enrollment; lower values make recall harder).
+Recall is measured against the exact float32 top-1 and the true identity.
+
+    python benchmark_gallery_precision.py --size 100000 --probes 200
+"""
+import argparse
+import time
+import numpy as np
+from app.core.config import settings
+from app.ai.matcher import EmbeddingGallery, cosine_similarity, normalize_embeddings
+
+def make_data(size: int, probes: int, dim: int, match_similarity: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    gallery = normalize_embeddings(rng.standard_normal((size, dim)).astype(np.float32))
+    truth = rng.choice(size, probes, replace=False)
+    noise = normalize_embeddings(rng.standard_normal((probes, dim)).astype(np.float32))
+    noise -= np.einsum("ij,ij->i", noise, gallery[truth])[:, None] * gallery[truth]
+    noise = normalize_embeddings(noise)
+    queries = normalize_embeddings(match_similarity * gallery[truth] + np.sqrt(1 - match_similarity ** 2) * noise)
+    return gallery, queries, truth
+
+def time_probes(search, queries: np.ndarray) -> tuple:
+    """(results, median ms per probe)"""
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        timings.append((time.perf_counter() - start) * 1000)
+    return results, float(np.median(timings))
+
+def cosine_loop_search(vectors: np.ndarray, ids: np.ndarray):
+    # The original per-candidate matching path
+    def search(query):
+        best_id, best = None, -1.0
+        for vid, vector in zip(ids.tolist(), vectors):
+            similarity = cosine_similarity(query, vector)
+            if similarity > best:
+                best_id, best = vid, similarity
+        return [(best_id, best)]
+    return search
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=50000, help="gallery size")
+    parser.add_argument("--probes", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--match-similarity", type=float, default=0.7)
+    parser.add_argument("--rerank", type=int, default=settings.gallery_rerank_candidates, help="float32 re-rank candidates")
+    parser.add_argument("--loop-probes", type=int, default=10, help="probes for the (slow) cosine_similarity loop")
+    args = parser.parse_args()
+    settings.gallery_rerank_candidates = args.rerank
+
+    vectors, queries, truth = make_data(args.size, args.probes, args.dim, args.match_similarity)
+    ids = np.arange(args.size, dtype=np.int64)
+    exact = EmbeddingGallery(ids, vectors, normalized=True)
+    reference, _ = time_probes(lambda q: exact.search(q, k=1), queries)
+    reference_ids = np.array([r[0][0] for r in reference])
+
+    print(f"Gallery: {args.size} x {args.dim}, {args.probes} probes, re-rank {args.rerank}")
+    print(f"{'mode':<18}{'scan MB':>10}{'ms/probe':>10}{'probes/s (batch)':>18}{'recall@1':>10}{'identity':>10}{'max |dsim|':>12}")
+
+    loop_queries = queries[:args.loop_probes]
+    results, latency = time_probes(cosine_loop_search(vectors, ids), loop_queries)
+    found = np.array([r[0][0] for r in results])
+    print(f"{'cosine_similarity':<18}{vectors.nbytes / 2**20:>10.1f}{latency:>10.2f}{'-':>18}"
+          f"{np.mean(found == reference_ids[:len(found)]):>10.3f}{np.mean(found == truth[:len(found)]):>10.3f}{'-':>12}")
+
+    for precision in ("float32", "float16", "int8"):
+        start = time.perf_counter()
+        searcher = exact.compressed(precision)
+        build_ms = (time.perf_counter() - start) * 1000
+        results, latency = time_probes(lambda q: searcher.search(q, k=1), queries)
+        start = time.perf_counter()
+        searcher.search_many(queries, k=1)
+        throughput = len(queries) / (time.perf_counter() - start)
+
+        found = np.array([r[0][0] for r in results])
+        scores = np.array([r[0][1] for r in results])
+        exact_scores = np.einsum("ij,ij->i", vectors[found], queries)
+        scanned = getattr(searcher, "nbytes", vectors.nbytes)
+        print(f"{precision:<18}{scanned / 2**20:>10.1f}{latency:>10.2f}{throughput:>18.0f}"
+              f"{np.mean(found == reference_ids):>10.3f}{np.mean(found == truth):>10.3f}"
+              f"{np.max(np.abs(scores - exact_scores)):>12.2e}"
+              + (f"   (built in {build_ms:.0f} ms)" if precision != "float32" else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Move face embeddings from JSON text to the compact binary column
+
+    python migrate_binary_embeddings.py               # add and fill embedding_blob, keep the JSON
+    python migrate_binary_embeddings.py --clear-json  # verify every blob, then drop the JSON text
+
+The first run leaves the legacy JSON column untouched, so a bad encode can
+be undone by clearing embedding_blob. --clear-json only clears the JSON once
+every row's blob decodes to the same vector; otherwise nothing is cleared.
+"""
+import sqlite3
+import os
+import sys
+import json
+import numpy as np
+from app.utils.embedding_blob import embedding_to_blob, embedding_from_blob, normalize_embedding
+
+# Get the database path
+db_path = os.path.join(os.path.dirname(__file__), 'attendance.db')
+
+TABLES = {
+    "face_embeddings": ("student_id", "students"),
+    "teacher_face_embeddings": ("teacher_id", "teachers"),
+}
+
+def _rebuild_table(cursor, table, owner_column, owner_table):
+    """Recreate the table with a nullable legacy JSON column and a BLOB column"""
+    cursor.execute(f"""
+        CREATE TABLE {table}_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            {owner_column} INTEGER NOT NULL UNIQUE,
+            embedding TEXT,
+            embedding_blob BLOB,
+            created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+            updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+            FOREIGN KEY ({owner_column}) REFERENCES {owner_table} (id)
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO {table}_new (id, {owner_column}, embedding, created_at, updated_at)
+        SELECT id, {owner_column}, embedding, created_at, updated_at FROM {table}
+    """)
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_id ON {table} (id)")
+
+def _backfill(cursor, table):
+    cursor.execute(f"SELECT id, embedding FROM {table} WHERE embedding_blob IS NULL AND embedding IS NOT NULL")
+    rows = cursor.fetchall()
+    for row_id, embedding_json in rows:
+        blob = embedding_to_blob(json.loads(embedding_json))
+        cursor.execute(
+            f"UPDATE {table} SET embedding_blob = ? WHERE id = ?",
+            (sqlite3.Binary(blob), row_id)
+        )
+    return len(rows)
+
+def _mismatched_rows(cursor, table):
+    """Ids of rows whose blob is missing or does not decode to their JSON embedding"""
+    cursor.execute(f"SELECT id, embedding, embedding_blob FROM {table} WHERE embedding IS NOT NULL")
+    mismatched = []
+    for row_id, embedding_json, blob in cursor.fetchall():
+        try:
+            expected = normalize_embedding(json.loads(embedding_json))
+            if blob is None or not np.allclose(embedding_from_blob(bytes(blob)), expected, atol=1e-6):
+                mismatched.append(row_id)
+        except Exception:
+            mismatched.append(row_id)
+    return mismatched
+
+def _clear_json(cursor, table):
+    cursor.execute(f"UPDATE {table} SET embedding = NULL WHERE embedding IS NOT NULL AND embedding_blob IS NOT NULL")
+    return cursor.rowcount
+
+def migrate(clear_json=False):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        for table, (owner_column, owner_table) in TABLES.items():
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+            if cursor.fetchone() is None:
+                print(f"{table} does not exist. Skipping.")
+                continue
+
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = {column[1]: column for column in cursor.fetchall()}
+            if 'embedding_blob' not in columns or columns['embedding'][3]:
+                print(f"Rebuilding {table} with binary embedding column...")
+                _rebuild_table(cursor, table, owner_column, owner_table)
+
+            converted = _backfill(cursor, table)
+            print(f"Converted {converted} row(s) in {table}")
+        conn.commit()
+
+        if not clear_json:
+            print("✅ Migration completed successfully! The JSON column is kept; run with --clear-json once verified")
+            return
+
+        present = [t for t in TABLES if cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (t,)).fetchone()]
+        mismatched = {table: _mismatched_rows(cursor, table) for table in present}
+        if any(mismatched.values()):
+            for table, row_ids in mismatched.items():
+                if row_ids:
+                    print(f"❌ {len(row_ids)} row(s) in {table} do not match their JSON embedding: {row_ids[:10]}")
+            print("JSON embeddings were not cleared")
+            return
+        for table in present:
+            print(f"Cleared JSON from {_clear_json(cursor, table)} verified row(s) in {table}")
+        conn.commit()
+        # Reclaim the space freed by the JSON text
+        conn.execute("VACUUM")
+        print("✅ JSON embeddings cleared")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    migrate(clear_json="--clear-json" in sys.argv[1:])